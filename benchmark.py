@@ -0,0 +1,872 @@
+#!/usr/bin/env python
+
+"""
+    Benchmarks of yawpl client methods against a local fake WordPress
+    XML-RPC server, no live blog needed.
+
+    Every client method is run in every transport mode and reported with
+    throughput, p50/p99 latency and peak memory. Save a run with --save
+    and check a later one with --compare, which exits with status 1 when
+    a case got slower than the tolerance allows.
+
+        python benchmark.py
+        python benchmark.py --latency 20 --threads 4 --cases getPost,newPost
+        python benchmark.py --save baseline.json
+        python benchmark.py --compare baseline.json --tolerance 0.25
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import socket
+import tempfile
+import threading
+import cPickle as pickle
+import xmlrpclib
+import SocketServer
+import SimpleXMLRPCServer
+from StringIO import StringIO
+from optparse import OptionParser
+
+import yawpl
+
+USER = 'admin'
+PASSWORD = 'secret'
+
+class _FakeRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler): #{{{
+    """Keep-alive request handler accepting chunked request bodies, with
+    latency and HTTP error injection
+    """
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/xmlrpc.php', '/RPC2')
+
+    def do_POST(self): #{{{
+        blog = self.server.blog
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0], 16)
+                if not size:
+                    # trailers end with an empty line
+                    while self.rfile.readline().strip():
+                        pass
+                    break
+                body.append(self.rfile.read(size))
+                self.rfile.readline()
+        else:
+            body = [self.rfile.read(int(self.headers['content-length']))]
+        body = ''.join(body)
+        if blog.latency:
+            time.sleep(blog.latency)
+        if blog.httpErrorRate and blog.random() < blog.httpErrorRate:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        # hand the buffered body to the stock implementation
+        self.headers['content-length'] = str(len(body))
+        rfile, self.rfile = self.rfile, StringIO(body)
+        try:
+            SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.do_POST(self)
+        finally:
+            self.rfile = rfile
+    #}}}
+#}}}
+
+class _FakeServer(SocketServer.ThreadingMixIn,
+                  SimpleXMLRPCServer.SimpleXMLRPCServer): #{{{
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        SimpleXMLRPCServer.SimpleXMLRPCServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+
+    def process_request(self, request, clientAddress):
+        self.connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request,
+                                                    clientAddress)
+
+    def shutdown_request(self, request):
+        self.connections.discard(request)
+        SimpleXMLRPCServer.SimpleXMLRPCServer.shutdown_request(self, request)
+
+    def closeConnections(self):
+        """End keep-alive connections the clients left open
+        """
+        for request in list(self.connections):
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def handle_error(self, request, clientAddress):
+        # clients dropping connections after injected errors are expected
+        if not isinstance(sys.exc_info()[1], socket.error):
+            SimpleXMLRPCServer.SimpleXMLRPCServer.handle_error(self, request,
+                                                            clientAddress)
+#}}}
+
+class _FakeServer6(_FakeServer): #{{{
+    address_family = socket.AF_INET6
+#}}}
+
+class FakeWordPressServer(object): #{{{
+    """In-process stand-in for a WordPress XML-RPC endpoint. Holds posts,
+    comments, categories and tags in memory and implements the methods
+    used by WordPressClient.
+
+    latency is added to every HTTP request in seconds, postSize is the
+    length of post content, faultRate and httpErrorRate are the fractions
+    of calls answered with an XML-RPC fault or an HTTP 503 response.
+    """
+    def __init__(self, posts=1000, comments=1000, categories=50, tags=100,
+                 postSize=2000, latency=0.0, faultRate=0.0, httpErrorRate=0.0,
+                 multicall=True, seed=0):
+        self.latency = latency
+        self.faultRate = faultRate
+        self.httpErrorRate = httpErrorRate
+        self.multicall = multicall
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        words = ('lorem ipsum dolor sit amet consectetur adipiscing elit '
+                 'sed do eiusmod tempor incididunt ut labore et dolore ')
+        self._content = (words * (postSize // len(words) + 1))[:postSize]
+        self.categories = [self._category(i) for i in range(1, categories + 1)]
+        self.tags = [self._tag(i) for i in range(1, tags + 1)]
+        self.posts = {}
+        for i in range(1, posts + 1):
+            self.posts[i] = self._post(i, 'Post %d' % i, self._content)
+        self.comments = [self._comment(i, self._random.randint(1, max(posts, 1)))
+                         for i in range(1, comments + 1)]
+        self.nextPostId = posts + 1
+        self.calls = {}
+        self._methods = {
+            'blogger.getUsersBlogs'             : self.getUsersBlogs,
+            'blogger.getUserInfo'               : self.getUserInfo,
+            'blogger.deletePost'                : self.deletePost,
+            'metaWeblog.getPost'                : self.getPost,
+            'metaWeblog.getRecentPosts'         : self.getRecentPosts,
+            'metaWeblog.newPost'                : self.newPost,
+            'metaWeblog.editPost'               : self.editPost,
+            'metaWeblog.newMediaObject'         : self.newMediaObject,
+            'wp.uploadFile'                     : self.newMediaObject,
+            'mt.getPostCategories'              : self.getPostCategories,
+            'mt.setPostCategories'              : self.setPostCategories,
+            'mt.publishPost'                    : self.publishPost,
+            'mt.getTrackbackPings'              : self.getTrackbackPings,
+            'mt.supportedMethods'               : self.supportedMethods,
+            'pingback.extensions.getPingbacks'  : self.getPingbacks,
+            'wp.getPosts'                       : self.wpGetPosts,
+            'mt.getRecentPostTitles'            : self.getRecentPostTitles,
+            'wp.getCategories'                  : self.getCategories,
+            'wp.newCategory'                    : self.newCategory,
+            'wp.deleteCategory'                 : self.deleteCategory,
+            'wp.suggestCategories'              : self.suggestCategories,
+            'wp.getTags'                        : self.getTags,
+            'wp.newTerm'                        : self.newTerm,
+            'wp.getComment'                     : self.getComment,
+            'wp.getComments'                    : self.getComments,
+            'wp.newComment'                     : self.newComment,
+            'wp.editComment'                    : self.editComment,
+        }
+
+    requestHandler = _FakeRequestHandler
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def start(self, port=0, host='127.0.0.1'): #{{{
+        """Start serving in a background thread, return endpoint url
+        """
+        serverClass = ':' in host and _FakeServer6 or _FakeServer
+        server = serverClass((host, port), self.requestHandler,
+                             logRequests=False, allow_none=True)
+        server.blog = self
+        server.register_instance(self)
+        if self.multicall:
+            server.register_multicall_functions()
+        thread = threading.Thread(target=server.serve_forever,
+                                  name='fake-wordpress')
+        thread.daemon = True
+        thread.start()
+        self._server = server
+        return self.url
+    #}}}
+
+    def stop(self): #{{{
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.closeConnections()
+            self._server.server_close()
+            self._server = None
+    #}}}
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        if ':' in host:
+            host = '[%s]' % host
+        return 'http://%s:%d/xmlrpc.php' % (host, port)
+
+    def _dispatch(self, method, params): #{{{
+        """Called by SimpleXMLRPCServer for every method and every call of
+        a system.multicall
+        """
+        function = self._methods.get(method)
+        if function is None:
+            raise xmlrpclib.Fault(-32601, 'server error. requested method '
+                                  '%s does not exist.' % method)
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.faultRate and self.random() < self.faultRate:
+            raise xmlrpclib.Fault(500, 'Injected fault')
+        return function(*params)
+    #}}}
+
+    def _check(self, user, password): #{{{
+        if user != USER or password != PASSWORD:
+            raise xmlrpclib.Fault(403, 'Bad login/pass combination.')
+    #}}}
+
+    def _post(self, postId, title, content): #{{{
+        date = xmlrpclib.DateTime('2009%02d%02dT%02d:%02d:00' % (
+            postId % 12 + 1, postId % 28 + 1, postId % 24, postId % 60))
+        return {
+            'postid'            : str(postId),
+            'title'             : title,
+            'description'       : content,
+            'mt_text_more'      : '',
+            'mt_excerpt'        : '',
+            'mt_keywords'       : '',
+            'mt_allow_comments' : 1,
+            'mt_allow_pings'    : 1,
+            'dateCreated'       : date,
+            'date_modified'     : date,
+            'userid'            : '1',
+            'link'              : 'http://example.com/?p=%d' % postId,
+            'permaLink'         : 'http://example.com/?p=%d' % postId,
+            'categories'        : [self.categories[postId % len(self.categories)]
+                                   ['categoryName']] if self.categories else [],
+            'post_status'       : 'publish',
+            'wp_slug'           : 'post-%d' % postId,
+        }
+    #}}}
+
+    def _category(self, categoryId): #{{{
+        return {
+            'categoryId'            : str(categoryId),
+            'parentId'              : str(categoryId // 10),
+            'categoryName'          : 'Category %d' % categoryId,
+            'categoryDescription'   : '',
+            'htmlUrl'               : 'http://example.com/?cat=%d' % categoryId,
+            'rssUrl'                : 'http://example.com/?feed=rss2&cat=%d' % categoryId,
+        }
+    #}}}
+
+    def _tag(self, tagId): #{{{
+        return {
+            'tag_id'    : str(tagId),
+            'name'      : 'tag%d' % tagId,
+            'slug'      : 'tag%d' % tagId,
+            'count'     : str(tagId % 17),
+            'html_url'  : 'http://example.com/?tag=tag%d' % tagId,
+            'rss_url'   : 'http://example.com/?feed=rss2&tag=tag%d' % tagId,
+        }
+    #}}}
+
+    def _comment(self, commentId, postId): #{{{
+        return {
+            'comment_id'    : str(commentId),
+            'parent'        : '0',
+            'user_id'       : '0',
+            'status'        : 'approve',
+            'content'       : 'Comment %d' % commentId,
+            'link'          : 'http://example.com/?p=%d#comment-%d' % (
+                postId, commentId),
+            'post_id'       : str(postId),
+            'post_title'    : 'Post %d' % postId,
+            'author'        : 'visitor',
+            'author_url'    : '',
+            'author_email'  : 'visitor@example.com',
+            'author_ip'     : '127.0.0.1',
+            'date_created_gmt' : xmlrpclib.DateTime('20090412T10:00:00'),
+        }
+    #}}}
+
+    def _getPost(self, postId): #{{{
+        post = self.posts.get(int(postId))
+        if post is None:
+            raise xmlrpclib.Fault(404, 'Invalid post ID.')
+        return post
+    #}}}
+
+    def getUsersBlogs(self, appKey, user, password):
+        self._check(user, password)
+        return [{'blogid': '1', 'blogName': 'Benchmark', 'isAdmin': True,
+                 'url': 'http://example.com/'}]
+
+    def getUserInfo(self, appKey, user, password):
+        self._check(user, password)
+        return {'userid': '1', 'firstname': 'Bench', 'lastname': 'Mark',
+                'nickname': user, 'email': 'admin@example.com',
+                'url': 'http://example.com/'}
+
+    def getPost(self, postId, user, password):
+        self._check(user, password)
+        return self._getPost(postId)
+
+    def getRecentPosts(self, blogId, user, password, number):
+        self._check(user, password)
+        ids = sorted(self.posts, reverse=True)[:number]
+        return [self.posts[i] for i in ids]
+
+    def newPost(self, blogId, user, password, content, publish):
+        self._check(user, password)
+        with self._lock:
+            postId = self.nextPostId
+            self.nextPostId += 1
+        post = self._post(postId, content.get('title', ''),
+                          content.get('description', ''))
+        post.update(content)
+        if 'wp_author_id' in content:
+            post['userid'] = str(post.pop('wp_author_id'))
+        if 'post_status' not in content:
+            post['post_status'] = publish and 'publish' or 'draft'
+        post['date_modified'] = xmlrpclib.DateTime(time.gmtime())
+        self._addKeywords(content)
+        self.posts[postId] = post
+        return str(postId)
+
+    def editPost(self, postId, user, password, content, publish):
+        self._check(user, password)
+        post = dict(self._getPost(postId))
+        post.update(content)
+        if 'post_status' not in content:
+            post['post_status'] = publish and 'publish' or 'draft'
+        post['date_modified'] = xmlrpclib.DateTime(time.gmtime())
+        self._addKeywords(content)
+        self.posts[int(postId)] = post
+        return True
+
+    def _addKeywords(self, content):
+        # WordPress creates the tags named in mt_keywords
+        for name in content.get('mt_keywords', '').split(','):
+            name = name.strip()
+            with self._lock:
+                if name and not any(tag['name'] == name
+                                    for tag in self.tags):
+                    tag = self._tag(len(self.tags) + 1)
+                    tag.update(name=name, slug=name, count='0')
+                    self.tags.append(tag)
+
+    def deletePost(self, appKey, postId, user, password):
+        self._check(user, password)
+        self._getPost(postId)
+        del self.posts[int(postId)]
+        return True
+
+    def newMediaObject(self, blogId, user, password, data):
+        self._check(user, password)
+        return {'file': data['name'],
+                'url': 'http://example.com/wp-content/uploads/' + data['name'],
+                'type': data.get('type', '')}
+
+    def getPostCategories(self, postId, user, password):
+        self._check(user, password)
+        names = self._getPost(postId)['categories']
+        return [dict(categoryId=c['categoryId'], categoryName=c['categoryName'],
+                     isPrimary=False) for c in self.categories
+                if c['categoryName'] in names]
+
+    def setPostCategories(self, postId, user, password, categories):
+        self._check(user, password)
+        self._getPost(postId)
+        return True
+
+    def publishPost(self, postId, user, password):
+        self._check(user, password)
+        self._getPost(postId)['post_status'] = 'publish'
+        return True
+
+    def getTrackbackPings(self, postId):
+        return []
+
+    def getPingbacks(self, url):
+        return []
+
+    def supportedMethods(self):
+        methods = sorted(self._methods)
+        if self.multicall:
+            methods.append('system.multicall')
+        return methods
+
+    def wpGetPosts(self, blogId, user, password, filter={}, fields=None):
+        self._check(user, password)
+        offset = filter.get('offset', 0)
+        if filter.get('orderby') == 'modified':
+            key = lambda i: (self.posts[i]['date_modified'].value, i)
+        else:
+            key = None
+        ids = sorted(self.posts, key=key,
+                     reverse=filter.get('order', 'DESC') == 'DESC')
+        ids = ids[offset:offset + filter.get('number', 10)]
+        posts = [self._wpPost(self.posts[i]) for i in ids]
+        if fields is not None and 'post' not in fields:
+            # post_id is always returned, terms only when asked for
+            keep = set(fields) | set(['post_id'])
+            posts = [dict((key, value) for key, value in post.items()
+                          if key in keep) for post in posts]
+        return posts
+
+    def getRecentPostTitles(self, blogId, user, password, number):
+        self._check(user, password)
+        ids = sorted(self.posts, reverse=True)[:number]
+        return [dict((key, self.posts[i][key]) for key in
+                     ('postid', 'title', 'dateCreated', 'userid'))
+                for i in ids]
+
+    def _wpPost(self, post):
+        return {
+            'post_id'           : post['postid'],
+            'post_title'        : post['title'],
+            'post_content'      : post['description'],
+            'post_excerpt'      : post['mt_excerpt'],
+            'post_author'       : post['userid'],
+            'post_date'         : post['dateCreated'],
+            'post_modified'     : post['date_modified'],
+            'post_status'       : post['post_status'],
+            'post_type'         : 'post',
+            'link'              : post['link'],
+            'post_name'         : post['wp_slug'],
+            'comment_status'    : post['mt_allow_comments'] and 'open'
+                                  or 'closed',
+            'ping_status'       : post['mt_allow_pings'] and 'open'
+                                  or 'closed',
+            'terms'             : [{'taxonomy': 'category', 'name': name}
+                                   for name in post['categories']],
+        }
+
+    def getCategories(self, blogId, user, password):
+        self._check(user, password)
+        return self.categories
+
+    def newCategory(self, blogId, user, password, category):
+        self._check(user, password)
+        with self._lock:
+            categoryId = max([int(category['categoryId']) for category
+                              in self.categories] or [0]) + 1
+            self.categories.append(self._category(categoryId))
+            self.categories[-1]['categoryName'] = category.get('name',
+                'Category %d' % categoryId)
+        return categoryId
+
+    def deleteCategory(self, blogId, user, password, categoryId):
+        self._check(user, password)
+        with self._lock:
+            categories = [category for category in self.categories
+                          if category['categoryId'] != str(categoryId)]
+            if len(categories) == len(self.categories):
+                raise xmlrpclib.Fault(404, 'Invalid category ID.')
+            self.categories[:] = categories
+        return True
+
+    def suggestCategories(self, blogId, user, password, category, maxResults=5):
+        self._check(user, password)
+        return [{'category_id': c['categoryId'], 'category_name': c['categoryName']}
+                for c in self.categories
+                if c['categoryName'].startswith(category)][:maxResults]
+
+    def getTags(self, blogId, user, password):
+        self._check(user, password)
+        return self.tags
+
+    def newTerm(self, blogId, user, password, content):
+        self._check(user, password)
+        if content.get('taxonomy') != 'post_tag':
+            raise xmlrpclib.Fault(403, 'Invalid taxonomy.')
+        with self._lock:
+            if any(tag['name'] == content['name'] for tag in self.tags):
+                raise xmlrpclib.Fault(500, 'A term with the name provided '
+                                      'already exists.')
+            tagId = len(self.tags) + 1
+            tag = self._tag(tagId)
+            tag.update(name=content['name'],
+                       slug=content.get('slug') or content['name'], count='0')
+            self.tags.append(tag)
+        return str(tagId)
+
+    def getComment(self, blogId, user, password, commentId):
+        self._check(user, password)
+        return self.comments[(int(commentId) - 1) % len(self.comments)]
+
+    def getComments(self, blogId, user, password, filter={}):
+        self._check(user, password)
+        # newest first
+        comments = self.comments[::-1]
+        if filter.get('post_id'):
+            postId = str(filter['post_id'])
+            comments = [c for c in comments if c['post_id'] == postId]
+        offset = filter.get('offset', 0)
+        return comments[offset:offset + filter.get('number', 10)]
+
+    def newComment(self, blogId, user, password, postId, comment):
+        self._check(user, password)
+        self._getPost(postId)
+        with self._lock:
+            commentId = len(self.comments) + 1
+            struct = self._comment(commentId, int(postId))
+            struct['parent'] = str(comment.get('comment_parent', 0))
+            for key in ('content', 'author', 'author_url', 'author_email'):
+                if key in comment:
+                    struct[key] = comment[key]
+            self.comments.append(struct)
+        return commentId
+
+    def editComment(self, blogId, user, password, commentId, comment):
+        self._check(user, password)
+        struct = self.comments[int(commentId) - 1]
+        struct.update(comment)
+        return True
+#}}}
+
+# (transport mode, keyword arguments of WordPressClient, thread safe), the
+# stdlib transport has a single connection so each thread gets a client
+MODES = [
+    ('stdlib',      lambda: {'transport' : xmlrpclib.Transport()}, False),
+    ('keepalive',   lambda: {}, True),
+    ('nogzip',      lambda: {'compress' : False}, True),
+    ('close',       lambda: {'keepAlive' : False}, True),
+    ('stream',      lambda: {'streamResponses' : True}, True),
+    ('cache',       lambda: {'cache' : True}, True),
+]
+
+def _newPost(client, i, options):
+    post = yawpl.WordPressPost()
+    post.title = 'Benchmark %d' % i
+    post.description = 'x' * options.post_size
+    post.categories = [1, 2]
+    post.date = time.localtime()[:9]
+    client.newPost(post, True)
+
+def _editPost(client, i, options):
+    post = yawpl.WordPressPost()
+    post.title = 'Edited %d' % i
+    post.description = 'y' * options.post_size
+    post.categories = [3]
+    client.editPost(i % options.posts + 1, post, True)
+
+def _newMediaObject(client, i, options):
+    client.newMediaObject(options.media_file, 'media%d.bin' % i)
+
+# (name, function(client, i, options), number of requests divisor)
+CASES = [
+    ('getPost',         lambda c, i, o: c.getPost(i % 10 + 1), 1),
+    ('getRecentPosts',  lambda c, i, o: list(c.getRecentPosts(50)), 4),
+    ('listPosts',       lambda c, i, o: list(c.getRecentPosts(50,
+                            fields=('id', 'title', 'date', 'status'))), 4),
+    ('iterPosts',       lambda c, i, o: sum(1 for p in c.iterPosts()), 50),
+    ('newPost',         _newPost, 1),
+    ('editPost',        _editPost, 1),
+    ('getCategoryList', lambda c, i, o: c.getCategoryList(True), 2),
+    ('getTags',         lambda c, i, o: list(c.getTags()), 2),
+    ('getComments',     lambda c, i, o: list(c.getComments(number=50)), 4),
+    ('getComment',      lambda c, i, o: c.getComment(i % 10 + 1), 1),
+    ('getUsersBlogs',   lambda c, i, o: list(c.getUsersBlogs()), 1),
+    ('newMediaObject',  _newMediaObject, 10),
+]
+
+def _memory():
+    """Current and peak resident memory in MB, None when unknown
+    """
+    try:
+        status = dict(line.split(':', 1) for line in open('/proc/self/status'))
+        return (int(status['VmRSS'].split()[0]) / 1024.0,
+                int(status['VmHWM'].split()[0]) / 1024.0)
+    except (IOError, KeyError, ValueError):
+        return None, None
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def runCase(url, function, mode, shared, requests, threads, options): #{{{
+    """Run function requests times on threads threads sharing one client
+    if shared, return result dict
+    """
+    clients = [yawpl.WordPressClient(url, USER, PASSWORD, **mode())
+               for i in range(shared and 1 or threads)]
+    for client in clients:
+        try:
+            # warm up connections and caches
+            function(client, 0, options)
+        except Exception:
+            pass
+    baseline = _memory()[0]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(xrange(1, requests + 1))
+    def worker(client):
+        own = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.time()
+            try:
+                function(client, i, options)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+            own.append(time.time() - start)
+        with lock:
+            latencies.extend(own)
+    start = time.time()
+    workers = [threading.Thread(target=worker, args=(clients[i % len(clients)],))
+               for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+    peak = _memory()[1]
+    growth = None
+    if peak is not None:
+        growth = peak - baseline
+    return {
+        'requests'  : requests,
+        'errors'    : errors[0],
+        'seconds'   : elapsed,
+        'rate'      : requests / elapsed,
+        'p50'       : _percentile(latencies, 0.50) * 1000,
+        'p99'       : _percentile(latencies, 0.99) * 1000,
+        'peakMB'    : peak,
+        'growthMB'  : growth,
+    }
+#}}}
+
+def runForked(*args): #{{{
+    """Run runCase in a child process so that peak memory is measured for
+    the case alone, the server keeps running in this process
+    """
+    if not hasattr(os, 'fork'):
+        return runCase(*args)
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        try:
+            result = runCase(*args)
+        except BaseException, e:
+            result = {'failed' : '%s: %s' % (e.__class__.__name__, e)}
+        os.write(write, pickle.dumps(result))
+        os._exit(0)
+    os.close(write)
+    data = []
+    while True:
+        chunk = os.read(read, 65536)
+        if not chunk:
+            break
+        data.append(chunk)
+    os.close(read)
+    os.waitpid(pid, 0)
+    return pickle.loads(''.join(data))
+#}}}
+
+def benchmarkDecoding(server, repeat=5): #{{{
+    """Compare decoding responses with xmlrpclib and building items with
+    fromStruct against the decoder WordPressTransport uses
+    """
+    shapes = [
+        ('posts', [server.posts[i] for i in sorted(server.posts)],
+         yawpl.WordPressPost),
+        ('comments', server.comments, yawpl.WordPressComment),
+        ('categories', server.categories, yawpl.WordPressCategory),
+        ('tags', server.tags, yawpl.WordPressTag),
+        ('blogs', server.getUsersBlogs('', USER, PASSWORD), yawpl.WordPressBlog),
+    ]
+    print '%-12s %6s %12s %12s %8s' % ('response', 'items', 'xmlrpclib ms',
+                                       'yawpl ms', 'speedup')
+    for name, values, itemClass in shapes:
+        body = xmlrpclib.dumps((values,), methodresponse=True)
+        def generic():
+            parser, unmarshaller = xmlrpclib.getparser()
+            parser.feed(body)
+            parser.close()
+            return map(itemClass.fromStruct, unmarshaller.close()[0])
+        def fast():
+            parser, close = yawpl._responseParser(itemClass)
+            parser.Parse(body, False)
+            return close()[0]
+        times = []
+        for function in (generic, fast):
+            best = None
+            for i in range(repeat):
+                start = time.time()
+                function()
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            times.append(best * 1000)
+        print '%-12s %6d %12.2f %12.2f %7.1fx' % (name, len(values), times[0],
+                                                 times[1], times[0] / times[1])
+#}}}
+
+def benchmarkMarshalling(count=20000): #{{{
+    """Compare marshalling calls with xmlrpclib.dumps against the request
+    templates of WordPressClient
+    """
+    client = yawpl.WordPressClient('http://127.0.0.1/xmlrpc.php', USER,
+                                   PASSWORD)
+    client.selectBlog('1')
+    post = {'title' : 'Title', 'description' : 'x' * 200}
+    calls = [
+        ('metaWeblog.getPost', lambda i: (str(i), client.user,
+                                          client.password)),
+        ('wp.getComment', lambda i: (client.blogId, client.user,
+                                     client.password, i)),
+        ('mt.publishPost', lambda i: (i, client.user, client.password)),
+        ('metaWeblog.editPost', lambda i: (i, client.user, client.password,
+                                           post, 0)),
+    ]
+    print '%-22s %14s %14s %8s' % ('method', 'xmlrpclib /s', 'yawpl /s',
+                                   'speedup')
+    for methodName, params in calls:
+        paramsList = map(params, range(1, count + 1))
+        for values in paramsList[:100]:
+            assert (client._dumps(methodName, values) ==
+                    xmlrpclib.dumps(values, methodName))
+        rates = []
+        for function in (lambda values: xmlrpclib.dumps(values, methodName),
+                         lambda values: client._dumps(methodName, values)):
+            start = time.time()
+            for values in paramsList:
+                function(values)
+            rates.append(count / (time.time() - start))
+        print '%-22s %14.0f %14.0f %7.1fx' % (methodName, rates[0], rates[1],
+                                              rates[1] / rates[0])
+#}}}
+
+def compare(results, baseline, tolerance): #{{{
+    """Return list of regressions of results against baseline results
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        old = baseline.get(key)
+        if old is None or 'failed' in result or 'failed' in old:
+            continue
+        for metric in ('p50', 'p99'):
+            if result[metric] > old[metric] * (1 + tolerance):
+                regressions.append('%s %s %.2f ms -> %.2f ms' % (
+                    key, metric, old[metric], result[metric]))
+        if result['rate'] < old['rate'] / (1 + tolerance):
+            regressions.append('%s rate %.1f/s -> %.1f/s' % (
+                key, old['rate'], result['rate']))
+    return regressions
+#}}}
+
+def main(argv=None): #{{{
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--requests', type='int', default=200,
+                      help='requests per case, divided for heavy cases')
+    parser.add_option('--threads', type='int', default=1,
+                      help='client threads sharing one client')
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='server latency per request in ms')
+    parser.add_option('--posts', type='int', default=1000)
+    parser.add_option('--comments', type='int', default=1000)
+    parser.add_option('--post-size', type='int', default=2000,
+                      help='post content length in bytes')
+    parser.add_option('--media-size', type='int', default=1 << 20,
+                      help='uploaded media size in bytes')
+    parser.add_option('--fault-rate', type='float', default=0.0)
+    parser.add_option('--http-error-rate', type='float', default=0.0)
+    parser.add_option('--no-multicall', action='store_true', default=False)
+    parser.add_option('--cases', help='comma separated case names')
+    parser.add_option('--modes', help='comma separated transport modes')
+    parser.add_option('--no-fork', action='store_true', default=False,
+                      help='run cases in this process')
+    parser.add_option('--decoding', action='store_true', default=False,
+                      help='only compare response decoding speed')
+    parser.add_option('--marshalling', action='store_true', default=False,
+                      help='only compare request marshalling speed')
+    parser.add_option('--save', help='write results to JSON file')
+    parser.add_option('--compare', help='compare with results JSON file')
+    parser.add_option('--tolerance', type='float', default=0.2,
+                      help='allowed slowdown fraction for --compare')
+    options, args = parser.parse_args(argv)
+
+    cases = CASES
+    if options.cases:
+        names = options.cases.split(',')
+        cases = [case for case in CASES if case[0] in names]
+    modes = MODES
+    if options.modes:
+        names = options.modes.split(',')
+        modes = [mode for mode in MODES if mode[0] in names]
+
+    server = FakeWordPressServer(posts=options.posts,
+        comments=options.comments, postSize=options.post_size,
+        latency=options.latency / 1000.0, faultRate=options.fault_rate,
+        httpErrorRate=options.http_error_rate,
+        multicall=not options.no_multicall)
+    if options.decoding:
+        benchmarkDecoding(server)
+        return 0
+    if options.marshalling:
+        benchmarkMarshalling()
+        return 0
+    url = server.start()
+    media = tempfile.NamedTemporaryFile(suffix='.bin', delete=False)
+    media.write(os.urandom(options.media_size))
+    media.close()
+    options.media_file = media.name
+    run = options.no_fork and runCase or runForked
+
+    print '%-16s %-10s %6s %6s %9s %9s %9s %9s' % ('case', 'mode',
+        'reqs', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'peak MB')
+    results = {}
+    try:
+        for name, function, divisor in cases:
+            requests = max(1, options.requests // divisor)
+            for mode, kwargs, shared in modes:
+                result = run(url, function, kwargs, shared, requests,
+                             options.threads, options)
+                results['%s/%s' % (name, mode)] = result
+                if 'failed' in result:
+                    print '%-16s %-10s failed: %s' % (name, mode,
+                                                      result['failed'])
+                    continue
+                print '%-16s %-10s %6d %6d %9.1f %9.2f %9.2f %9s' % (name,
+                    mode, result['requests'], result['errors'],
+                    result['rate'], result['p50'], result['p99'],
+                    result['peakMB'] is not None and
+                    '%.1f' % result['peakMB'] or '-')
+                sys.stdout.flush()
+    finally:
+        server.stop()
+        os.remove(media.name)
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for regression in regressions:
+            print 'REGRESSION', regression
+        if regressions:
+            return 1
+    return 0
+#}}}
+
+if __name__ == '__main__':
+    sys.exit(main())
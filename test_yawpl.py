@@ -0,0 +1,1586 @@
+#!/usr/bin/env python
+
+"""
+    Tests of yawpl against the fake WordPress server of benchmark.py.
+
+        python -m unittest test_yawpl
+"""
+
+import os
+import copy
+import time
+import json
+import pickle
+import errno
+import hashlib
+import socket
+import sqlite3
+import tempfile
+import threading
+import unittest
+import xmlrpclib
+from StringIO import StringIO
+
+import yawpl
+import benchmark
+
+class _ServerTestCase(unittest.TestCase): #{{{
+    """Start a fresh fake blog for every test
+    """
+    serverOptions = {}
+
+    def setUp(self):
+        options = dict(posts=20, comments=30, categories=5, tags=5,
+                       postSize=100)
+        options.update(self.serverOptions)
+        self.blog = benchmark.FakeWordPressServer(**options)
+        self.url = self.blog.start()
+
+    def tearDown(self):
+        self.blog.stop()
+
+    def client(self, **options):
+        return yawpl.WordPressClient(self.url, benchmark.USER,
+                                     benchmark.PASSWORD, **options)
+
+    def track(self, methodName):
+        """Record the peak number of concurrent calls of methodName
+        """
+        method = self.blog._methods[methodName]
+        lock = threading.Lock()
+        state = {'active': 0, 'peak': 0}
+        def tracked(*params):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            try:
+                time.sleep(0.02)
+                return method(*params)
+            finally:
+                with lock:
+                    state['active'] -= 1
+        self.blog._methods[methodName] = tracked
+        return state
+#}}}
+
+class AsyncClientTest(_ServerTestCase): #{{{
+
+    def asyncClient(self, **options):
+        client = yawpl.AsyncWordPressClient(self.url, benchmark.USER,
+                                            benchmark.PASSWORD, **options)
+        self.addCleanup(client.close)
+        return client
+
+    def testMaxPerHostIsSharedByClients(self):
+        state = self.track('metaWeblog.getPost')
+        first = self.asyncClient(maxPerHost=2)
+        second = self.asyncClient(maxPerHost=2, map=first.map)
+        futures = [client.getPost(i) for i in range(1, 6)
+                   for client in (first, second)]
+        first.run()
+        self.assertEqual([f.result().id for f in futures],
+                         [i for i in range(1, 6) for client in (1, 2)])
+        self.assertEqual(state['peak'], 2)
+
+    def testConnectionsAreKeptAlive(self):
+        client = self.asyncClient(maxPerHost=2)
+        client.run()
+        client.wait(client.getPost(1))
+        connections = list(client._hostRequests.idle)
+        self.assertEqual(len(connections), 1)
+        for i in range(5):
+            self.assertEqual(client.wait(client.getPost(i + 1)).id, i + 1)
+        self.assertEqual(client._hostRequests.idle, connections)
+        client.close()
+        self.assertEqual(client._hostRequests.idle, [])
+        self.assertEqual(client.map, {})
+
+    def stalledUrl(self):
+        """Get URL of a server accepting connections and never answering
+        """
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        self.addCleanup(listener.close)
+        return 'http://127.0.0.1:%d/xmlrpc.php' % listener.getsockname()[1]
+
+    def testStalledRequestTimesOut(self):
+        client = yawpl.AsyncWordPressClient(self.stalledUrl(),
+            benchmark.USER, benchmark.PASSWORD, timeout=0.3)
+        futures = [client.getPost(1), client.getTags()]
+        start = time.time()
+        client.run()
+        self.assertTrue(time.time() - start < 2)
+        for future in futures:
+            self.assertRaises(socket.timeout, future.result)
+        self.assertEqual(client.map, {})
+
+    def testRunDeadline(self):
+        client = yawpl.AsyncWordPressClient(self.stalledUrl(),
+            benchmark.USER, benchmark.PASSWORD, maxPerHost=1)
+        futures = [client.getPost(i) for i in range(3)]
+        start = time.time()
+        client.run(timeout=0.3)
+        self.assertTrue(time.time() - start < 2)
+        for future in futures:
+            self.assertRaises(socket.timeout, future.result)
+        self.assertEqual(client.map, {})
+        self.assertRaises(socket.timeout, client.wait, client.getPost(1),
+                          timeout=0.3)
+
+    def testAddressFamilies(self):
+        blog = benchmark.FakeWordPressServer(posts=3)
+        self.addCleanup(blog.stop)
+        url = blog.start(host='::1')
+        client = yawpl.AsyncWordPressClient(url, benchmark.USER,
+                                            benchmark.PASSWORD)
+        self.assertEqual(client.wait(client.getPost(2)).id, 2)
+        # the first address refuses the connection
+        port = int(self.url.split(':')[2].split('/')[0])
+        client = self.asyncClient()
+        client._hostRequests._addresses = [
+            (socket.AF_INET6, ('::1', port, 0, 0)),
+            (socket.AF_INET, ('127.0.0.1', port))]
+        self.assertEqual(client.wait(client.getPost(3)).id, 3)
+
+    def testIterPostsAndComments(self):
+        client = self.asyncClient()
+        pages = []
+        self.assertEqual(client.wait(client.iterPosts(
+            lambda posts: pages.append([post.id for post in posts]), 7)), 20)
+        self.assertEqual(map(len, pages), [7, 7, 6])
+        self.assertEqual(sum(pages, []), range(20, 0, -1))
+        pages = []
+        self.assertEqual(client.wait(client.iterComments(
+            lambda comments: pages.append(len(comments)), pageSize=10)), 30)
+        self.assertEqual(pages, [10, 10, 10])
+
+    def testDeleteCategory(self):
+        client = self.asyncClient()
+        self.assertEqual(len(client.wait(client.getCategoryList())), 5)
+        self.assertTrue(client.wait(client.deleteCategory(3)))
+        self.assertEqual(len(self.blog.categories), 4)
+        self.assertEqual([category.id for category
+                          in client.wait(client.getCategoryList())],
+                         [1, 2, 4, 5])
+
+    def testMediaIsStreamed(self):
+        client = self.asyncClient()
+        client.mediaChunkSize = 57 * 10
+        data = os.urandom(57 * 25 + 7)
+        progress = []
+        for mediaFile in (StringIO(data), self.mediaFile(data)):
+            del progress[:]
+            url = client.wait(client.newMediaObject(mediaFile, 'bits.bin',
+                lambda sent, total: progress.append(sent)))
+            self.assertEqual(url,
+                'http://example.com/wp-content/uploads/bits.bin')
+            self.assertEqual(len(progress), 3)
+            self.assertEqual(progress[-1], len(data))
+
+    def mediaFile(self, data):
+        f = tempfile.TemporaryFile()
+        f.write(data)
+        f.seek(0)
+        return f
+#}}}
+
+class ClientTest(_ServerTestCase): #{{{
+
+    def testSelectBlogClearsCategories(self):
+        client = self.client()
+        self.assertEqual(len(client.getCategoryList()), 5)
+        client.getCategoryList()
+        self.assertEqual(self.blog.calls['wp.getCategories'], 1)
+        client.selectBlog(2)
+        self.assertEqual(client.categories, None)
+        client.getCategoryList()
+        self.assertEqual(self.blog.calls['wp.getCategories'], 2)
+
+    def testDeleteCategory(self):
+        client = self.client()
+        self.assertTrue(3 in client.getCategoryStore())
+        self.assertTrue(client.deleteCategory(3))
+        self.assertEqual([category['categoryId'] for category
+                          in self.blog.categories], ['1', '2', '4', '5'])
+        self.assertFalse(3 in client.categoryStore)
+        self.assertEqual(client.getCategoryStore().getByName('Category 3'),
+                         None)
+        self.assertRaises(yawpl.WordPressException, client.deleteCategory, 3)
+
+    def testCallReturnsStructs(self):
+        client = self.client()
+        post = client._call('metaWeblog.getPost', '3', client.user,
+                            client.password)
+        self.assertEqual(type(post), dict)
+        self.assertEqual(post['postid'], '3')
+        self.assertEqual(client.getPost(3).id, 3)
+
+    def testStreamedCallFinishesWhenStoppedEarly(self):
+        events = []
+        client = self.client(streamResponses=True)
+        client.afterCall.append(events.append)
+        posts = client.getRecentPosts(10)
+        self.assertEqual(posts.next().id, 20)
+        posts.close()
+        self.assertEqual([event.methodName for event in events],
+                         ['metaWeblog.getRecentPosts'])
+        self.assertEqual(events[0].error, None)
+        self.assertTrue(events[0].bytesReceived > 0)
+        self.assertEqual(len(list(client.getRecentPosts(3))), 3)
+        self.assertEqual(len(events), 2)
+
+    def testCoalescedCallersGetOwnResults(self):
+        client = self.client()
+        getPost = self.blog._methods['metaWeblog.getPost']
+        def slowGetPost(*params):
+            time.sleep(0.2)
+            return getPost(*params)
+        self.blog._methods['metaWeblog.getPost'] = slowGetPost
+        class slowCopy(object):
+            @staticmethod
+            def deepcopy(value):
+                time.sleep(0.1)
+                return copy.deepcopy(value)
+        yawpl.copy = slowCopy
+        self.addCleanup(setattr, yawpl, 'copy', copy)
+        call = lambda: client._call('metaWeblog.getPost', '1', client.user,
+                                    client.password)
+        followers = []
+        thread = threading.Timer(0.05, lambda: followers.append(call()))
+        thread.start()
+        post = call()
+        post['title'] = 'changed by the caller'
+        thread.join()
+        self.assertEqual(self.blog.calls['metaWeblog.getPost'], 1)
+        self.assertEqual(followers[0]['title'], 'Post 1')
+        self.assertFalse(followers[0] is post)
+#}}}
+
+class MetricsTest(_ServerTestCase): #{{{
+
+    def calls(self, metrics):
+        client = self.client()
+        client.afterCall.append(metrics)
+        client.getPost(1)
+        client.getPost(2)
+        self.assertRaises(yawpl.WordPressException, client.getPost, 999)
+        list(client.getTags())
+        return client
+
+    def testCounters(self):
+        metrics = yawpl.WordPressMetrics()
+        self.calls(metrics)
+        stats = metrics.asDict()
+        self.assertEqual(sorted(stats), ['metaWeblog.getPost', 'wp.getTags'])
+        getPost = stats['metaWeblog.getPost']
+        self.assertEqual((getPost['calls'], getPost['faults'],
+                          getPost['errors']), (3, 1, 0))
+        self.assertEqual(stats['wp.getTags']['faults'], 0)
+        self.assertTrue(getPost['bytesSent'] > 0)
+        self.assertTrue(getPost['bytesReceived'] > 0)
+        self.assertEqual(getPost['buckets'][-1], (float('inf'), 3))
+        metrics.reset()
+        self.assertEqual(metrics.asDict(), {})
+
+    def testPrometheus(self):
+        metrics = yawpl.WordPressMetrics(buckets=(60.0, 0.0))
+        self.calls(metrics)
+        text = metrics.prometheus()
+        self.assertTrue(text.endswith('\n'))
+        lines = text.splitlines()
+        samples = {}
+        types = {}
+        for line in lines:
+            if line.startswith('# TYPE '):
+                name, kind = line.split()[2:]
+                types[name] = kind
+            elif not line.startswith('# HELP '):
+                sample, value = line.rsplit(' ', 1)
+                self.assertTrue(sample.startswith('yawpl_'), line)
+                self.assertTrue(sample.endswith('"}'), line)
+                samples[sample] = float(value)
+        self.assertEqual(len(types), len([line for line in lines
+                                          if line.startswith('# HELP ')]))
+        getPost = '{method="metaWeblog.getPost"}'
+        self.assertEqual(types['yawpl_calls_total'], 'counter')
+        self.assertEqual(samples['yawpl_calls_total' + getPost], 3)
+        self.assertEqual(samples['yawpl_faults_total' + getPost], 1)
+        self.assertEqual(samples['yawpl_errors_total' + getPost], 0)
+        self.assertEqual(samples['yawpl_calls_total'
+                                 '{method="wp.getTags"}'], 1)
+        name = 'yawpl_call_duration_seconds'
+        self.assertEqual(types[name], 'histogram')
+        bucket = name + '_bucket{method="metaWeblog.getPost",le="%s"}'
+        self.assertEqual([samples[bucket % bound] for bound in
+                          ('0.0', '60.0', '+Inf')], [0, 3, 3])
+        self.assertEqual(samples[name + '_count' + getPost], 3)
+        self.assertTrue(0 < samples[name + '_sum' + getPost] < 60)
+#}}}
+
+class PagingTest(_ServerTestCase): #{{{
+
+    def prefetchThreads(self, wait=False):
+        for i in range(50):
+            threads = [thread for thread in threading.enumerate()
+                       if thread.name == 'yawpl-prefetch']
+            if not threads or not wait:
+                break
+            time.sleep(0.02)
+        return threads
+
+    def testExactMultipleOfPageSize(self):
+        client = self.client()
+        for prefetch in (True, False):
+            self.blog.calls.clear()
+            posts = [post.id for post in client.iterPosts(5, prefetch)]
+            self.assertEqual(posts, range(20, 0, -1))
+            # the fourth page is full, an empty fifth one ends the listing
+            self.assertEqual(self.blog.calls['wp.getPosts'], 5)
+            comments = [comment.id for comment in
+                        client.iterComments(pageSize=10, prefetch=prefetch)]
+            self.assertEqual(sorted(comments), range(1, 31))
+            self.assertEqual(self.blog.calls['wp.getComments'], 4)
+
+    def testShortLastPage(self):
+        client = self.client()
+        self.assertEqual(len(list(client.iterPosts(7))), 20)
+        self.assertEqual(self.blog.calls['wp.getPosts'], 3)
+        self.assertEqual([comment.id for comment in client.iterComments()],
+                         [comment.id for comment in client.iterComments(
+                             prefetch=False)])
+
+    def testStoppingEarlyCancelsPrefetch(self):
+        client = self.client()
+        comments = client.iterComments(pageSize=2)
+        self.assertEqual(len([comments.next() for i in range(3)]), 3)
+        self.assertEqual(len(self.prefetchThreads()), 1)
+        comments.close()
+        self.assertEqual(self.prefetchThreads(wait=True), [])
+        # pages 1 and 2 were read, at most two more were fetched ahead
+        self.assertTrue(self.blog.calls['wp.getComments'] <= 4)
+        calls = dict(self.blog.calls)
+        time.sleep(0.1)
+        self.assertEqual(self.blog.calls, calls)
+
+    def testPrefetchError(self):
+        client = self.client()
+        posts = client.iterPosts(5)
+        self.assertEqual(posts.next().id, 20)
+        self.blog.faultRate = 1.0
+        self.assertRaises(yawpl.WordPressException, list, posts)
+        self.assertEqual(self.prefetchThreads(wait=True), [])
+#}}}
+
+class BatchTest(_ServerTestCase): #{{{
+
+    def setUp(self):
+        _ServerTestCase.setUp(self)
+        self.blog.posts[4]['post_status'] = 'draft'
+
+    def recorded(self, client):
+        client.supportedMethods()
+        methods = []
+        client.afterCall.append(lambda event: methods.append(
+            event.methodName))
+        return methods
+
+    def newPost(self):
+        post = yawpl.WordPressPost()
+        post.title = 'batched'
+        post.categories = [2, 3]
+        return post
+
+    def testResultsAndFaults(self):
+        client = self.client()
+        methods = self.recorded(client)
+        with client.batch() as batch:
+            found = batch.call('metaWeblog.getPost', '3', client.user,
+                               client.password)
+            missing = batch.call('metaWeblog.getPost', '99', client.user,
+                                 client.password)
+        self.assertEqual(batch.results[found]['title'], 'Post 3')
+        self.assertTrue(isinstance(batch.results[missing],
+                                   yawpl.WordPressException))
+        self.assertEqual(methods, ['system.multicall'])
+        self.assertRaises(yawpl.WordPressException, batch.call,
+                          'wp.getTags', client.blogId, client.user,
+                          client.password)
+
+    def testNewPostFollowUpsInOneRequest(self):
+        client = self.client()
+        methods = self.recorded(client)
+        postId = client.newPost(self.newPost(), True)
+        self.assertEqual(methods, ['metaWeblog.newPost', 'system.multicall'])
+        self.assertEqual(self.blog.posts[postId]['post_status'], 'publish')
+        self.assertEqual(self.blog.calls['mt.setPostCategories'], 1)
+
+    def testFailedEditSendsNothingElse(self):
+        for answer in (xmlrpclib.Fault(500, 'edit rejected'), False):
+            def editPost(*params):
+                if isinstance(answer, Exception):
+                    raise answer
+                return answer
+            self.blog._methods['metaWeblog.editPost'] = editPost
+            client = self.client()
+            post = client.getPost(4)
+            post.title = 'changed'
+            post.categories = [1]
+            self.assertRaises(yawpl.WordPressException, client.editPost, 4,
+                              post, True)
+            self.assertEqual(self.blog.posts[4]['post_status'], 'draft')
+            self.assertFalse('mt.setPostCategories' in self.blog.calls)
+            self.assertFalse('mt.publishPost' in self.blog.calls)
+
+    def testEditThenFollowUps(self):
+        client = self.client()
+        methods = self.recorded(client)
+        post = client.getPost(4)
+        del methods[:]
+        post.title = 'changed'
+        post.categories = [1]
+        client.editPost(4, post, True)
+        self.assertEqual(methods, ['metaWeblog.editPost', 'system.multicall'])
+        self.assertEqual(self.blog.posts[4]['post_status'], 'publish')
+        self.assertEqual(self.blog.posts[4]['title'], 'changed')
+
+    def testWithoutMulticall(self):
+        self.blog.stop()
+        self.blog = benchmark.FakeWordPressServer(posts=5, multicall=False)
+        self.url = self.blog.start()
+        client = self.client()
+        methods = self.recorded(client)
+        postId = client.newPost(self.newPost(), True)
+        self.assertEqual(methods, ['metaWeblog.newPost',
+                                   'mt.setPostCategories', 'mt.publishPost'])
+        self.assertEqual(self.blog.posts[postId]['post_status'], 'publish')
+        self.assertFalse(client.supportsMethod('system.multicall'))
+#}}}
+
+class CacheTest(_ServerTestCase): #{{{
+
+    def backends(self):
+        path = tempfile.mktemp(suffix='.db')
+        self.addCleanup(os.remove, path)
+        return [yawpl.WordPressMemoryCache(), yawpl.WordPressDiskCache(path)]
+
+    def testTtl(self):
+        for backend in self.backends():
+            backend.set('forever', 1, None)
+            backend.set('later', 2, 60)
+            backend.set('zero', 3, 0)
+            backend.set('past', 4, -1)
+            self.assertEqual(backend.get('forever'), (True, 1))
+            self.assertEqual(backend.get('later'), (True, 2))
+            self.assertEqual(backend.get('zero'), (False, None))
+            self.assertEqual(backend.get('past'), (False, None))
+            backend.set('later', 5, 0)
+            self.assertEqual(backend.get('later'), (False, None))
+            self.assertEqual(len(backend), 1)
+
+    def testZeroTtlIsNotCached(self):
+        client = self.client(cache=yawpl.WordPressResponseCache(
+            ttls={'metaWeblog.getPost': 0}))
+        client.getPost(1)
+        client.getPost(1)
+        self.assertEqual(self.blog.calls['metaWeblog.getPost'], 2)
+
+    def testStreamedTagsAreCached(self):
+        client = self.client(cache=yawpl.WordPressResponseCache(),
+                             streamResponses=True)
+        for i in range(2):
+            self.assertEqual(len(list(client.getTags(forceUpdate=True))), 5)
+        self.assertEqual(self.blog.calls['wp.getTags'], 1)
+        self.assertEqual(client.cache.stats()['hits'], 1)
+
+    def testDiskCacheStoresJson(self):
+        path = tempfile.mktemp(suffix='.db')
+        self.addCleanup(os.remove, path)
+        client = self.client(cache=yawpl.WordPressResponseCache(
+            yawpl.WordPressDiskCache(path)))
+        post = client.getPost(3)
+        other = self.client(cache=yawpl.WordPressResponseCache(
+            yawpl.WordPressDiskCache(path)))
+        self.assertEqual(other.getPost(3).struct(), post.struct())
+        self.assertEqual(self.blog.calls['metaWeblog.getPost'], 1)
+        [value] = other.cache.backend._db.execute('SELECT value FROM cache')
+        self.assertEqual(json.loads(value[0])['postid'], '3')
+
+    def testDiskCacheEvictsLeastRecentlyUsed(self):
+        path = tempfile.mktemp(suffix='.db')
+        self.addCleanup(os.remove, path)
+        backend = yawpl.WordPressDiskCache(path, maxSize=3)
+        for key in 'abc':
+            backend.set(key, key)
+            time.sleep(0.01)
+        backend.get('a')
+        backend.set('b', 'B')
+        time.sleep(0.01)
+        self.assertEqual(len(backend), 3)
+        backend.set('d', 'd')
+        self.assertEqual(backend.get('c'), (False, None))
+        self.assertEqual([backend.get(key) for key in 'abd'],
+                         [(True, 'a'), (True, 'B'), (True, 'd')])
+        # entries added by another instance are evicted too
+        other = yawpl.WordPressDiskCache(path, maxSize=3)
+        time.sleep(0.01)
+        other.set('e', 'e')
+        other.set('f', 'f')
+        self.assertEqual(len(backend), 3)
+        backend.delete('e')
+        backend.set('g', 'g')
+        self.assertEqual(len(backend), 3)
+        plan = backend._db.execute('EXPLAIN QUERY PLAN SELECT key FROM cache '
+                                   'ORDER BY used LIMIT 1').fetchall()
+        self.assertTrue('cache_used' in str(plan))
+
+    def testPickledDiskCacheIsDropped(self):
+        path = tempfile.mktemp(suffix='.db')
+        self.addCleanup(os.remove, path)
+        db = sqlite3.connect(path)
+        with db:
+            db.execute('CREATE TABLE cache (key TEXT PRIMARY KEY, value BLOB, '
+                       'expires REAL, used REAL)')
+            db.execute("INSERT INTO cache VALUES ('key', 'cos\\nsystem\\n', "
+                       "NULL, 0)")
+        db.close()
+        backend = yawpl.WordPressDiskCache(path)
+        self.assertEqual(backend.get('key'), (False, None))
+        self.assertEqual(len(backend), 0)
+#}}}
+
+class _LostResponseHandler(benchmark._FakeRequestHandler): #{{{
+    """Handle request, then answer 503 as a proxy losing the response
+    """
+    def do_POST(self):
+        wfile, self.wfile = self.wfile, StringIO()
+        try:
+            benchmark._FakeRequestHandler.do_POST(self)
+        finally:
+            self.wfile = wfile
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+#}}}
+
+class _LostResponseServer(benchmark.FakeWordPressServer): #{{{
+    requestHandler = _LostResponseHandler
+#}}}
+
+class RetryTest(_ServerTestCase): #{{{
+
+    def newPost(self, title):
+        post = yawpl.WordPressPost()
+        post.title = title
+        post.description = 'text'
+        return post
+
+    def testNewPostIsNotResent(self):
+        self.blog.stop()
+        self.blog = _LostResponseServer(posts=0)
+        self.url = self.blog.start()
+        client = self.client()
+        [(index, error)] = client.bulkNewPosts([self.newPost('once')],
+                                               backoff=0)
+        self.assertTrue(isinstance(error, xmlrpclib.ProtocolError))
+        self.assertTrue(error.postMayExist)
+        self.assertEqual(self.blog.calls['metaWeblog.newPost'], 1)
+        self.assertEqual([post['title'] for post in self.blog.posts.values()],
+                         ['once'])
+
+    def testUnsentNewPostIsRetried(self):
+        client = self.client()
+        call = client._call
+        failures = []
+        def refuse(methodName, *params):
+            if methodName == 'metaWeblog.newPost' and len(failures) < 2:
+                error = socket.error(errno.ECONNREFUSED, 'Connection refused')
+                error.unsent = True
+                failures.append(error)
+                raise error
+            return call(methodName, *params)
+        client._call = refuse
+        [(index, postId)] = client.bulkNewPosts([self.newPost('retried')],
+                                                backoff=0)
+        self.assertEqual(len(failures), 2)
+        self.assertEqual(self.blog.posts[postId]['title'], 'retried')
+        self.assertEqual(self.blog.calls['metaWeblog.newPost'], 1)
+
+    def testRefusedConnectionIsUnsent(self):
+        self.blog.stop()
+        client = self.client()
+        try:
+            client.getPost(1)
+        except socket.error, error:
+            self.assertTrue(yawpl._isUnsent(error))
+        else:
+            self.fail('connection not refused')
+
+    def testClosedBulkStopsWriting(self):
+        self.blog.stop()
+        self.blog = benchmark.FakeWordPressServer(posts=0)
+        self.url = self.blog.start()
+        self.track('metaWeblog.newPost')
+        client = self.client()
+        results = client.bulkNewPosts([self.newPost('post %d' % i)
+                                       for i in range(40)], maxWorkers=2)
+        results.next()
+        results.close()
+        created = len(self.blog.posts)
+        # the first result and the tasks running when it arrived
+        self.assertTrue(created <= 5, created)
+        time.sleep(0.3)
+        self.assertEqual(len(self.blog.posts), created)
+
+    def testFaultIsNotRetried(self):
+        client = self.client()
+        client.password = 'wrong'
+        [(index, error)] = client.bulkNewPosts([self.newPost('denied')],
+                                               backoff=0)
+        self.assertTrue(isinstance(error, yawpl.WordPressException))
+        self.assertFalse(hasattr(error, 'postMayExist'))
+        self.assertEqual(self.blog.calls['metaWeblog.newPost'], 1)
+#}}}
+
+class CircuitBreakerTest(_ServerTestCase): #{{{
+
+    def setUp(self):
+        _ServerTestCase.setUp(self)
+        # breakers are shared by host for the whole process
+        self.addCleanup(yawpl._circuitBreakers.clear)
+
+    def testStates(self):
+        breaker = yawpl.WordPressCircuitBreaker('host', 2, 0.1)
+        breaker.record(xmlrpclib.Fault(404, 'Invalid post ID.'))
+        breaker.record(xmlrpclib.Fault(404, 'Invalid post ID.'))
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record(socket.error(errno.ECONNREFUSED, 'refused'))
+        breaker.record()
+        breaker.record(socket.error(errno.ECONNREFUSED, 'refused'))
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record(xmlrpclib.ProtocolError('host', 503, 'Unavailable',
+                                               {}))
+        self.assertEqual(breaker.state, 'open')
+        self.assertRaises(yawpl.WordPressException, breaker.allow)
+        time.sleep(0.15)
+        self.assertEqual(breaker.state, 'half-open')
+        breaker.allow()
+        # a single trial call at a time
+        self.assertEqual(breaker.state, 'open')
+        self.assertRaises(yawpl.WordPressException, breaker.allow)
+        breaker.record()
+        self.assertEqual((breaker.state, breaker.failures), ('closed', 0))
+        breaker.allow()
+
+    def testFailFastThenRecover(self):
+        transport = yawpl.WordPressTransport(failureThreshold=2,
+                                             resetTimeout=0.3)
+        client = self.client(transport=transport)
+        self.blog.httpErrorRate = 1.0
+        for i in range(2):
+            self.assertRaises(xmlrpclib.ProtocolError, client.getPost, 1)
+        breaker = yawpl.getCircuitBreaker('http', self.url.split('/')[2])
+        self.assertEqual(breaker.state, 'open')
+        # calls fail at once without reaching the server
+        self.blog.httpErrorRate = 0.0
+        self.blog.calls.clear()
+        start = time.time()
+        try:
+            client.getPost(1)
+        except yawpl.WordPressException, error:
+            self.assertTrue(error.unsent)
+            self.assertTrue('Circuit open' in str(error))
+        else:
+            self.fail('circuit did not open')
+        self.assertTrue(time.time() - start < 0.1)
+        self.assertEqual(self.blog.calls, {})
+        # the failed trial call opens the circuit again
+        time.sleep(0.35)
+        self.assertEqual(breaker.state, 'half-open')
+        self.blog.httpErrorRate = 1.0
+        self.assertRaises(xmlrpclib.ProtocolError, client.getPost, 1)
+        self.assertEqual(breaker.state, 'open')
+        self.assertRaises(yawpl.WordPressException, client.getPost, 1)
+        # the successful one closes it
+        time.sleep(0.35)
+        self.blog.httpErrorRate = 0.0
+        self.assertEqual(client.getPost(1).id, 1)
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(client.getPost(2).id, 2)
+#}}}
+
+class MirrorTest(_ServerTestCase): #{{{
+
+    def setUp(self):
+        _ServerTestCase.setUp(self)
+        self.path = tempfile.mktemp(suffix='.db')
+        self.addCleanup(os.remove, self.path)
+
+    def testSyncedItemsReadBack(self):
+        client = self.client()
+        mirror = yawpl.WordPressMirror(client, self.path)
+        counts = mirror.sync()
+        self.assertEqual(counts, {'posts': 20, 'comments': 30,
+                                  'categories': 5, 'tags': 5})
+        post = mirror.getPost(3)
+        self.assertEqual(post.struct(), client.getPost(3).struct())
+        self.assertEqual(post.date, client.getPost(3).date)
+        self.assertEqual(len(list(mirror.getComments())), 30)
+        self.assertEqual(sorted(tag.name for tag in mirror.getTags()),
+                         ['tag%d' % i for i in range(1, 6)])
+        self.assertEqual(len(mirror.getCategoryStore()), 5)
+        mirror.close()
+
+    def testPickledMirrorIsSyncedAgain(self):
+        mirror = yawpl.WordPressMirror(self.client(), self.path)
+        mirror.sync()
+        with mirror._db:
+            mirror._db.execute("UPDATE posts SET struct = 'cos\\nsystem\\n'")
+            mirror._db.execute("DELETE FROM state WHERE key = 'format'")
+        mirror.close()
+        mirror = yawpl.WordPressMirror(self.client(), self.path)
+        self.assertEqual(mirror.getPost(3), None)
+        self.assertEqual(mirror.sync()['posts'], 20)
+        self.assertEqual(mirror.getPost(3).id, 3)
+        mirror.close()
+#}}}
+
+class JsonTest(unittest.TestCase): #{{{
+
+    def testRoundTrip(self):
+        value = {'title': 'caf\xc3\xa9'.decode('utf-8'), 'id': '7', 'n': 3,
+                 'date': xmlrpclib.DateTime('20090412T10:00:00'),
+                 'bits': xmlrpclib.Binary('\x00\xff'), 'tags': ['a', True],
+                 'none': None}
+        restored = yawpl._loadJson(yawpl._dumpJson(value))
+        self.assertEqual(restored, value)
+        self.assertTrue(type(restored['id']) is str)
+        self.assertTrue(isinstance(restored['date'], xmlrpclib.DateTime))
+        self.assertEqual(restored['bits'].data, '\x00\xff')
+#}}}
+
+class ItemTest(unittest.TestCase): #{{{
+
+    def post(self, i):
+        return {'postid': str(i), 'title': 'Post %d' % i,
+                'dateCreated': xmlrpclib.DateTime('20090412T10:00:00'),
+                'categories': ['one', 'two'], 'mt_allow_pings': 1,
+                'post_status': 'draft', 'unknown': 'dropped'}
+
+    def testFromStructs(self):
+        posts = yawpl.WordPressPost.fromStructs([self.post(1), self.post(2)])
+        self.assertEqual([type(post) for post in posts],
+                         [yawpl.WordPressPost] * 2)
+        self.assertEqual([post.id for post in posts], [1, 2])
+        expected = self.post(2)
+        del expected['unknown']
+        self.assertEqual(posts[1].struct(), expected)
+        self.assertEqual(yawpl.WordPressPost.fromStructs([]), [])
+
+    def testLazyDecoding(self):
+        post = yawpl.WordPressPost.fromStruct(self.post(3))
+        slot = yawpl.WordPressPost._f_date
+        self.assertRaises(AttributeError, slot.__get__, post)
+        self.assertEqual(post.date.tm_year, 2009)
+        self.assertTrue(slot.__get__(post) is post.date)
+        self.assertTrue(post.allowPings is True)
+        self.assertEqual(post.keywords, '')
+        self.assertEqual(post.changedFields(), [])
+        post.title = 'Changed'
+        self.assertEqual(post.changedFields(), ['title'])
+        self.assertEqual(post.originalValue('title'), 'Post 3')
+
+    def testPickle(self):
+        post = yawpl.WordPressPost.fromStruct(self.post(4))
+        post.title = 'Changed'
+        comment = yawpl.WordPressComment()
+        comment.content = 'new'
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            restored = pickle.loads(pickle.dumps(post, protocol))
+            self.assertEqual(restored.struct(), post.struct())
+            self.assertEqual(restored.title, 'Changed')
+            self.assertEqual(restored.date, post.date)
+            self.assertEqual(restored.categories, ['one', 'two'])
+            self.assertEqual(restored.changedFields(), ['title'])
+            restored = pickle.loads(pickle.dumps(comment, protocol))
+            self.assertEqual(restored.content, 'new')
+            self.assertEqual(restored.struct(), {})
+#}}}
+
+class ParserTest(unittest.TestCase): #{{{
+
+    def parse(self, value, itemClass=None, items=None):
+        parser, close = yawpl._responseParser(itemClass, items)
+        parser.Parse(xmlrpclib.dumps((value,), methodresponse=True), False)
+        return close()[0]
+
+    def tag(self, i):
+        return {'tag_id': str(i), 'name': 'tag%d' % i, 'slug': 'tag%d' % i,
+                'count': i, 'html_url': 'http://x/%d' % i,
+                'rss_url': 'http://x/feed/%d' % i}
+
+    def testValuesMatchXmlrpclib(self):
+        value = [{'a': 1, 'b': [True, None, 'x', u'\xe9', 2.5]},
+                 xmlrpclib.DateTime('20090412T10:00:00'),
+                 xmlrpclib.Binary('\x00\x01')]
+        parser, close = yawpl._responseParser()
+        parser.Parse(xmlrpclib.dumps((value,), methodresponse=True,
+                                     allow_none=True), False)
+        self.assertEqual(close(), xmlrpclib.loads(xmlrpclib.dumps((value,),
+            methodresponse=True, allow_none=True))[0])
+
+    def testStructsBuildItems(self):
+        tags = self.parse([self.tag(1), self.tag(2)], yawpl.WordPressTag)
+        self.assertEqual([type(tag) for tag in tags], [yawpl.WordPressTag] * 2)
+        self.assertEqual([tag.name for tag in tags], ['tag1', 'tag2'])
+        self.assertEqual(tags[0].struct(), self.tag(1))
+
+    def testStructsMissingKeysStayDicts(self):
+        partial = {'name': 'tag3', 'count': 3}
+        tags = self.parse([self.tag(1), partial], yawpl.WordPressTag)
+        self.assertTrue(isinstance(tags[0], yawpl.WordPressTag))
+        self.assertEqual(tags[1], partial)
+        error = {'faultCode': 1, 'faultString': 'no'}
+        self.assertEqual(self.parse(error, yawpl.WordPressTag), error)
+
+    def testStreamedItems(self):
+        items = []
+        self.assertEqual(self.parse([self.tag(1), {'name': 'x'}],
+                                    yawpl.WordPressTag, items), [])
+        self.assertTrue(isinstance(items[0], yawpl.WordPressTag))
+        self.assertEqual(items[1], {'name': 'x'})
+#}}}
+
+class _BadRequestHandler(benchmark._FakeRequestHandler): #{{{
+    """Answer 400 to gzip encoded requests, or to all large requests when
+    the server rejects them
+    """
+    def do_POST(self):
+        size = int(self.headers.get('content-length', 0))
+        if (self.headers.get('content-encoding') == 'gzip' or
+                size > self.server.blog.maxRequestSize):
+            self.rfile.read(size)
+            self.send_response(400)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        benchmark._FakeRequestHandler.do_POST(self)
+#}}}
+
+class _BadRequestServer(benchmark.FakeWordPressServer): #{{{
+    requestHandler = _BadRequestHandler
+    maxRequestSize = 1 << 20
+#}}}
+
+class CompressionTest(_ServerTestCase): #{{{
+
+    def setUp(self):
+        self.blog = _BadRequestServer(posts=20, postSize=200)
+        self.url = self.blog.start()
+
+    def largePost(self):
+        post = yawpl.WordPressPost()
+        post.title = 'large'
+        post.description = 'text ' * 1000
+        return post
+
+    def testHostRejectingGzip(self):
+        client = self.client()
+        list(client.getRecentPosts(20))
+        gzipHosts = client._transport._gzipHosts
+        self.assertEqual(gzipHosts[client._host], True)
+        postId = client.newPost(self.largePost(), False)
+        self.assertEqual(self.blog.posts[postId]['description'],
+                         'text ' * 1000)
+        self.assertEqual(gzipHosts[client._host], False)
+
+    def testBadRequestKeepsGzip(self):
+        self.blog.maxRequestSize = 1024
+        client = self.client()
+        list(client.getRecentPosts(20))
+        self.assertRaises(xmlrpclib.ProtocolError, client.newPost,
+                          self.largePost(), False)
+        self.assertEqual(client._transport._gzipHosts[client._host], True)
+#}}}
+
+class FleetTest(_ServerTestCase): #{{{
+
+    def fleet(self, sites, **options):
+        fleet = yawpl.WordPressFleet(**options)
+        for blogId in range(sites):
+            fleet.add(self.url, benchmark.USER, benchmark.PASSWORD, blogId)
+        self.addCleanup(fleet.close)
+        return fleet
+
+    def testMaxPerHostAcrossMaps(self):
+        state = self.track('metaWeblog.getPost')
+        # the pool of the host allows more connections than the fleet
+        self.client(maxConnections=8).getPost(1)
+        fleet = self.fleet(6, maxPerHost=2)
+        results = []
+        # different posts, identical calls of a client would be coalesced
+        threads = [threading.Thread(target=lambda postId: results.extend(
+                   fleet.map('getPost', postId)), args=(i + 1,))
+                   for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 12)
+        self.assertEqual(state['peak'], 2)
+
+    def testWritesAreNotRetried(self):
+        self.blog.stop()
+        self.blog = _LostResponseServer(posts=3)
+        self.url = self.blog.start()
+        fleet = self.fleet(1, retries=2, backoff=0)
+        post = yawpl.WordPressPost()
+        post.title = 'once'
+        [(client, error)] = fleet.map('newPost', post, False)
+        self.assertTrue(isinstance(error, xmlrpclib.ProtocolError))
+        self.assertEqual(self.blog.calls['metaWeblog.newPost'], 1)
+        [(client, error)] = fleet.map('getPost', 1)
+        self.assertTrue(isinstance(error, xmlrpclib.ProtocolError))
+        self.assertEqual(self.blog.calls['metaWeblog.getPost'], 3)
+        fleet.retriedMethods.add('newPost')
+        fleet.map('newPost', post, False).next()
+        self.assertEqual(self.blog.calls['metaWeblog.newPost'], 4)
+#}}}
+
+class HedgeTest(_ServerTestCase): #{{{
+
+    def slowFirstCall(self, methodName, delay=0.3):
+        method = self.blog._methods[methodName]
+        calls = []
+        def slow(*params):
+            calls.append(params)
+            if len(calls) == 1:
+                time.sleep(delay)
+            return method(*params)
+        self.blog._methods[methodName] = slow
+
+    def events(self, client):
+        events = []
+        client.afterCall.append(events.append)
+        return events
+
+    def testWinnerIsCounted(self):
+        plain = self.client(compress=False)
+        events = self.events(plain)
+        plain.getPost(3)
+        self.slowFirstCall('metaWeblog.getPost')
+        client = self.client(hedgeAfter=0.05, compress=False)
+        hedged = self.events(client)
+        self.assertEqual(client.getPost(3).id, 3)
+        self.assertTrue(hedged[0].hedged)
+        # the slow attempt ends too without touching the event
+        time.sleep(0.4)
+        self.assertEqual(hedged[0].bytesReceived, events[0].bytesReceived)
+        self.assertEqual(hedged[0].bytesSent, events[0].bytesSent)
+        self.assertTrue(hedged[0].wallTime < 0.3)
+        self.assertEqual(self.blog.calls['metaWeblog.getPost'], 3)
+
+    def testNoHedgeWithoutFreeConnection(self):
+        self.slowFirstCall('metaWeblog.getPost')
+        client = self.client(hedgeAfter=0.05, maxConnections=1)
+        events = self.events(client)
+        self.assertEqual(client.getPost(3).id, 3)
+        self.assertFalse(events[0].hedged)
+        self.assertEqual(self.blog.calls['metaWeblog.getPost'], 1)
+#}}}
+
+class CommentIndexTest(unittest.TestCase): #{{{
+
+    def setUp(self):
+        self.blog = benchmark.FakeWordPressServer(posts=5, comments=40)
+        self.structs = dict((int(struct['comment_id']), dict(struct))
+                            for struct in self.blog.comments)
+        for commentId, struct in self.structs.items():
+            struct['parent'] = str(commentId // 3)
+            struct['status'] = ('approve', 'hold')[commentId % 2]
+            struct['author_email'] = 'Visitor%d@Example.com' % (commentId % 4)
+        self.index = yawpl.WordPressCommentIndex(self.structs.values())
+
+    def expected(self, **filters):
+        keys = {'postId': ('post_id', int), 'parent': ('parent', int),
+                'status': ('status', str),
+                'authorEmail': ('author_email', str.lower)}
+        ids = sorted(self.structs, reverse=True)
+        for name, value in filters.items():
+            key, normalize = keys[name]
+            ids = [commentId for commentId in ids if
+                   normalize(self.structs[commentId][key]) == normalize(value)]
+        return ids
+
+    def check(self):
+        self.assertEqual(len(self.index), len(self.structs))
+        self.assertEqual(self.index._ids, sorted(self.structs))
+        for filters in ({}, {'postId': 3}, {'status': 'hold'},
+                        {'postId': '2', 'status': 'approve'},
+                        {'authorEmail': 'visitor1@example.com'},
+                        {'parent': 4, 'status': 'hold'}):
+            expected = self.expected(**filters)
+            self.assertEqual([comment.id for comment
+                              in self.index.query(**filters)], expected)
+            self.assertEqual(self.index.count(**filters), len(expected))
+            self.assertEqual([comment.id for comment
+                              in self.index.query(limit=2, **filters)],
+                             expected[:2])
+        for commentId, struct in self.structs.items():
+            comment = self.index.get(commentId)
+            self.assertEqual(comment.content, struct['content'])
+            self.assertEqual(comment.postId, struct['post_id'])
+            self.assertEqual([reply.id for reply
+                              in self.index.replies(commentId)],
+                             sorted(self.expected(parent=commentId)))
+
+    def testLoad(self):
+        self.check()
+
+    def testUpdateReplacesComments(self):
+        changed = dict(self.structs[7], status='spam', post_id='3',
+                       content='edited')
+        added = dict(self.structs[1], comment_id='41', parent='7')
+        self.assertEqual(self.index.update([changed, added]), 1)
+        self.structs[7] = changed
+        self.structs[41] = added
+        self.check()
+        self.assertEqual(self.index.count(status='spam'), 1)
+        self.assertEqual(self.index.newestId(), 41)
+
+    def testRemoveReusesRows(self):
+        for commentId in (4, 9, 40):
+            self.assertTrue(self.index.remove(commentId))
+            del self.structs[commentId]
+        self.assertFalse(self.index.remove(9))
+        self.assertFalse(9 in self.index)
+        self.assertEqual(self.index.get(9), None)
+        self.check()
+        added = dict(self.structs[1], comment_id='50', post_id='4')
+        self.index.update([yawpl.WordPressComment.fromStruct(added)])
+        self.structs[50] = added
+        self.check()
+        self.assertEqual(self.index.newestId(), 50)
+        self.assertEqual(len(self.index._columns[0]), 40)
+#}}}
+
+class EditTest(_ServerTestCase): #{{{
+
+    def setUp(self):
+        _ServerTestCase.setUp(self)
+        self.blog.posts[4]['post_status'] = 'draft'
+        self.sent = []
+        editPost = self.blog._methods['metaWeblog.editPost']
+        def recordedEditPost(postId, user, password, content, publish):
+            self.sent.append((content, publish))
+            return editPost(postId, user, password, content, publish)
+        self.blog._methods['metaWeblog.editPost'] = recordedEditPost
+
+    def testUnchangedPostSendsNothing(self):
+        client = self.client()
+        post = client.getPost(3)
+        client.editPost(3, post, False)
+        self.assertEqual(self.sent, [])
+        self.assertFalse('mt.setPostCategories' in self.blog.calls)
+
+    def testOnlyChangedFieldsAreSent(self):
+        client = self.client()
+        post = client.getPost(3)
+        post.title = 'changed'
+        self.assertEqual(post.changedFields(), ['title'])
+        client.editPost(3, post, False)
+        self.assertEqual(self.sent, [({'title': 'changed'}, 1)])
+        self.assertEqual(self.blog.posts[3]['post_status'], 'publish')
+        self.assertEqual(post.changedFields(), [])
+        client.editPost(3, post, False)
+        self.assertEqual(len(self.sent), 1)
+        post.textMore = 'more'
+        client.editPost(3, post, False)
+        self.assertEqual(sorted(self.sent[1][0]),
+                         ['description', 'mt_text_more'])
+
+    def testDraftKeepsItsStatus(self):
+        client = self.client()
+        post = client.getPost(4)
+        post.excerpt = 'short'
+        client.editPost(4, post, False)
+        self.assertEqual(self.sent, [({'mt_excerpt': 'short',
+                                       'post_status': 'draft'}, 0)])
+        self.assertEqual(self.blog.posts[4]['post_status'], 'draft')
+        client.editPost(4, post, True)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.blog.posts[4]['post_status'], 'publish')
+        self.assertEqual(post.status, 'publish')
+        self.assertEqual(post.changedFields(), [])
+
+    def testCategoriesOnlyWhenChanged(self):
+        client = self.client()
+        post = client.getPost(3)
+        post.categories = [1, 2]
+        client.editPost(3, post, False)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(self.blog.calls['mt.setPostCategories'], 1)
+        client.editPost(3, post, False)
+        self.assertEqual(self.blog.calls['mt.setPostCategories'], 1)
+
+    def testBulkEditSkipsUnchangedPosts(self):
+        client = self.client()
+        posts = [client.getPost(postId) for postId in (3, 5, 6)]
+        posts[1].title = 'changed'
+        results = dict(client.bulkEditPosts(posts, backoff=0))
+        self.assertEqual(results, {0: None, 1: None, 2: None})
+        self.assertEqual(self.sent, [({'title': 'changed'}, 1)])
+
+    def projected(self, client, fields, postId):
+        [post] = [post for post in client.iterPosts(fields=fields)
+                  if post.id == postId]
+        return post
+
+    def testProjectedPostKeepsItsStatus(self):
+        client = self.client()
+        for postId in (3, 4):
+            post = self.projected(client, ('id', 'title'), postId)
+            post.title = 'changed'
+            client.editPost(postId, post, False)
+        self.assertEqual(self.blog.posts[3]['post_status'], 'publish')
+        self.assertEqual(self.blog.posts[4]['post_status'], 'draft')
+        self.assertEqual([publish for content, publish in self.sent], [1, 0])
+        self.assertEqual(self.sent[1][0]['post_status'], 'draft')
+        [post] = [post for post in client.getRecentPosts(20,
+                  fields=('id', 'excerpt')) if post.id == 3]
+        self.assertEqual(post.status, 'publish')
+
+    def testPostWithoutStatusIsNotDrafted(self):
+        self.blog.posts[4]['post_status'] = 'draft'
+        client = self.client()
+        self.assertEqual(client._postListMethod(('id', 'title')),
+                         'mt.getRecentPostTitles')
+        posts = dict((post.id, post) for post in
+                     client.getRecentPosts(20, fields=('id', 'title')))
+        posts[3].title = 'published'
+        client.editPost(3, posts[3], True)
+        self.assertEqual(self.blog.posts[3]['post_status'], 'publish')
+        self.assertEqual(self.sent, [({'title': 'published'}, 1)])
+        self.assertEqual(posts[3].status, 'publish')
+        self.assertEqual(self.blog.calls.get('mt.publishPost'), None)
+        posts[5].title = 'unknown status'
+        self.assertRaises(yawpl.WordPressException, client.editPost, 5,
+                          posts[5], False)
+        self.assertEqual(self.blog.posts[5]['title'], 'Post 5')
+        self.assertEqual(self.blog.posts[5]['post_status'], 'publish')
+        self.assertEqual(len(self.sent), 1)
+        # an unchanged post can still be published
+        client.editPost(4, posts[4], True)
+        self.assertEqual(self.blog.posts[4]['post_status'], 'publish')
+        # listed with their status the posts keep it
+        self.blog.posts[6]['post_status'] = 'draft'
+        posts = dict((post.id, post) for post in client.getRecentPosts(20,
+                     fields=('id', 'title', 'status')))
+        self.assertEqual(posts[6].status, 'draft')
+        posts[6].title = 'still a draft'
+        client.editPost(6, posts[6], False)
+        self.assertEqual(self.blog.posts[6]['post_status'], 'draft')
+        self.assertEqual(self.blog.posts[6]['title'], 'still a draft')
+
+    def testUnknownFieldsRaiseAtCall(self):
+        client = self.client()
+        self.assertRaises(ValueError, client.getRecentPosts, 5,
+                          fields=('id', 'colour'))
+        self.assertRaises(ValueError, client.iterPosts, fields=('colour',))
+#}}}
+
+class MediaIndexTest(_ServerTestCase): #{{{
+
+    def setUp(self):
+        _ServerTestCase.setUp(self)
+        self.path = tempfile.mktemp(suffix='.db')
+        self.addCleanup(os.remove, self.path)
+        self.media = tempfile.mktemp(suffix='.png')
+        self.addCleanup(os.remove, self.media)
+        self.data = '\x89PNG' + os.urandom(5000)
+        with open(self.media, 'wb') as f:
+            f.write(self.data)
+
+    def index(self):
+        index = yawpl.WordPressMediaIndex(self.path)
+        self.addCleanup(index.close)
+        return index
+
+    def uploads(self):
+        return (self.blog.calls.get('metaWeblog.newMediaObject', 0) +
+                self.blog.calls.get('wp.uploadFile', 0))
+
+    def testSameBytesUploadedOnce(self):
+        client = self.client(mediaIndex=self.index())
+        url = client.newMediaObject(self.media)
+        self.assertEqual(client.newMediaObject(self.media), url)
+        self.assertEqual(client.newMediaObject(StringIO(self.data),
+                                               'copy.png'), url)
+        self.assertEqual(self.uploads(), 1)
+        client.newMediaObject(StringIO(self.data + 'x'), 'other.png')
+        self.assertEqual(self.uploads(), 2)
+        # another blog of the same site has its own media
+        client.selectBlog(2)
+        client.newMediaObject(self.media)
+        self.assertEqual(self.uploads(), 3)
+
+    def testHashing(self):
+        index = self.index()
+        expected = (hashlib.sha256(self.data).hexdigest(), len(self.data))
+        self.assertEqual(index.hashFile(self.media), expected)
+        stream = StringIO('head' + self.data)
+        stream.seek(4)
+        self.assertEqual(index.hashFile(stream), expected)
+        self.assertEqual(stream.tell(), 4)
+        # a stream that can not be rewound is not hashed
+        self.assertEqual(index.hashFile(iter([self.data])), None)
+        # an unchanged file is not read again, a modified one is
+        hashed = []
+        hashStream = index._hashStream
+        index._hashStream = lambda f: hashed.append(f) or hashStream(f)
+        self.assertEqual(index.hashFile(self.media), expected)
+        self.assertEqual(hashed, [])
+        with open(self.media, 'ab') as f:
+            f.write('more')
+        self.assertEqual(index.hashFile(self.media),
+            (hashlib.sha256(self.data + 'more').hexdigest(),
+             len(self.data) + 4))
+        self.assertEqual(len(hashed), 1)
+
+    def testIndexPersists(self):
+        index = self.index()
+        url = self.client(mediaIndex=index).newMediaObject(self.media)
+        index.close()
+        index = self.index()
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.entries(),
+                         [(self.url, '0', index.hashFile(self.media)[0], url)])
+        client = self.client(mediaIndex=index)
+        self.assertEqual(client.newMediaObject(self.media), url)
+        self.assertEqual(self.uploads(), 1)
+        self.assertEqual(index.evict(url), 1)
+        self.assertEqual(client.newMediaObject(self.media), url)
+        self.assertEqual(self.uploads(), 2)
+#}}}
+
+class SnapshotTest(_ServerTestCase): #{{{
+
+    def setUp(self):
+        _ServerTestCase.setUp(self)
+        self.path = tempfile.mktemp(suffix='.db')
+        self.addCleanup(os.remove, self.path)
+
+    def snapshot(self):
+        snapshot = yawpl.WordPressSnapshot(self.path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def testRoundTrip(self):
+        client = self.client()
+        client.snapshot = self.snapshot()
+        client.refreshSnapshot()
+        data, saved = self.snapshot().load(client.url, client.user,
+                                           client.blogId)
+        self.assertEqual(data, {
+            'blogs'         : self.blog.getUsersBlogs('', client.user,
+                                                      client.password),
+            'categories'    : self.blog.categories,
+            'tags'          : self.blog.tags,
+            'methods'       : self.blog.supportedMethods(),
+        })
+        self.blog.calls.clear()
+        client = self.client(snapshot=self.snapshot())
+        self.assertEqual([tag.name for tag in client.getTags()],
+                         [tag['name'] for tag in self.blog.tags])
+        self.assertEqual(len(client.getCategoryList()), 5)
+        self.assertTrue(client.supportsMethod('wp.getPosts'))
+        self.assertEqual(self.blog.calls, {})
+
+    def waitForRefresh(self, client, calls):
+        for i in range(100):
+            if (self.blog.calls.get('wp.getTags', 0) >= calls and
+                    not client._refreshing.locked()):
+                return
+            time.sleep(0.02)
+        self.fail('snapshot was not refreshed')
+
+    def testExpiredSnapshotIsRefreshed(self):
+        client = self.client()
+        client.snapshot = self.snapshot()
+        client.refreshSnapshot()
+        snapshot = self.snapshot()
+        snapshot.maxAge = 0.2
+        client = self.client(snapshot=snapshot)
+        self.blog.calls.clear()
+        self.blog.tags.append(self.blog._tag(len(self.blog.tags) + 1))
+        names = [tag['name'] for tag in self.blog.tags]
+        self.assertEqual(len(list(client.getTags())), len(names) - 1)
+        time.sleep(0.3)
+        # the stale tags are served once more while they are refreshed
+        self.assertEqual(len(list(client.getTags())), len(names) - 1)
+        self.waitForRefresh(client, 1)
+        self.assertEqual([tag.name for tag in client.getTags()], names)
+        self.assertEqual(self.blog.calls.get('wp.getTags'), 1)
+        data, saved = snapshot.load(client.url, client.user, client.blogId)
+        self.assertEqual([tag['name'] for tag in data['tags']], names)
+
+    def testNewKeywordsInvalidateTags(self):
+        client = self.client()
+        client.snapshot = self.snapshot()
+        client.refreshSnapshot()
+        client = self.client(snapshot=self.snapshot())
+        self.blog.calls.clear()
+        post = yawpl.WordPressPost()
+        post.title = 'Tagged'
+        post.keywords = 'fresh'
+        postId = client.newPost(post, True)
+        self.assertTrue('fresh' in [tag.name for tag in client.getTags()])
+        self.waitForRefresh(client, 2)
+        post = client.getPost(postId)
+        post.keywords = 'fresh, fresher'
+        client.editPost(postId, post, True)
+        self.assertTrue('fresher' in [tag.name for tag in client.getTags()])
+
+    def testPickledSnapshotIsDropped(self):
+        db = sqlite3.connect(self.path)
+        db.executescript(yawpl._snapshotSchema)
+        with db:
+            db.execute('INSERT INTO snapshots VALUES (?, ?, ?, 1, ?, ?)',
+                       (self.url, benchmark.USER, '0', time.time(),
+                        sqlite3.Binary('cos\nsystem\n.')))
+        db.close()
+        snapshot = self.snapshot()
+        self.assertEqual(snapshot.load(self.url, benchmark.USER, 0), None)
+        self.assertEqual(snapshot._db.execute('SELECT COUNT(*) FROM '
+                                              'snapshots').fetchone()[0], 0)
+#}}}
+
+class TemplateTest(_ServerTestCase): #{{{
+
+    def check(self, client, methodName, *params):
+        self.assertEqual(client._dumps(methodName, params),
+                         xmlrpclib.dumps(params, methodName))
+
+    def testDumpsMatchesXmlrpclib(self):
+        client = self.client()
+        user, password = client.user, client.password
+        for postId in ('3', '4', 5, 5L, -1, client.blogId):
+            self.check(client, 'metaWeblog.getPost', postId, user, password)
+        self.check(client, 'metaWeblog.editPost', 5, user, password, {
+            'title'             : u'caf\xe9 <b>&amp;</b>',
+            'description'       : 'plain & <escaped>',
+            'mt_allow_pings'    : True,
+            'mt_excerpt'        : u'',
+            'dateCreated'       : xmlrpclib.DateTime('20090101T10:00:00'),
+            'categories'        : ['one', u'two'],
+            'score'             : 1.5,
+        }, 0)
+        self.check(client, 'metaWeblog.newMediaObject', client.blogId, user,
+                   password, {'name': 'a.png', 'type': 'image/png',
+                              'bits': xmlrpclib.Binary('\x00\xff<&')})
+        self.check(client, 'wp.getComments', client.blogId, user, password,
+                   {'post_id': 3, 'number': 10, 'offset': 0})
+        self.check(client, u'wp.getTags', client.blogId, user, password)
+
+    def testConstantsFollowTheClient(self):
+        client = self.client()
+        self.check(client, 'wp.getTags', client.blogId, client.user,
+                   client.password)
+        # equal values that are other objects, then another password
+        self.check(client, 'wp.getTags', client.blogId, client.user,
+                   ''.join(list(client.password)))
+        self.check(client, 'wp.getTags', client.blogId, client.user,
+                   client.password)
+        client.password = 'another'
+        self.check(client, 'wp.getTags', client.blogId, client.user,
+                   client.password)
+        self.check(client, 'wp.getTags', client.user, client.user,
+                   client.password)
+        self.assertRaises(yawpl.WordPressException, client.getTags().next)
+#}}}
+
+class ImportTest(_ServerTestCase): #{{{
+
+    def setUp(self):
+        _ServerTestCase.setUp(self)
+        post = self.blog.posts[2]
+        post.update(mt_excerpt='short', mt_allow_comments=0, wp_slug='second',
+                    userid='2', post_status='pending')
+        self.blog.posts[3]['description'] += \
+            '<img src="http://example.com/wp-content/uploads/a.png">'
+        self.blog.tags[0]['name'] = 'shared'
+        self.target = benchmark.FakeWordPressServer(posts=0, comments=0,
+                                                    categories=5, tags=1)
+        self.target.tags[0]['name'] = 'shared'
+        self.addCleanup(self.target.stop)
+        self.targetUrl = self.target.start()
+
+    def replay(self):
+        stream = StringIO()
+        self.client().exportBlog(stream)
+        stream.seek(0)
+        client = yawpl.WordPressClient(self.targetUrl, benchmark.USER,
+                                       benchmark.PASSWORD)
+        return client.importBlog(stream, backoff=0)
+
+    def testPostsKeepTheirFields(self):
+        result = self.replay()
+        self.assertEqual(result['post'], 20)
+        [post] = [post for post in self.target.posts.values()
+                  if post['title'] == 'Post 2']
+        self.assertEqual(post['mt_excerpt'], 'short')
+        self.assertEqual(post['mt_allow_comments'], 0)
+        self.assertEqual(post['wp_slug'], 'second')
+        self.assertEqual(post['userid'], '2')
+        self.assertEqual(post['post_status'], 'pending')
+        [post] = [post for post in self.target.posts.values()
+                  if post['title'] == 'Post 3']
+        self.assertEqual(post['post_status'], 'publish')
+
+    def testTagsAreCreatedAndMediaFails(self):
+        result = self.replay()
+        self.assertEqual(result['tag'], 5)
+        self.assertEqual(sorted(tag['name'] for tag in self.target.tags),
+                         ['shared', 'tag2', 'tag3', 'tag4', 'tag5'])
+        [(kind, postId, error)] = result['failed']
+        self.assertEqual((kind, postId), ('media', 3))
+        self.assertTrue('/wp-content/uploads/a.png' in str(error))
+
+    def testTagsFailWithoutNewTerm(self):
+        del self.target._methods['wp.newTerm']
+        result = self.replay()
+        self.assertFalse('tag' in result)
+        self.assertEqual([kind for kind, oldId, error in result['failed']],
+                         ['tag'] * 5 + ['media'])
+
+    def testResumeAfterTruncatedStream(self):
+        self.blog.comments[5]['parent'] = '3'
+        source = StringIO()
+        self.client().exportBlog(source)
+        lines = source.getvalue().splitlines(True)
+        comments = [i for i, line in enumerate(lines)
+                    if json.loads(line)['type'] == 'comment']
+        self.assertEqual(len(comments), 30)
+        # the stream ends inside the record of the twelfth comment
+        cut = comments[11]
+        truncated = StringIO(''.join(lines[:cut]) + lines[cut][:25])
+        checkpoint = tempfile.mktemp(suffix='.db')
+        self.addCleanup(os.remove, checkpoint)
+        client = yawpl.WordPressClient(self.targetUrl, benchmark.USER,
+                                       benchmark.PASSWORD)
+        self.assertRaises(ValueError, client.importBlog, truncated,
+                          checkpoint, batchSize=4, backoff=0)
+        self.assertEqual(len(self.target.posts), 20)
+        done = len(self.target.comments)
+        self.assertTrue(0 < done <= 11)
+        result = client.importBlog(StringIO(source.getvalue()), checkpoint,
+                                   batchSize=4, backoff=0)
+        self.assertFalse('post' in result)
+        self.assertEqual(result['comment'], 30 - done)
+        self.assertEqual([kind for kind, oldId, error in result['failed']],
+                         [])
+        titles = sorted(post['title'] for post in self.target.posts.values())
+        self.assertEqual(titles, sorted('Post %d' % i for i in range(1, 21)))
+        contents = [comment['content'] for comment in self.target.comments]
+        self.assertEqual(sorted(contents),
+                         sorted('Comment %d' % i for i in range(1, 31)))
+        newIds = dict((comment['content'], comment['comment_id'])
+                      for comment in self.target.comments)
+        [reply] = [comment for comment in self.target.comments
+                   if comment['content'] == 'Comment 6']
+        self.assertEqual(reply['parent'], newIds['Comment 3'])
+        posts = dict((post['title'], postId) for postId, post
+                     in self.target.posts.items())
+        for comment in self.blog.comments:
+            [copy] = [item for item in self.target.comments
+                      if item['content'] == comment['content']]
+            self.assertEqual(int(copy['post_id']),
+                             posts[comment['post_title']])
+#}}}
+
+class TransportTest(_ServerTestCase): #{{{
+
+    def requestItems(self, methodName, *params):
+        transport = yawpl.WordPressTransport()
+        host = self.url.split('/')[2]
+        return list(transport.requestItems(host, '/xmlrpc.php',
+                                           xmlrpclib.dumps(params, methodName)))
+
+    def testRequestItemsYieldsArrayElements(self):
+        posts = self.requestItems('metaWeblog.getRecentPosts', 1,
+                                  benchmark.USER, benchmark.PASSWORD, 3)
+        self.assertEqual([post['postid'] for post in posts], ['20', '19', '18'])
+
+    def testRequestItemsYieldsSingleValue(self):
+        posts = self.requestItems('metaWeblog.getPost', '3', benchmark.USER,
+                                  benchmark.PASSWORD)
+        self.assertEqual([post['postid'] for post in posts], ['3'])
+        self.assertEqual(self.requestItems('mt.publishPost', '3',
+            benchmark.USER, benchmark.PASSWORD), [True])
+
+    def pool(self, maxConnections=4, idleTimeout=60.0):
+        host = self.url.split('/')[2]
+        # pools are shared by host for the whole process
+        self.addCleanup(yawpl._connectionPools.pop, ('http', host), None)
+        return yawpl.getConnectionPool('http', host, maxConnections,
+                                       idleTimeout)
+
+    def testIdleConnectionsExpire(self):
+        pool = self.pool(idleTimeout=0.1)
+        connection, reused = pool.acquire()
+        self.assertFalse(reused)
+        connection.connect()
+        pool.release(connection)
+        self.assertEqual(pool.acquire(), (connection, True))
+        pool.release(connection)
+        time.sleep(0.15)
+        fresh, reused = pool.acquire()
+        self.assertFalse(reused)
+        self.assertTrue(fresh is not connection)
+        self.assertEqual(connection.sock, None)
+        pool.release(fresh, False)
+        self.assertEqual(pool.available(), 4)
+
+    def testStaleSocketReconnects(self):
+        pool = self.pool()
+        client = self.client()
+        self.assertEqual(client.getPost(1).id, 1)
+        stale = pool._idle[-1][0]
+        # the server ends the keep-alive connection while it is idle
+        self.blog._server.closeConnections()
+        time.sleep(0.05)
+        self.assertEqual(client.getPost(2).id, 2)
+        self.assertEqual(len(pool._idle), 1)
+        self.assertTrue(pool._idle[0][0] is not stale)
+        self.assertEqual(self.blog.calls['metaWeblog.getPost'], 2)
+
+    def testThreadsCheckOutOwnConnections(self):
+        pool = self.pool(maxConnections=3)
+        lock = threading.Lock()
+        held = set()
+        state = {'peak': 0, 'shared': 0, 'done': 0}
+        def work():
+            for i in range(5):
+                connection, reused = pool.acquire()
+                with lock:
+                    state['shared'] += connection in held
+                    held.add(connection)
+                    state['peak'] = max(state['peak'], len(held))
+                time.sleep(0.01)
+                with lock:
+                    held.discard(connection)
+                pool.release(connection)
+            with lock:
+                state['done'] += 1
+        threads = [threading.Thread(target=work) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(state, {'peak': 3, 'shared': 0, 'done': 8})
+        self.assertEqual(len(pool._idle), 3)
+        self.assertEqual(pool.available(), 3)
+#}}}
+
+if __name__ == '__main__':
+    unittest.main()
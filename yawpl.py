@@ -65,8 +65,30 @@ import exceptions
 import re
 import os
 import xmlrpclib
+import httplib
+import socket
+import ssl
+import base64
+import zlib
+from xml.parsers import expat
+import asyncore
+import collections
+import Queue
+import sys
+import copy
+import hashlib
+import sqlite3
+import errno
+import urllib
+import threading
+import weakref
 import datetime
 import time
+import random
+import bisect
+import operator
+import json
+import tempfile
 from pprint import pprint
 
 class WordPressException(exceptions.Exception): #{{{
@@ -84,528 +106,5801 @@ class WordPressException(exceptions.Exception): #{{{
         return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.message)
 #}}}
         
-class WordPressBlog(object): #{{{
-    """Represents blog item
+class WordPressUser(object): #{{{
+    """Represents user item
     """ 
     def __init__(self):
         self.id = ''
-        self.name = ''
-        self.url = ''
-        self.isAdmin = False
+        self.firstName = ''
+        self.lastName = ''
+        self.nickname = ''
+        self.email = ''
+    def __str__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+
+    def __repr__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+#}}}
+        
+_isoDate = re.compile(r'(\d{4})-?(\d\d)-?(\d\d)T(\d\d):?(\d\d):?(\d\d)').match
+
+def _parseDate(value): #{{{
+    """Transform XML-RPC dateTime.iso8601 value in time.struct_time
+    """
+    value = str(value)
+    if len(value) == 17 and value[8] == 'T':
+        # 20090412T10:00:00, the format WordPress sends
+        try:
+            return datetime.datetime(int(value[:4]), int(value[4:6]),
+                int(value[6:8]), int(value[9:11]), int(value[12:14]),
+                int(value[15:17])).timetuple()
+        except ValueError:
+            pass
+    match = _isoDate(value)
+    if match is None:
+        return time.strptime(value, "%Y%m%dT%H:%M:%S")
+    return datetime.datetime(*map(int, match.groups())).timetuple()
+#}}}
+
+def _dateKey(value):
+    """Transform XML-RPC date value in sortable text
+    """
+    return time.strftime('%Y-%m-%dT%H:%M:%S', _parseDate(value))
+
+def _isTrue(value):
+    return value == 1
+
+def _intKey(value):
+    return int(value or 0)
+
+def _textKey(value):
+    return value or ''
+
+def _lowerKey(value):
+    return (value or '').lower()
+
+class _Field(object): #{{{
+    """Item attribute decoded from the raw values on first access
+    """
+    def __init__(self, slot, indexes, decode, default):
+        self.slot = slot
+        self.indexes = indexes
+        self.decode = decode
+        self.default = default
+
+    def __get__(self, item, cls):
+        if item is None:
+            return self
+        try:
+            return self.slot.__get__(item, cls)
+        except AttributeError:
+            pass
+        value = self.original(item)
+        self.slot.__set__(item, value)
+        return value
+
+    def __set__(self, item, value):
+        self.slot.__set__(item, value)
+
+    def original(self, item): #{{{
+        """Decode value item was loaded with
+        """
+        value = None
+        if item._raw is not None:
+            for index in self.indexes:
+                value = item._raw[index]
+                if value is not None:
+                    break
+        if value is None:
+            value = self.default
+            if callable(value):
+                value = value()
+        elif self.decode is not None:
+            value = self.decode(value)
+        return value
+    #}}}
+#}}}
+
+def _slots(fields):
+    return tuple('_f_' + field[0] for field in fields)
+
+def _lazyFields(cls): #{{{
+    """Class decorator installing _Field descriptors for cls._fields,
+    each field is (name, struct key or keys, decode function, default)
+    """
+    keys = []
+    keyIndex = {}
+    # keys of a field, a struct has one of them for each field
+    keyGroups = []
+    for name, fieldKeys, decode, default in cls._fields:
+        if isinstance(fieldKeys, basestring):
+            fieldKeys = (fieldKeys,)
+        keyGroups.append(fieldKeys)
+        indexes = tuple(range(len(keys), len(keys) + len(fieldKeys)))
+        slot = cls.__dict__['_f_' + name]
+        for key, index in zip(fieldKeys, indexes):
+            keyIndex[key] = (index, slot)
+        keys.extend(fieldKeys)
+        setattr(cls, name, _Field(slot, indexes, decode, default))
+    cls._keys = tuple(keys)
+    cls._keyIndex = keyIndex
+    cls._keyGroups = tuple(keyGroups)
+    return cls
+#}}}
+
+class _WordPressItem(object): #{{{
+    """Base of items built from XML-RPC structs. The struct values the
+    item uses are kept in a tuple, fields are decoded from it only when
+    first accessed.
+    """
+    __slots__ = ('_raw',)
+    _fields = ()
+    _keys = ()
+    _keyIndex = {}
+    _keyGroups = ()
+
+    def __init__(self):
+        self._raw = None
+
+    @classmethod
+    def fromStruct(cls, struct): #{{{
+        """Build item from XML-RPC struct
+        """
+        item = cls.__new__(cls)
+        item._raw = tuple(map(struct.get, cls._keys))
+        return item
+    #}}}
+
+    @classmethod
+    def fromStructs(cls, structs): #{{{
+        """Build items list from XML-RPC structs
+        """
+        keys = cls._keys
+        raws = [tuple(map(struct.get, keys)) for struct in structs]
+        items = map(cls.__new__, [cls] * len(raws))
+        map(_WordPressItem._raw.__set__, items, raws)
+        return items
+    #}}}
+
+    def struct(self): #{{{
+        """Get XML-RPC struct values item was built from
+        """
+        if self._raw is None:
+            return {}
+        return dict((key, value) for key, value in zip(self._keys, self._raw)
+                    if value is not None)
+    #}}}
+
+    def __getstate__(self): #{{{
+        """Get struct values and every field, fields not accessed yet are
+        decoded. Items have no __dict__, pickle protocols 0 and 1 need it.
+        """
+        return self._raw, dict((field[0], getattr(self, field[0]))
+                               for field in self._fields)
+    #}}}
+
+    def __setstate__(self, state): #{{{
+        self._raw, values = state
+        for name, value in values.iteritems():
+            setattr(self, name, value)
+    #}}}
+
+    def originalValue(self, name): #{{{
+        """Get value of field name as the item was loaded
+        """
+        return getattr(self.__class__, name).original(self)
+    #}}}
+
+    def changedFields(self): #{{{
+        """Get names of fields set to another value than the one the item
+        was loaded with
+        """
+        cls = self.__class__
+        changed = []
+        for field in cls._fields:
+            descriptor = getattr(cls, field[0])
+            try:
+                value = descriptor.slot.__get__(self, cls)
+            except AttributeError:
+                continue
+            if value != descriptor.original(self):
+                changed.append(field[0])
+        return changed
+    #}}}
+
+    def _rebase(self, struct): #{{{
+        """Make struct values the ones the item was loaded with, fields
+        they belong to are decoded from them again
+        """
+        raw = list(self._raw or (None,) * len(self._keys))
+        for key, value in struct.iteritems():
+            index, slot = self._keyIndex.get(key, (None, None))
+            if index is None:
+                continue
+            raw[index] = value
+            try:
+                slot.__delete__(self)
+            except AttributeError:
+                pass
+        self._raw = tuple(raw)
+    #}}}
+#}}}
+
+@_lazyFields
+class WordPressCategory(_WordPressItem): #{{{
+    """Represents category item
+    """ 
+    _fields = (
+        ('id',          ('categoryId', 'category_id'),      int,    0),
+        ('parentId',    'parentId',                         int,    0),
+        ('name',        ('categoryName', 'category_name'),  None,   ''),
+        ('slug',        'slug',                             None,   ''),
+        ('description', 'categoryDescription',              None,   ''),
+        ('rssUrl',      'rssUrl',                           None,   ''),
+        ('htmlUrl',     'htmlUrl',                          None,   ''),
+        ('isPrimary',   'isPrimary',                        None,   False),
+    )
+    __slots__ = _slots(_fields)
+    
+    def __str__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+
+    def __repr__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+#}}}
+
+@_lazyFields
+class WordPressComment(_WordPressItem): #{{{
+    """Represents comment item
+    """ 
+    _fields = (
+        ('id',          'comment_id',   int,    0),
+        ('userId',      'user_id',      None,   ''),
+        ('parent',      'parent',       None,   ''),
+        ('status',      'status',       None,   ''),
+        ('content',     'content',      None,   ''),
+        ('link',        'link',         None,   ''),
+        ('postId',      'post_id',      None,   0),
+        ('postTitle',   'post_title',   None,   ''),
+        ('author',      'author',       None,   ''),
+        ('authorUrl',   'author_url',   None,   ''),
+        ('authorEmail', 'author_email', None,   ''),
+        ('authorIp',    'author_ip',    None,   ''),
+        ('date',        'date_created_gmt', _parseDate, None),
+    )
+    __slots__ = _slots(_fields)
+
+    def __str__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.content)
+
+    def __repr__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.content)
+#}}}
+
+@_lazyFields
+class WordPressPost(_WordPressItem): #{{{
+    """Represents post item
+    """ 
+    _fields = (
+        ('id',              'postid',               int,        0),
+        ('title',           'title',                None,       ''),
+        ('date',            'dateCreated',          _parseDate, None),
+        ('permaLink',       'permaLink',            None,       ''),
+        ('description',     'description',          None,       ''),
+        ('textMore',        'mt_text_more',         None,       ''),
+        ('excerpt',         'mt_excerpt',           None,       ''),
+        ('link',            'link',                 None,       ''),
+        ('categories',      'categories',           list,       list),
+        ('user',            'userid',               None,       ''),
+        ('allowPings',      'mt_allow_pings',       _isTrue,    False),
+        ('allowComments',   'mt_allow_comments',    _isTrue,    False),
+        ('keywords',        'mt_keywords',          None,       ''),
+        ('status',          'post_status',          None,       ''),
+        ('slug',            'wp_slug',              None,       ''),
+    )
+    __slots__ = _slots(_fields)
+
+    def __str__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.title)
+
+    def __repr__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.title)
+#}}}
+
+@_lazyFields
+class WordPressTag(_WordPressItem): #{{{
+    """Represents tag item
+    """ 
+    _fields = (
+        ('id',      'tag_id',   int,    0),
+        ('name',    'name',     None,   ''),
+        ('rssUrl',  'rss_url',  None,   ''),
+        ('htmlUrl', 'html_url', None,   ''),
+        ('slug',    'slug',     None,   ''),
+        ('count',   'count',    int,    0),
+    )
+    __slots__ = _slots(_fields)
+
+    def __str__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+
+    def __repr__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+#}}}
+
+@_lazyFields
+class WordPressBlog(_WordPressItem): #{{{
+    """Represents blog item
+    """ 
+    _fields = (
+        ('id',      'blogid',   None,   ''),
+        ('name',    'blogName', None,   ''),
+        ('url',     'url',      None,   ''),
+        ('isAdmin', 'isAdmin',  None,   False),
+    )
+    __slots__ = _slots(_fields)
+
     def __str__(self):
         return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
 
-    def __repr__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
-#}}}
-        
-class WordPressUser(object): #{{{
-    """Represents user item
-    """ 
-    def __init__(self):
-        self.id = ''
-        self.firstName = ''
-        self.lastName = ''
-        self.nickname = ''
-        self.email = ''
-    def __str__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+    def __repr__(self):
+        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+#}}}
+
+class WordPressCategoryStore(object): #{{{
+    """Categories indexed by id, name, slug and parent id.
+    The store expires ttl seconds after load, None keeps it forever.
+    It can be shared by threads, load() replaces the content at once.
+    """
+    def __init__(self, categories=None, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.clear()
+        if categories is not None:
+            self.load(categories)
+
+    def __len__(self):
+        return len(self._byId)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(self._byId.values())
+
+    def __contains__(self, categoryId):
+        return categoryId in self._byId
+
+    def _indexes(self):
+        return collections.OrderedDict(), {}, {}, {}
+
+    def clear(self): #{{{
+        """Remove all categories, store is expired until next load
+        """
+        with self._lock:
+            self._byId, self._byName, self._bySlug, self._byParent = \
+                self._indexes()
+            self.loadTime = None
+    #}}}
+
+    def load(self, categories): #{{{
+        """Replace content with categories
+        """
+        indexes = self._indexes()
+        for category in categories:
+            self._add(indexes, category)
+        with self._lock:
+            self._byId, self._byName, self._bySlug, self._byParent = indexes
+            self.loadTime = time.time()
+    #}}}
+
+    def expired(self): #{{{
+        if self.loadTime is None:
+            return True
+        return self.ttl is not None and time.time() - self.loadTime > self.ttl
+    #}}}
+
+    def add(self, category): #{{{
+        """Add or replace category
+        """
+        with self._lock:
+            self._add((self._byId, self._byName, self._bySlug,
+                       self._byParent), category)
+    #}}}
+
+    def _add(self, indexes, category): #{{{
+        byId, byName, bySlug, byParent = indexes
+        if category.id in byId:
+            self._remove(indexes, category.id)
+        byId[category.id] = category
+        byName.setdefault(category.name, []).append(category)
+        if category.slug:
+            bySlug[category.slug] = category
+        byParent.setdefault(category.parentId, []).append(category)
+    #}}}
+
+    def remove(self, categoryId): #{{{
+        """Remove category, return removed WordPressCategory or None
+        """
+        with self._lock:
+            return self._remove((self._byId, self._byName, self._bySlug,
+                                 self._byParent), categoryId)
+    #}}}
+
+    def _remove(self, indexes, categoryId): #{{{
+        byId, byName, bySlug, byParent = indexes
+        category = byId.pop(categoryId, None)
+        if category is None:
+            return None
+        for index, key in ((byName, category.name),
+                           (byParent, category.parentId)):
+            items = index[key]
+            items.remove(category)
+            if not items:
+                del index[key]
+        if bySlug.get(category.slug) is category:
+            del bySlug[category.slug]
+        return category
+    #}}}
+
+    def get(self, categoryId): #{{{
+        return self._byId.get(categoryId)
+    #}}}
+
+    def getByName(self, name): #{{{
+        """Get first category named name
+        """
+        categories = self._byName.get(name)
+        if categories:
+            return categories[0]
+    #}}}
+
+    def getBySlug(self, slug): #{{{
+        return self._bySlug.get(slug)
+    #}}}
+
+    def children(self, categoryId=0): #{{{
+        """Get direct children of category, top level categories for 0
+        """
+        with self._lock:
+            return list(self._byParent.get(categoryId, ()))
+    #}}}
+
+    def parent(self, categoryId): #{{{
+        category = self._byId.get(categoryId)
+        if category is not None:
+            return self._byId.get(category.parentId)
+    #}}}
+
+    def ancestors(self, categoryId): #{{{
+        """Get path from top level category down to category parent
+        """
+        path = []
+        category = self.parent(categoryId)
+        while category is not None and category not in path:
+            path.insert(0, category)
+            category = self.parent(category.id)
+        return path
+    #}}}
+
+    def descendants(self, categoryId=0): #{{{
+        """Get all categories below category, depth first
+        """
+        result = []
+        stack = self.children(categoryId)[::-1]
+        while stack:
+            category = stack.pop()
+            result.append(category)
+            stack.extend(self.children(category.id)[::-1])
+        return result
+    #}}}
+#}}}
+
+class WordPressCommentIndex(object): #{{{
+    """Comments of a blog kept column by column rather than as one item
+    each, indexed by post id, parent, status, author e-mail and author IP.
+    Queries build WordPressComment items only for the comments they
+    return. Repeated values such as e-mails and post titles are stored
+    once, dates are kept as text.
+    """
+    # indexed fields with their struct key and key normalization
+    _indexed = (
+        ('postId',      'post_id',      _intKey),
+        ('parent',      'parent',       _intKey),
+        ('status',      'status',       _textKey),
+        ('authorEmail', 'author_email', _lowerKey),
+        ('authorIp',    'author_ip',    _textKey),
+    )
+    # columns holding values shared by many comments
+    _internedKeys = frozenset(['user_id', 'parent', 'status', 'post_id',
+        'post_title', 'author', 'author_url', 'author_email', 'author_ip'])
+
+    def __init__(self, comments=None):
+        keys = WordPressComment._keys
+        self._idColumn = keys.index('comment_id')
+        self._dateColumn = keys.index('date_created_gmt')
+        self._interned = [key in self._internedKeys for key in keys]
+        self._indexedColumns = [keys.index(key) for name, key, normalize
+                                in self._indexed]
+        self._lock = threading.Lock()
+        self.clear()
+        if comments is not None:
+            self.load(comments)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self.query())
+
+    def __contains__(self, commentId):
+        return int(commentId) in self._rows
+
+    def clear(self): #{{{
+        """Remove all comments
+        """
+        with self._lock:
+            self._clear()
+    #}}}
+
+    def _clear(self):
+        self._columns = [[] for key in WordPressComment._keys]
+        # normalized values of indexed fields, and indexes of sorted ids
+        self._keyColumns = [[] for field in self._indexed]
+        self._indexes = [{} for field in self._indexed]
+        # comment id -> row, rows of removed comments, sorted ids
+        self._rows = {}
+        self._free = []
+        self._ids = []
+        self._values = {}
+        self.loadTime = None
+
+    def load(self, comments): #{{{
+        """Replace content with comments, WordPressComment items or
+        wp.getComments structs
+        """
+        raws = {}
+        for comment in comments:
+            raw = self._raw(comment)
+            raws[int(raw[self._idColumn])] = raw
+        ids = sorted(raws)
+        rows = map(raws.pop, ids)
+        columns = [map(operator.itemgetter(position), rows)
+                   for position in range(len(WordPressComment._keys))]
+        del rows
+        values = {}
+        intern = values.setdefault
+        for position, interned in enumerate(self._interned):
+            if interned:
+                columns[position] = map(intern, columns[position],
+                                        columns[position])
+        columns[self._idColumn] = ids
+        columns[self._dateColumn] = [date if date is None else str(date)
+                                     for date in columns[self._dateColumn]]
+        # rows are in ascending id order, so are the index lists
+        keyColumns = []
+        indexes = []
+        for field, position in zip(self._indexed, self._indexedColumns):
+            keys = map(field[2], columns[position])
+            keyColumns.append(map(intern, keys, keys))
+            index = collections.defaultdict(list)
+            for commentId, key in zip(ids, keyColumns[-1]):
+                index[key].append(commentId)
+            indexes.append(dict(index))
+        with self._lock:
+            self._columns = columns
+            self._keyColumns = keyColumns
+            self._indexes = indexes
+            self._rows = dict(zip(ids, xrange(len(ids))))
+            self._free = []
+            # the id column changes with the rows, keep an own list
+            self._ids = list(ids)
+            self._values = values
+            self.loadTime = time.time()
+    #}}}
+
+    def update(self, comments): #{{{
+        """Add or replace comments, return number of comments added
+        """
+        raws = [self._raw(comment) for comment in comments]
+        added = 0
+        with self._lock:
+            for raw in raws:
+                commentId = int(raw[self._idColumn])
+                added += commentId not in self._rows
+                self._insert(commentId, raw)
+        return added
+    #}}}
+
+    def remove(self, commentId): #{{{
+        """Remove comment, return True if it was in the index
+        """
+        commentId = int(commentId)
+        with self._lock:
+            row = self._rows.pop(commentId, None)
+            if row is None:
+                return False
+            self._unindex(commentId, row)
+            for column in self._columns:
+                column[row] = None
+            self._free.append(row)
+            del self._ids[bisect.bisect_left(self._ids, commentId)]
+            return True
+    #}}}
+
+    def _raw(self, comment): #{{{
+        if isinstance(comment, WordPressComment):
+            if comment._raw is not None:
+                return comment._raw
+            comment = {}
+        return tuple(map(comment.get, WordPressComment._keys))
+    #}}}
+
+    def _insert(self, commentId, raw): #{{{
+        row = self._rows.get(commentId)
+        if row is not None:
+            self._unindex(commentId, row)
+        else:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self._columns[0])
+                for column in self._columns:
+                    column.append(None)
+                for column in self._keyColumns:
+                    column.append(None)
+            bisect.insort(self._ids, commentId)
+        self._rows[commentId] = row
+        intern = self._values.setdefault
+        for column, value, interned in zip(self._columns, raw, self._interned):
+            if interned and value is not None:
+                value = intern(value, value)
+            column[row] = value
+        self._columns[self._idColumn][row] = commentId
+        date = raw[self._dateColumn]
+        if date is not None:
+            self._columns[self._dateColumn][row] = str(date)
+        for field, position, keyColumn, index in zip(self._indexed,
+                self._indexedColumns, self._keyColumns, self._indexes):
+            key = field[2](raw[position])
+            keyColumn[row] = key = intern(key, key)
+            ids = index.get(key)
+            if ids is None:
+                index[key] = [commentId]
+            else:
+                bisect.insort(ids, commentId)
+    #}}}
+
+    def _unindex(self, commentId, row): #{{{
+        for keyColumn, index in zip(self._keyColumns, self._indexes):
+            key = keyColumn[row]
+            ids = index[key]
+            del ids[bisect.bisect_left(ids, commentId)]
+            if not ids:
+                del index[key]
+            keyColumn[row] = None
+    #}}}
+
+    def _comment(self, commentId): #{{{
+        comment = WordPressComment.__new__(WordPressComment)
+        comment._raw = tuple(map(operator.itemgetter(self._rows[commentId]),
+                                 self._columns))
+        return comment
+    #}}}
+
+    def _filters(self, postId, parent, status, authorEmail, authorIp): #{{{
+        """Get (field position, normalized key) of given filters
+        """
+        filters = []
+        for position, value in enumerate((postId, parent, status,
+                                          authorEmail, authorIp)):
+            if value is not None:
+                filters.append((position, self._indexed[position][2](value)))
+        return filters
+    #}}}
+
+    def _select(self, filters, limit=None): #{{{
+        """Get ids of comments matching all filters, newest first. The
+        smallest index list is scanned, other filters are checked on the
+        key columns.
+        """
+        if filters:
+            candidates = sorted((len(self._indexes[position].get(key, ())),
+                                 position, key) for position, key in filters)
+            size, position, key = candidates[0]
+            ids = self._indexes[position].get(key, ())
+            checks = [(self._keyColumns[position], key)
+                      for size, position, key in candidates[1:]]
+        else:
+            ids = self._ids
+            checks = []
+        if not checks:
+            if limit is not None:
+                return ids[:-limit - 1:-1] if limit else []
+            return ids[::-1]
+        rows = self._rows
+        result = []
+        if limit == 0:
+            return result
+        for commentId in reversed(ids):
+            row = rows[commentId]
+            for keyColumn, key in checks:
+                if keyColumn[row] != key:
+                    break
+            else:
+                result.append(commentId)
+                if len(result) == limit:
+                    break
+        return result
+    #}}}
+
+    def get(self, commentId): #{{{
+        """Get WordPressComment or None
+        """
+        with self._lock:
+            if int(commentId) in self._rows:
+                return self._comment(int(commentId))
+    #}}}
+
+    def query(self, postId=None, parent=None, status=None, authorEmail=None,
+              authorIp=None, limit=None): #{{{
+        """Get comments matching all given filters, newest first, at most
+        limit of them. E-mails are compared ignoring case.
+        """
+        filters = self._filters(postId, parent, status, authorEmail, authorIp)
+        with self._lock:
+            return map(self._comment, self._select(filters, limit))
+    #}}}
+
+    def count(self, postId=None, parent=None, status=None, authorEmail=None,
+              authorIp=None): #{{{
+        """Get number of comments matching all given filters
+        """
+        filters = self._filters(postId, parent, status, authorEmail, authorIp)
+        with self._lock:
+            if len(filters) == 1:
+                position, key = filters[0]
+                return len(self._indexes[position].get(key, ()))
+            return len(self._select(filters))
+    #}}}
+
+    def replies(self, commentId): #{{{
+        """Get direct replies to comment, oldest first
+        """
+        with self._lock:
+            return map(self._comment, self._indexes[1].get(int(commentId), ()))
+    #}}}
+
+    def thread(self, commentId=0, postId=None): #{{{
+        """Get replies below comment as (depth, comment) tuples, depth
+        first and oldest first. For commentId 0 the top level comments
+        start the trees, those of postId only when given.
+        """
+        with self._lock:
+            if commentId == 0 and postId is not None:
+                top = self._select(self._filters(postId, 0, None, None, None))
+            else:
+                top = self._indexes[1].get(int(commentId), ())[::-1]
+            result = []
+            seen = set()
+            stack = [(0, childId) for childId in top]
+            while stack:
+                depth, childId = stack.pop()
+                if childId in seen:
+                    continue
+                seen.add(childId)
+                result.append((depth, self._comment(childId)))
+                stack.extend((depth + 1, replyId) for replyId
+                             in reversed(self._indexes[1].get(childId, ())))
+            return result
+    #}}}
+
+    def newestId(self): #{{{
+        """Get highest comment id, 0 when empty
+        """
+        with self._lock:
+            return self._ids[-1] if self._ids else 0
+    #}}}
+#}}}
+
+class WordPressMemoryCache(object): #{{{
+    """In-process LRU cache backend holding up to maxSize entries
+    """
+    def __init__(self, maxSize=1000):
+        self.maxSize = maxSize
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key): #{{{
+        """Get (found, value) tuple for key
+        """
+        with self._lock:
+            entry = self._items.pop(key, None)
+            if entry is None:
+                return False, None
+            if entry[1] is not None and entry[1] < time.time():
+                return False, None
+            self._items[key] = entry
+        return True, copy.deepcopy(entry[0])
+    #}}}
+
+    def set(self, key, value, ttl=None): #{{{
+        """Store value for ttl seconds, None keeps it until evicted and
+        ttl <= 0 does not store it
+        """
+        if ttl is not None and ttl <= 0:
+            self.delete(key)
+            return
+        expires = None if ttl is None else time.time() + ttl
+        entry = (copy.deepcopy(value), expires)
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = entry
+            while len(self._items) > self.maxSize:
+                self._items.popitem(last=False)
+    #}}}
+
+    def delete(self, key): #{{{
+        with self._lock:
+            self._items.pop(key, None)
+    #}}}
+
+    def clear(self): #{{{
+        with self._lock:
+            self._items.clear()
+    #}}}
+#}}}
+
+# values are stored as JSON since format 2, format 1 pickled them
+_diskCacheFormat = 2
+
+class WordPressDiskCache(object): #{{{
+    """LRU cache backend stored in a SQLite file, can be shared by
+    several processes. Values are stored as JSON. Least recently used
+    entries are evicted when this instance sees the file grow over
+    maxSize entries, entries added by other processes are counted then.
+    """
+    def __init__(self, path, maxSize=10000):
+        self.path = path
+        self.maxSize = maxSize
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT '
+                'PRIMARY KEY, value TEXT, expires REAL, used REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS cache_used ON '
+                             'cache (used)')
+            if self._db.execute('PRAGMA user_version').fetchone()[0] != \
+                    _diskCacheFormat:
+                # entries of an older format are never read
+                self._db.execute('DELETE FROM cache')
+                self._db.execute('PRAGMA user_version = %d' %
+                                 _diskCacheFormat)
+            # entries known to this instance
+            self._size = self._db.execute('SELECT COUNT(*) FROM '
+                                          'cache').fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def get(self, key): #{{{
+        """Get (found, value) tuple for key
+        """
+        now = time.time()
+        with self._lock:
+            with self._db:
+                row = self._db.execute('SELECT value, expires FROM cache '
+                    'WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    return False, None
+                if row[1] is not None and row[1] < now:
+                    self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+                    self._size -= 1
+                    return False, None
+                self._db.execute('UPDATE cache SET used = ? WHERE key = ?',
+                                 (now, key))
+        return True, _loadJson(row[0])
+    #}}}
+
+    def set(self, key, value, ttl=None): #{{{
+        """Store value for ttl seconds, None keeps it until evicted and
+        ttl <= 0 does not store it
+        """
+        if ttl is not None and ttl <= 0:
+            self.delete(key)
+            return
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        data = _dumpJson(value)
+        with self._lock:
+            with self._db:
+                added = self._db.execute('SELECT 1 FROM cache WHERE key = ?',
+                                         (key,)).fetchone() is None
+                self._db.execute('INSERT OR REPLACE INTO cache VALUES '
+                    '(?, ?, ?, ?)', (key, data, expires, now))
+                self._size += added
+                if self._size > self.maxSize:
+                    self._evict()
+    #}}}
+
+    def _evict(self): #{{{
+        """Remove least recently used entries over maxSize, through the
+        index on used
+        """
+        count = self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self.maxSize:
+            self._db.execute('DELETE FROM cache WHERE key IN (SELECT key '
+                'FROM cache ORDER BY used LIMIT ?)', (count - self.maxSize,))
+        self._size = min(count, self.maxSize)
+    #}}}
+
+    def delete(self, key): #{{{
+        with self._lock:
+            with self._db:
+                self._size -= self._db.execute('DELETE FROM cache WHERE '
+                                               'key = ?', (key,)).rowcount
+    #}}}
+
+    def clear(self): #{{{
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM cache')
+                self._size = 0
+    #}}}
+#}}}
+
+class WordPressResponseCache(object): #{{{
+    """Read-through cache of XML-RPC responses keyed by method name and
+    parameters. Only methods listed in ttls are cached, for ttls[method]
+    seconds; None caches them until evicted, 0 not at all.
+    """
+    defaultTtls = {
+        'metaWeblog.getPost'    : 300,
+        'wp.getComment'         : 300,
+        'wp.getTags'            : 600,
+        'blogger.getUsersBlogs' : 3600,
+    }
+
+    def __init__(self, backend=None, ttls=None):
+        if backend is None:
+            backend = WordPressMemoryCache()
+        self.backend = backend
+        self.ttls = dict(self.defaultTtls)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def cacheable(self, methodName):
+        ttl = self.ttls.get(methodName, 0)
+        return ttl is None or ttl > 0
+
+    def key(self, url, methodName, params): #{{{
+        """Get cache key, a digest so that passwords are not stored
+        """
+        return hashlib.sha1(repr((url, methodName, params))).hexdigest()
+    #}}}
+
+    def get(self, key): #{{{
+        found, value = self.backend.get(key)
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found, value
+    #}}}
+
+    def set(self, key, value, methodName): #{{{
+        self.backend.set(key, value, self.ttls[methodName])
+    #}}}
+
+    def invalidate(self, url, methodName, params): #{{{
+        """Drop cached response of call
+        """
+        self.backend.delete(self.key(url, methodName, params))
+    #}}}
+
+    def clear(self): #{{{
+        self.backend.clear()
+    #}}}
+
+    def stats(self): #{{{
+        return {'hits' : self.hits, 'misses' : self.misses,
+                'size' : len(self.backend)}
+    #}}}
+#}}}
+
+class WordPressBatch(object): #{{{
+    """Collects XML-RPC calls and sends them as one system.multicall request
+
+    Usage:
+        with wp.batch() as b:
+            first = b.call('mt.publishPost', postId, wp.user, wp.password)
+            ...
+        b.results[first]
+    """
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        if excType is None:
+            self.execute()
+        return False
+
+    def __len__(self):
+        return len(self._calls)
+
+    def call(self, methodName, *params): #{{{
+        """Queue call, return its index in results list
+        """
+        if self.results is not None:
+            raise WordPressException('Batch already executed')
+        self._calls.append({'methodName' : methodName, 'params' : params})
+        return len(self._calls) - 1
+    #}}}
+
+    def execute(self): #{{{
+        """Send queued calls, return list with return value or
+        WordPressException for each call
+        """
+        if self.results is not None:
+            return self.results
+        results = []
+        if self._calls:
+            try:
+                response = self._client._call('system.multicall', self._calls)
+            except xmlrpclib.Fault, fault:
+                raise WordPressException(fault)
+            for item in response:
+                if isinstance(item, dict):
+                    results.append(WordPressException(
+                        xmlrpclib.Fault(item['faultCode'], item['faultString'])))
+                else:
+                    results.append(item[0])
+        self.results = results
+        return results
+    #}}}
+#}}}
+
+def _isTransient(error): #{{{
+    """Check if failed call may succeed when retried
+    """
+    if isinstance(error, xmlrpclib.ProtocolError):
+        return error.errcode >= 500 or error.errcode == 429
+    return isinstance(error, (socket.error, httplib.HTTPException))
+#}}}
+
+def _isUnsent(error): #{{{
+    """Check if call failed before any byte of the request was sent, so
+    that it may be retried even when it is not idempotent
+    """
+    return getattr(error, 'unsent', False)
+#}}}
+
+class WordPressAdaptiveLimit(object): #{{{
+    """Concurrency limit adjusted from call outcomes. The limit grows by
+    one after limit healthy calls and halves when a call fails or takes
+    longer than latencyFactor times the fastest call seen.
+    """
+    def __init__(self, initial=4, minimum=1, maximum=32, latencyFactor=4.0):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latencyFactor = latencyFactor
+        self.active = 0
+        self.minLatency = None
+        self._healthy = 0
+        self._lastDecrease = 0.0
+        self._lock = threading.Condition()
+
+    def __repr__(self):
+        return '<%s %d/%d>' % (self.__class__.__name__, self.active,
+                               self.limit)
+
+    def acquire(self): #{{{
+        """Wait until a call may start
+        """
+        with self._lock:
+            while self.active >= self.limit:
+                self._lock.wait()
+            self.active += 1
+    #}}}
+
+    def release(self, latency, ok=True): #{{{
+        """Record outcome of call started after acquire
+        """
+        now = time.time()
+        with self._lock:
+            self.active -= 1
+            if ok and (self.minLatency is None or latency < self.minLatency):
+                self.minLatency = latency
+            slow = (self.minLatency is not None and
+                    latency > self.minLatency * self.latencyFactor)
+            if ok and not slow:
+                self._healthy += 1
+                if self._healthy >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._healthy = 0
+            elif now - self._lastDecrease > latency:
+                # calls already in flight report the same congestion, one
+                # decrease per round trip
+                self.limit = max(self.minimum, self.limit // 2)
+                self._healthy = 0
+                self._lastDecrease = now
+            self._lock.notify_all()
+    #}}}
+#}}}
+
+class WordPressCallEvent(object): #{{{
+    """Remote call seen by WordPressClient call hooks. Before hooks get
+    methodName, blogId and start, after hooks get the other attributes
+    too. fault is the xmlrpclib.Fault returned by the server, error any
+    other exception the call raised. bytesSent and bytesReceived count
+    bytes on the wire, bytesSaved the bytes gzip compression saved. hedged
+    is set when a duplicate request was sent, coalesced when the call got
+    the response of an identical call made by another thread.
+    """
+    def __init__(self, methodName, blogId):
+        self.methodName = methodName
+        self.blogId = blogId
+        self.start = time.time()
+        self.wallTime = 0.0
+        self.marshalTime = 0.0
+        self.unmarshalTime = 0.0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.bytesSaved = 0
+        self.cached = False
+        self.hedged = False
+        self.coalesced = False
+        self.fault = None
+        self.error = None
+
+    def __repr__(self):
+        return '<%s %s %.3fs>' % (self.__class__.__name__, self.methodName,
+                                  self.wallTime)
+
+    def _merge(self, other): #{{{
+        """Take the wire and parsing figures of other, an event of the
+        same call recorded separately
+        """
+        self.bytesSent = other.bytesSent
+        self.bytesReceived = other.bytesReceived
+        self.bytesSaved = other.bytesSaved
+        self.unmarshalTime = other.unmarshalTime
+    #}}}
+
+    def finish(self, error=None): #{{{
+        self.wallTime = time.time() - self.start
+        if isinstance(error, xmlrpclib.Fault):
+            self.fault = error
+        else:
+            self.error = error
+    #}}}
+#}}}
+
+def _measureChunks(chunks, event): #{{{
+    """Yield chunks adding their size and the time taken to produce them
+    to event
+    """
+    chunks = iter(chunks)
+    while True:
+        start = time.time()
+        try:
+            chunk = chunks.next()
+        finally:
+            event.marshalTime += time.time() - start
+        event.bytesSent += len(chunk)
+        yield chunk
+#}}}
+
+def _labelValue(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class WordPressMetrics(object): #{{{
+    """Call hook keeping counters and a latency histogram per method,
+    append it to WordPressClient.afterCall
+    """
+    defaultBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                      5.0, 10.0)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(sorted(buckets or self.defaultBuckets))
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event): #{{{
+        """Record finished call
+        """
+        with self._lock:
+            stats = self._methods.get(event.methodName)
+            if stats is None:
+                stats = self._methods[event.methodName] = {
+                    'calls'             : 0,
+                    'faults'            : 0,
+                    'errors'            : 0,
+                    'cached'            : 0,
+                    'hedged'            : 0,
+                    'coalesced'         : 0,
+                    'bytesSent'         : 0,
+                    'bytesReceived'     : 0,
+                    'bytesSaved'        : 0,
+                    'seconds'           : 0.0,
+                    'maxSeconds'        : 0.0,
+                    'marshalSeconds'    : 0.0,
+                    'unmarshalSeconds'  : 0.0,
+                    'buckets'           : [0] * (len(self.buckets) + 1),
+                }
+            stats['calls'] += 1
+            stats['faults'] += event.fault is not None
+            stats['errors'] += event.error is not None
+            stats['cached'] += event.cached
+            stats['hedged'] += event.hedged
+            stats['coalesced'] += event.coalesced
+            stats['bytesSent'] += event.bytesSent
+            stats['bytesReceived'] += event.bytesReceived
+            stats['bytesSaved'] += event.bytesSaved
+            stats['seconds'] += event.wallTime
+            stats['maxSeconds'] = max(stats['maxSeconds'], event.wallTime)
+            stats['marshalSeconds'] += event.marshalTime
+            stats['unmarshalSeconds'] += event.unmarshalTime
+            stats['buckets'][bisect.bisect_left(self.buckets,
+                                                event.wallTime)] += 1
+    #}}}
+
+    def reset(self): #{{{
+        with self._lock:
+            self._methods.clear()
+    #}}}
+
+    def asDict(self): #{{{
+        """Get {methodName: stats} dict, buckets are (upper bound,
+        cumulative count) pairs
+        """
+        result = {}
+        with self._lock:
+            for methodName, stats in self._methods.items():
+                stats = dict(stats)
+                total = 0
+                buckets = []
+                for bound, count in zip(self.buckets + (float('inf'),),
+                                        stats['buckets']):
+                    total += count
+                    buckets.append((bound, total))
+                stats['buckets'] = buckets
+                result[methodName] = stats
+        return result
+    #}}}
+
+    def prometheus(self, prefix='yawpl'): #{{{
+        """Get metrics in Prometheus text exposition format
+        """
+        stats = self.asDict()
+        lines = []
+        def metric(name, kind, help, key):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+            for methodName in sorted(stats):
+                lines.append('%s_%s{method="%s"} %r' % (prefix, name,
+                    _labelValue(methodName), stats[methodName][key]))
+        metric('calls_total', 'counter', 'XML-RPC calls.', 'calls')
+        metric('faults_total', 'counter', 'Calls answered with a fault.',
+               'faults')
+        metric('errors_total', 'counter', 'Calls failed without a fault.',
+               'errors')
+        metric('cached_total', 'counter', 'Calls served from cache.', 'cached')
+        metric('hedged_total', 'counter', 'Calls sent twice by hedging.',
+               'hedged')
+        metric('coalesced_total', 'counter',
+               'Calls answered by an identical call in flight.', 'coalesced')
+        metric('sent_bytes_total', 'counter', 'Request bytes sent.',
+               'bytesSent')
+        metric('received_bytes_total', 'counter', 'Response bytes received.',
+               'bytesReceived')
+        metric('saved_bytes_total', 'counter',
+               'Bytes saved by gzip compression.', 'bytesSaved')
+        metric('marshal_seconds_total', 'counter',
+               'Time spent encoding requests.', 'marshalSeconds')
+        metric('unmarshal_seconds_total', 'counter',
+               'Time spent parsing responses.', 'unmarshalSeconds')
+        name = '%s_call_duration_seconds' % prefix
+        lines.append('# HELP %s Wall time of calls.' % name)
+        lines.append('# TYPE %s histogram' % name)
+        for methodName in sorted(stats):
+            label = _labelValue(methodName)
+            for bound, count in stats[methodName]['buckets']:
+                if bound == float('inf'):
+                    bound = '+Inf'
+                else:
+                    bound = repr(bound)
+                lines.append('%s_bucket{method="%s",le="%s"} %d' % (name,
+                    label, bound, count))
+            lines.append('%s_sum{method="%s"} %r' % (name, label,
+                stats[methodName]['seconds']))
+            lines.append('%s_count{method="%s"} %d' % (name, label,
+                stats[methodName]['calls']))
+        return '\n'.join(lines) + '\n'
+    #}}}
+#}}}
+
+class WordPressConnectionPool(object): #{{{
+    """Bounded pool of HTTP/1.1 keep-alive connections to one host
+    """
+    def __init__(self, scheme, host, maxConnections=4, idleTimeout=60.0,
+                 timeout=None):
+        self.scheme = scheme
+        self.host = host
+        self.maxConnections = maxConnections
+        self.idleTimeout = idleTimeout
+        self.timeout = timeout
+        self._idle = []
+        self._active = 0
+        self._lock = threading.Condition()
+
+    def __repr__(self):
+        return '<%s %s://%s>' % (self.__class__.__name__, self.scheme, self.host)
+
+    def _newConnection(self): #{{{
+        """Open new connection to host
+        """
+        options = {}
+        if self.timeout is not None:
+            options['timeout'] = self.timeout
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host, **options)
+        return httplib.HTTPConnection(self.host, **options)
+    #}}}
+
+    def _expire(self): #{{{
+        """Close connections idle for more than idleTimeout seconds
+        """
+        limit = time.time() - self.idleTimeout
+        while self._idle and self._idle[0][1] < limit:
+            self._idle.pop(0)[0].close()
+    #}}}
+
+    def acquire(self): #{{{
+        """Get connection, waiting while maxConnections are in use.
+        Return (connection, reused) tuple
+        """
+        with self._lock:
+            while True:
+                self._expire()
+                if self._idle:
+                    self._active += 1
+                    return self._idle.pop()[0], True
+                if self._active < self.maxConnections:
+                    self._active += 1
+                    break
+                self._lock.wait()
+        try:
+            return self._newConnection(), False
+        except:
+            self.release(None, False)
+            raise
+    #}}}
+
+    def available(self): #{{{
+        """Count connections that can be acquired without waiting
+        """
+        with self._lock:
+            return self.maxConnections - self._active
+    #}}}
+
+    def release(self, connection, reusable=True): #{{{
+        """Give back connection acquired from pool, close it if not reusable
+        """
+        with self._lock:
+            self._active -= 1
+            if connection is not None:
+                if reusable:
+                    self._idle.append((connection, time.time()))
+                else:
+                    connection.close()
+            self._lock.notify()
+    #}}}
+
+    def close(self): #{{{
+        """Close idle connections
+        """
+        with self._lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+    #}}}
+#}}}
+
+_connectionPools = {}
+_connectionPoolsLock = threading.Lock()
+
+def getConnectionPool(scheme, host, maxConnections=4, idleTimeout=60.0,
+                      timeout=None): #{{{
+    """Get connection pool shared by all transports talking to host.
+    Options are used only when the pool is created.
+    """
+    with _connectionPoolsLock:
+        pool = _connectionPools.get((scheme, host))
+        if pool is None:
+            pool = WordPressConnectionPool(scheme, host, maxConnections,
+                                           idleTimeout, timeout)
+            _connectionPools[(scheme, host)] = pool
+        return pool
+#}}}
+
+class WordPressCircuitBreaker(object): #{{{
+    """Circuit breaker for one host. After failureThreshold calls in a row
+    failed with a transient error the circuit opens and calls fail fast
+    with WordPressException for resetTimeout seconds. Then one trial call
+    is let through, its success closes the circuit, failure opens it again.
+    """
+    def __init__(self, host, failureThreshold=5, resetTimeout=30.0):
+        self.host = host
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.failures = 0
+        self.openedAt = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<%s %s %s>' % (self.__class__.__name__, self.host,
+                               self.state)
+
+    @property
+    def state(self):
+        """'closed', 'open' or 'half-open'
+        """
+        if self.openedAt is None:
+            return 'closed'
+        if self._trial or time.time() - self.openedAt < self.resetTimeout:
+            return 'open'
+        return 'half-open'
+
+    def allow(self): #{{{
+        """Check call may be sent, raise WordPressException when circuit
+        is open
+        """
+        if self.openedAt is None:
+            return
+        with self._lock:
+            if self.openedAt is None:
+                return
+            if self._trial or time.time() - self.openedAt < self.resetTimeout:
+                raise WordPressException('Circuit open for %s after %d '
+                    'failed calls' % (self.host, self.failures))
+            self._trial = True
+    #}}}
+
+    def record(self, error=None): #{{{
+        """Record outcome of allowed call, only transient errors count
+        as failures
+        """
+        if error is None or not _isTransient(error):
+            if self.failures or self.openedAt is not None:
+                with self._lock:
+                    self.failures = 0
+                    self.openedAt = None
+                    self._trial = False
+            return
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failureThreshold:
+                self.openedAt = time.time()
+                self._trial = False
+    #}}}
+#}}}
+
+_circuitBreakers = {}
+
+def getCircuitBreaker(scheme, host, failureThreshold=5, resetTimeout=30.0): #{{{
+    """Get circuit breaker shared by all transports talking to host.
+    Options are used only when the breaker is created.
+    """
+    with _connectionPoolsLock:
+        breaker = _circuitBreakers.get((scheme, host))
+        if breaker is None:
+            breaker = WordPressCircuitBreaker(host, failureThreshold,
+                                              resetTimeout)
+            _circuitBreakers[(scheme, host)] = breaker
+        return breaker
+#}}}
+
+_nonAscii = re.compile('[\x80-\xff]').search
+
+def _responseParser(itemClass=None, items=None, useDatetime=False): #{{{
+    """Get (parser, close) pair decoding XML-RPC response fed to expat
+    parser, close() returns the params tuple or raises the fault.
+
+    Values are decoded as xmlrpclib does, but with closures and C level
+    callbacks where possible. Structs that are the response value or
+    elements of the response array are built directly as itemClass
+    instances when they have a key for every field of itemClass, other
+    structs stay dicts. When items is a list, elements of the response
+    array are moved there as soon as they are complete.
+    """
+    parser = expat.ParserCreate(None, None)
+    # UTF-8 text, only non ASCII strings are decoded like xmlrpclib does
+    parser.returns_unicode = False
+    buf = []
+    stack = []
+    marks = []
+    valueMarks = []
+    state = []
+    push = stack.append
+    join = ''.join
+    if itemClass is not None:
+        keys = itemClass._keys
+        keyGroups = itemClass._keyGroups
+        new = itemClass.__new__
+
+    def matches(struct):
+        for group in keyGroups:
+            for key in group:
+                if key in struct:
+                    break
+            else:
+                return False
+        return True
+
+    def start(tag, attrs):
+        del buf[:]
+        if tag == 'value':
+            valueMarks.append(len(stack))
+        elif tag == 'struct':
+            marks.append(len(stack))
+        elif tag == 'array':
+            if not marks:
+                state.append('array')
+            marks.append(len(stack))
+        elif tag == 'fault':
+            state.append('fault')
+
+    def end(tag):
+        # most frequent tags first
+        if tag == 'value':
+            if len(stack) == valueMarks.pop():
+                # untyped value is a string
+                data = join(buf)
+                if _nonAscii(data):
+                    data = data.decode('utf-8')
+                push(data)
+            if items is not None and len(marks) == 1 and state == ['array']:
+                mark = marks[0]
+                items.extend(stack[mark:])
+                del stack[mark:]
+        elif tag == 'member':
+            pass
+        elif tag == 'name' or tag == 'string':
+            data = join(buf)
+            if _nonAscii(data):
+                data = data.decode('utf-8')
+            push(data)
+        elif tag == 'int' or tag == 'i4' or tag == 'i8':
+            push(int(join(buf)))
+        elif tag == 'struct':
+            mark = marks.pop()
+            values = stack[mark:]
+            del stack[mark:]
+            struct = dict(zip(values[::2], values[1::2]))
+            if itemClass is not None and ((not marks and not state) or
+                    (len(marks) == 1 and state == ['array'])) and \
+                    matches(struct):
+                item = new(itemClass)
+                item._raw = tuple(map(struct.get, keys))
+                push(item)
+            else:
+                push(struct)
+        elif tag == 'dateTime.iso8601':
+            if useDatetime:
+                push(datetime.datetime(*_parseDate(join(buf))[:6]))
+            else:
+                push(xmlrpclib.DateTime(join(buf)))
+        elif tag == 'boolean':
+            data = join(buf)
+            if data == '1':
+                push(True)
+            elif data == '0':
+                push(False)
+            else:
+                raise TypeError('bad boolean value')
+        elif tag == 'array':
+            mark = marks.pop()
+            values = stack[mark:]
+            del stack[mark:]
+            push(values)
+        elif tag == 'double':
+            push(float(join(buf)))
+        elif tag == 'base64':
+            push(xmlrpclib.Binary(base64.decodestring(join(buf))))
+        elif tag == 'nil':
+            push(None)
+
+    def close():
+        parser.Parse('', True)
+        if state == ['fault']:
+            raise xmlrpclib.Fault(**stack[0])
+        return tuple(stack)
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = buf.append
+    return parser, close
+#}}}
+
+class WordPressTransport(xmlrpclib.Transport): #{{{
+    """XML-RPC transport reusing keep-alive connections from shared pools.
+
+    With compress responses are requested gzip encoded and decompressed
+    while they are parsed. Request bodies over compressThreshold bytes are
+    gzip compressed once the host answered with a gzip encoded response,
+    a host rejecting compressed requests gets them uncompressed again.
+
+    With failureThreshold calls go through the host's shared
+    WordPressCircuitBreaker. timeout is the default socket timeout of
+    connections, request methods take a per-call timeout too.
+    """
+    compressLevel = 6
+
+    def __init__(self, scheme='http', maxConnections=4, idleTimeout=60.0,
+                 keepAlive=True, timeout=None, use_datetime=0, compress=True,
+                 compressThreshold=1024, failureThreshold=None,
+                 resetTimeout=30.0):
+        xmlrpclib.Transport.__init__(self, use_datetime)
+        self.scheme = scheme
+        self.maxConnections = maxConnections
+        self.idleTimeout = idleTimeout
+        self.keepAlive = keepAlive
+        self.timeout = timeout
+        self.compress = compress
+        self.compressThreshold = compressThreshold
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        # host -> True when it sends gzip, False when it rejected gzip requests
+        self._gzipHosts = {}
+
+    def getPool(self, host): #{{{
+        """Get connection pool for host
+        """
+        return getConnectionPool(self.scheme, host, self.maxConnections,
+                                 self.idleTimeout, self.timeout)
+    #}}}
+
+    def _breaker(self, host): #{{{
+        """Get circuit breaker of host after checking it allows a call,
+        None when circuit breaking is off
+        """
+        if self.failureThreshold is None:
+            return None
+        breaker = getCircuitBreaker(self.scheme, self.get_host_info(host)[0],
+                                    self.failureThreshold, self.resetTimeout)
+        try:
+            breaker.allow()
+        except WordPressException, error:
+            error.unsent = True
+            raise
+        return breaker
+    #}}}
+
+    def request(self, host, handler, request_body, verbose=0, event=None,
+                itemClass=None, timeout=None): #{{{
+        """Send request and parse response, event is a WordPressCallEvent
+        to record received bytes and unmarshal time in. Structs returned
+        by the method are built as itemClass instances. timeout overrides
+        socket timeout of the connection for this call.
+        """
+        def send(connection, compress):
+            return self._sendContent(connection, host, request_body, compress)
+        return self._perform(host, handler, send, verbose, event, itemClass,
+                             timeout)
+    #}}}
+
+    def send_request(self, connection, handler, request_body): #{{{
+        if self.compress:
+            connection.putrequest('POST', handler, skip_accept_encoding=True)
+            connection.putheader('Accept-Encoding', 'gzip')
+        else:
+            connection.putrequest('POST', handler)
+    #}}}
+
+    def _sendContent(self, connection, host, request_body, compress=True): #{{{
+        """Send request body, gzip compressed when compress is true, it is
+        large enough and host accepts it. Return bytes saved, None when
+        not compressed.
+        """
+        connection.putheader('Content-Type', 'text/xml')
+        saved = None
+        if (compress and self.compress and
+                len(request_body) > self.compressThreshold and
+                self._gzipHosts.get(host)):
+            compressor = zlib.compressobj(self.compressLevel, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            data = compressor.compress(request_body) + compressor.flush()
+            saved = len(request_body) - len(data)
+            request_body = data
+            connection.putheader('Content-Encoding', 'gzip')
+        connection.putheader('Content-Length', str(len(request_body)))
+        connection.endheaders(request_body)
+        return saved
+    #}}}
+
+    def _rejected(self, host, saved, status=200, fault=None): #{{{
+        """Check whether host may have failed compressed request because
+        it can not decode it, the request is then sent again uncompressed.
+        A host answering 415 or an XML parse fault gets uncompressed
+        requests from now on, one answering 400 only once it accepts the
+        uncompressed request (see _accepted).
+        """
+        if saved is None:
+            return False
+        if status == 415 or (fault is not None and fault.faultCode == -32700):
+            self._gzipHosts[host] = False
+            return True
+        return status == 400
+    #}}}
+
+    def _accepted(self, host, retried): #{{{
+        """Host answered uncompressed request sent again after 400, it
+        rejects compressed requests
+        """
+        if retried:
+            self._gzipHosts[host] = False
+    #}}}
+
+    def requestStream(self, host, handler, bodyFactory, contentLength=None,
+                      verbose=0, event=None, timeout=None): #{{{
+        """Send request body produced by bodyFactory() iterator chunk by
+        chunk and parse response. Without contentLength the body is sent
+        with chunked transfer encoding. bodyFactory is called again when
+        the request has to be resent.
+        """
+        def send(connection, compress):
+            connection.putheader('Content-Type', 'text/xml')
+            if contentLength is None:
+                connection.putheader('Transfer-Encoding', 'chunked')
+            else:
+                connection.putheader('Content-Length', str(contentLength))
+            connection.endheaders()
+            chunks = bodyFactory()
+            if event is not None:
+                chunks = _measureChunks(chunks, event)
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if contentLength is None:
+                    connection.send('%x\r\n' % len(chunk))
+                    connection.send(chunk)
+                    connection.send('\r\n')
+                else:
+                    connection.send(chunk)
+            if contentLength is None:
+                connection.send('0\r\n\r\n')
+        return self._perform(host, handler, send, verbose, event,
+                             timeout=timeout)
+    #}}}
+
+    def requestItems(self, host, handler, request_body, verbose=0,
+                     event=None, itemClass=None, timeout=None): #{{{
+        """Send request, yield elements of the array returned by server
+        as soon as each one is parsed from the response stream. Any other
+        returned value is yielded alone once the response is complete.
+        """
+        def send(connection, compress):
+            return self._sendContent(connection, host, request_body, compress)
+        breaker = self._breaker(host)
+        error = None
+        try:
+            for item in self._streamResponse(host, handler, send, verbose,
+                                             event, itemClass, timeout):
+                yield item
+        except Exception, error:
+            raise
+        finally:
+            # also when the caller stops reading early
+            if breaker is not None:
+                breaker.record(error)
+    #}}}
+
+    def _streamResponse(self, host, handler, send, verbose, event, itemClass,
+                        timeout): #{{{
+        compress = True
+        retried = False
+        while True:
+            pool, connection, response, saved = self._open(host, handler,
+                send, verbose, timeout, compress)
+            reusable = False
+            try:
+                if response.status != 200:
+                    response.read()
+                    if self._rejected(host, saved, response.status):
+                        compress = False
+                        retried = response.status == 400
+                        continue
+                    raise xmlrpclib.ProtocolError(pool.host + handler,
+                        response.status, response.reason, response.msg)
+                items = []
+                parser, close = _responseParser(itemClass, items,
+                                                self._use_datetime)
+                parsing = 0.0
+                for data in self._readResponse(response, event):
+                    start = time.time()
+                    parser.Parse(data, False)
+                    parsing += time.time() - start
+                    if items:
+                        self._sent(event, saved)
+                        saved = None
+                        for item in items:
+                            yield item
+                        del items[:]
+                reusable = self._reusable(response)
+                start = time.time()
+                try:
+                    result = close()
+                except xmlrpclib.Fault, fault:
+                    if self._rejected(host, saved, fault=fault):
+                        compress = False
+                        continue
+                    self._accepted(host, retried)
+                    raise
+                finally:
+                    if event is not None:
+                        event.unmarshalTime += parsing + time.time() - start
+                self._accepted(host, retried)
+                self._sent(event, saved)
+                for item in items:
+                    yield item
+                # elements of a returned array are gone from the emptied array
+                if result and not isinstance(result[0], list):
+                    yield result[0]
+                return
+            finally:
+                pool.release(connection, reusable)
+    #}}}
+
+    def parse_response(self, response, event=None, itemClass=None): #{{{
+        """Parse response, recording received bytes and time spent parsing
+        in event
+        """
+        parser, close = _responseParser(itemClass, None, self._use_datetime)
+        parsing = 0.0
+        start = time.time()
+        try:
+            for data in self._readResponse(response, event):
+                if self.verbose:
+                    print 'body:', repr(data)
+                start = time.time()
+                parser.Parse(data, False)
+                parsing += time.time() - start
+            start = time.time()
+            return close()
+        finally:
+            if event is not None:
+                event.unmarshalTime += parsing + time.time() - start
+    #}}}
+
+    def _readResponse(self, response, event=None): #{{{
+        """Yield response body chunks, gzip encoded body is decompressed
+        while read in chunks of at most 64 kB
+        """
+        if response.getheader('Content-Encoding', '') != 'gzip':
+            while True:
+                data = response.read(16384)
+                if not data:
+                    break
+                if event is not None:
+                    event.bytesReceived += len(data)
+                yield data
+            return
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while True:
+            data = response.read(16384)
+            if not data:
+                break
+            if event is not None:
+                event.bytesReceived += len(data)
+                event.bytesSaved -= len(data)
+            while data:
+                data = decompressor.decompress(data, 65536)
+                if event is not None:
+                    event.bytesSaved += len(data)
+                yield data
+                data = decompressor.unconsumed_tail
+        data = decompressor.flush()
+        if event is not None:
+            event.bytesSaved += len(data)
+        yield data
+    #}}}
+
+    def _sent(self, event, saved): #{{{
+        """Record bytes saved by compressing request of successful call
+        """
+        if event is not None and saved is not None:
+            event.bytesSent -= saved
+            event.bytesSaved += saved
+    #}}}
+
+    def _reusable(self, response): #{{{
+        return self.keepAlive and not response.will_close
+    #}}}
+
+    def _perform(self, host, handler, send, verbose, event=None,
+                 itemClass=None, timeout=None): #{{{
+        """Send request with send(connection, compress) and parse
+        response, through circuit breaker of host when enabled
+        """
+        breaker = self._breaker(host)
+        if breaker is None:
+            return self._performOnce(host, handler, send, verbose, event,
+                                     itemClass, timeout)
+        try:
+            result = self._performOnce(host, handler, send, verbose, event,
+                                       itemClass, timeout)
+        except Exception, error:
+            breaker.record(error)
+            raise
+        breaker.record()
+        return result
+    #}}}
+
+    def _performOnce(self, host, handler, send, verbose, event, itemClass,
+                     timeout): #{{{
+        """Send request with send(connection, compress) and parse
+        response. send returns bytes saved by compressing the request or
+        None, compressed request rejected by host is sent again
+        uncompressed.
+        """
+        compress = True
+        retried = False
+        while True:
+            pool, connection, response, saved = self._open(host, handler,
+                send, verbose, timeout, compress)
+            try:
+                if response.status == 200:
+                    self.verbose = verbose
+                    result = self.parse_response(response, event, itemClass)
+                else:
+                    response.read()
+            except xmlrpclib.Fault, fault:
+                pool.release(connection, self._reusable(response))
+                if self._rejected(host, saved, fault=fault):
+                    compress = False
+                    continue
+                self._accepted(host, retried)
+                raise
+            except:
+                pool.release(connection, False)
+                raise
+            if response.status != 200:
+                pool.release(connection, False)
+                if self._rejected(host, saved, response.status):
+                    compress = False
+                    retried = response.status == 400
+                    continue
+                raise xmlrpclib.ProtocolError(pool.host + handler,
+                    response.status, response.reason, response.msg)
+            pool.release(connection, self._reusable(response))
+            self._accepted(host, retried)
+            self._sent(event, saved)
+            return result
+    #}}}
+
+    def _open(self, host, handler, send, verbose, timeout=None,
+              compress=True): #{{{
+        """Send request headers and body with send(connection, compress) on
+        pooled connection, return (pool, connection, response, send
+        result). Retry on a fresh connection when a reused one was closed
+        by server.
+        """
+        chost, extraHeaders, x509 = self.get_host_info(host)
+        pool = self.getPool(chost)
+        if timeout is None:
+            timeout = pool.timeout
+            if timeout is None:
+                timeout = socket.getdefaulttimeout()
+        while True:
+            connection, reused = pool.acquire()
+            try:
+                if connection.timeout != timeout:
+                    connection.timeout = timeout
+                    if connection.sock is not None:
+                        connection.sock.settimeout(timeout)
+                if connection.sock is None:
+                    try:
+                        connection.connect()
+                    except socket.error, e:
+                        e.unsent = True
+                        raise
+                if verbose:
+                    connection.set_debuglevel(1)
+                self.send_request(connection, handler, None)
+                for key, value in extraHeaders or ():
+                    connection.putheader(key, value)
+                if not self.keepAlive:
+                    connection.putheader('Connection', 'close')
+                self.send_user_agent(connection)
+                saved = send(connection, compress)
+                response = connection.getresponse(buffering=True)
+                if (response.getheader('Content-Encoding', '') == 'gzip' and
+                        host not in self._gzipHosts):
+                    self._gzipHosts[host] = True
+                return pool, connection, response, saved
+            except socket.error, e:
+                pool.release(connection, False)
+                if not reused or e.errno not in (errno.ECONNRESET,
+                        errno.ECONNABORTED, errno.EPIPE):
+                    raise
+            except httplib.BadStatusLine:
+                pool.release(connection, False)
+                if not reused:
+                    raise
+            except:
+                pool.release(connection, False)
+                raise
+    #}}}
+
+    def close(self): #{{{
+        """Connections belong to shared pools, nothing to close here
+        """
+        pass
+    #}}}
+#}}}
+
+def _dumpParam(value): #{{{
+    """Marshal one XML-RPC call parameter as xmlrpclib.dumps() does
+    """
+    if type(value) is str:
+        return ('<param>\n<value><string>%s</string></value>\n</param>\n' %
+                xmlrpclib.escape(value))
+    if type(value) is int and xmlrpclib.MININT <= value <= xmlrpclib.MAXINT:
+        return '<param>\n<value><int>%d</int></value>\n</param>\n' % value
+    # strip <params> and </params> lines
+    return xmlrpclib.Marshaller('utf-8').dumps((value,))[9:-10]
+#}}}
+
+class _RequestTemplate(object): #{{{
+    """XML-RPC request of one method with some parameters marshalled
+    once, the bytes built are the ones of xmlrpclib.dumps()
+    """
+    __slots__ = ('size', 'constants', 'variables', 'chunks')
+
+    def __init__(self, methodName, params, constants):
+        """constants are (position, value) of the parameters marshalled
+        in the template
+        """
+        if isinstance(methodName, unicode):
+            methodName = methodName.encode('utf-8')
+        self.size = len(params)
+        self.constants = constants
+        fixed = dict(constants)
+        chunks = ["<?xml version='1.0'?>\n<methodCall>\n<methodName>%s"
+                  "</methodName>\n<params>\n" % methodName]
+        variables = []
+        for position, value in enumerate(params):
+            if position in fixed:
+                chunks[-1] += _dumpParam(value)
+            else:
+                variables.append(position)
+                chunks.append('')
+        chunks[-1] += '</params>\n</methodCall>\n'
+        self.variables = tuple(variables)
+        self.chunks = tuple(chunks)
+
+    def matches(self, params): #{{{
+        """Check if params have the template's constant values, the same
+        objects
+        """
+        if len(params) != self.size:
+            return False
+        for position, value in self.constants:
+            if params[position] is not value:
+                return False
+        return True
+    #}}}
+
+    def dumps(self, params): #{{{
+        chunks = self.chunks
+        parts = [chunks[0]]
+        for position, chunk in zip(self.variables, chunks[1:]):
+            parts.append(_dumpParam(params[position]))
+            parts.append(chunk)
+        return ''.join(parts)
+    #}}}
+#}}}
+
+class _WordPressClientBase(object): #{{{
+    """Conversion between XML-RPC structs and WordPress item instances,
+    shared by WordPressClient and AsyncWordPressClient
+    """
+
+    def _dumps(self, methodName, params): #{{{
+        """Marshal XML-RPC call through the request template of
+        methodName, in which parameters that are the blog id, user or
+        password are marshalled once
+        """
+        constants = self._templateConstants
+        if (constants[0] is not self.blogId or constants[1] is not self.user
+                or constants[2] is not self.password):
+            self._resetTemplates()
+        template = self._templates.get(methodName)
+        if template is None or not template.matches(params):
+            template = self._template(methodName, params, template)
+        return template.dumps(params)
+    #}}}
+
+    def _template(self, methodName, params, previous): #{{{
+        """Build request template of methodName for params
+        """
+        constants = self._templateConstants
+        positions = [position for position, value in enumerate(params)
+                     if value is constants[0] or value is constants[1]
+                     or value is constants[2]]
+        if previous is not None and previous.size == len(params):
+            # a parameter that differed once, such as a post id equal to
+            # the blog id, is not constant
+            kept = set(position for position, value in previous.constants)
+            positions = [position for position in positions
+                         if position in kept]
+        template = _RequestTemplate(methodName, params, tuple(
+            (position, params[position]) for position in positions))
+        self._templates[methodName] = template
+        return template
+    #}}}
+
+    def _resetTemplates(self): #{{{
+        """Drop request templates, they are built again for the current
+        blog id, user and password
+        """
+        self._templateConstants = (self.blogId, self.user, self.password)
+        self._templates = {}
+    #}}}
+
+    def _filterTag(self, tag): #{{{
+        """Transform tag struct in WordPressTag instance 
+        """
+        if isinstance(tag, WordPressTag):
+            return tag
+        return WordPressTag.fromStruct(tag)
+    #}}}
+ 
+    def _filterPost(self, post): #{{{
+        """Transform post struct in WordPressPost instance 
+        """
+        if isinstance(post, WordPressPost):
+            return post
+        return WordPressPost.fromStruct(post)
+    #}}}
+
+    def _filterWpPost(self, post): #{{{
+        """Transform wp.getPosts post struct in WordPressPost instance
+        """
+        return self._filterPost(self._wpPostStruct(post))
+    #}}}
+
+    # metaWeblog post struct keys copied from wp.getPosts post struct keys
+    _wpPostKeys = (
+        ('title',           'post_title'),
+        ('mt_excerpt',      'post_excerpt'),
+        ('userid',          'post_author'),
+        ('dateCreated',     'post_date'),
+        ('link',            'link'),
+        ('permaLink',       'link'),
+        ('post_status',     'post_status'),
+        ('date_modified',   'post_modified'),
+        ('wp_slug',         'post_name'),
+    )
+
+    # wp.getPosts fields returning each WordPressPost field
+    _wpPostFields = {
+        'id'            : (),
+        'title'         : ('post_title',),
+        'date'          : ('post_date',),
+        'permaLink'     : ('link',),
+        'link'          : ('link',),
+        'description'   : ('post_content',),
+        'textMore'      : ('post_content',),
+        'excerpt'       : ('post_excerpt',),
+        'categories'    : ('terms',),
+        'keywords'      : ('terms',),
+        'user'          : ('post_author',),
+        'allowPings'    : ('ping_status',),
+        'allowComments' : ('comment_status',),
+        'status'        : ('post_status',),
+        'slug'          : ('post_name',),
+    }
+
+    # WordPressPost fields mt.getRecentPostTitles returns
+    _titleFields = frozenset(['id', 'title', 'date', 'user'])
+
+    def _wpPostStruct(self, post): #{{{
+        """Transform wp.getPosts post struct in metaWeblog post struct,
+        keys of fields the server did not send are left out
+        """
+        struct = {'postid' : post['post_id']}
+        for key, wpKey in self._wpPostKeys:
+            if wpKey in post:
+                struct[key] = post[wpKey]
+        if 'post_content' in post:
+            description, more, textMore = post['post_content'].partition(
+                '<!--more-->')
+            struct['description'] = description
+            struct['mt_text_more'] = textMore
+        if 'terms' in post:
+            terms = post['terms']
+            struct['categories'] = [term['name'] for term in terms
+                                    if term['taxonomy'] == 'category']
+            struct['mt_keywords'] = ', '.join(term['name'] for term in terms
+                                              if term['taxonomy'] == 'post_tag')
+        if 'comment_status' in post:
+            struct['mt_allow_comments'] = int(post['comment_status'] == 'open')
+        if 'ping_status' in post:
+            struct['mt_allow_pings'] = int(post['ping_status'] == 'open')
+        return struct
+    #}}}
+
+    def _postKeys(self, fields): #{{{
+        """Get post struct keys of WordPressPost fields, and post_status
+        that editPost needs to keep the status of a projected post
+        """
+        unknown = set(fields).difference(self._wpPostFields)
+        if unknown:
+            raise ValueError('Unknown WordPressPost fields: %s' %
+                             ', '.join(sorted(unknown)))
+        keys = set(['post_status'])
+        for name, fieldKeys, decode, default in WordPressPost._fields:
+            if name in fields:
+                if isinstance(fieldKeys, basestring):
+                    fieldKeys = (fieldKeys,)
+                keys.update(fieldKeys)
+        return keys
+    #}}}
+
+    def _projectPost(self, post, keys): #{{{
+        """Transform post struct in WordPressPost instance keeping only
+        keys
+        """
+        if isinstance(post, WordPressPost):
+            post = post.struct()
+        return WordPressPost.fromStruct(dict((key, post[key]) for key in keys
+                                             if key in post))
+    #}}}
+
+    def _filterComment(self, comment): #{{{
+        """Transform comment struct in WordPressComment instance
+        """
+        if isinstance(comment, WordPressComment):
+            return comment
+        return WordPressComment.fromStruct(comment)
+    #}}}
+
+    def _filterCategory(self, cat): #{{{
+        """Transform category struct in WordPressCategory instance
+        """
+        if isinstance(cat, WordPressCategory):
+            return cat
+        return WordPressCategory.fromStruct(cat)
+    #}}}
+
+    def _filterBlog(self, blog): #{{{
+        """Transform blog struct in WordPressBlog instance
+        """
+        if isinstance(blog, WordPressBlog):
+            return blog
+        return WordPressBlog.fromStruct(blog)
+    #}}}
+
+    def _filterUser(self, userinfo): #{{{
+        """Transform user info struct in WordPressUser instance
+        """
+        userObj = WordPressUser()
+        userObj.id = userinfo['userid']
+        userObj.firstName = userinfo['firstname']
+        userObj.lastName = userinfo['lastname']
+        userObj.nickname = userinfo['nickname']
+        #userObj.email = userinfo['email']
+        return userObj
+    #}}}
+
+    def _postCategories(self, post): #{{{
+        """Transform post categories ids in mt category structs
+        """
+        categories = []
+        for i, cat in enumerate(post.categories):
+            categories.append({'categoryId' : cat, 'isPrimary' : int(i == 0)})
+        return categories
+    #}}}
+
+    def _newPostContent(self, post): #{{{
+        """Transform WordPressPost instance in metaWeblog.newPost struct
+        """
+        blogContent = {
+            'title' : post.title,
+            'description' : post.description,
+            'mt_text_more' : post.textMore,
+            'mt_keywords': post.keywords,
+        }
+        blogContent['dateCreated'] = xmlrpclib.DateTime(post.date) 
+        return blogContent
+    #}}}
+
+    # WordPressPost fields metaWeblog.editPost changes and their struct keys
+    _editPostFields = (
+        ('title',           'title'),
+        ('description',     'description'),
+        ('textMore',        'mt_text_more'),
+        ('excerpt',         'mt_excerpt'),
+        ('permaLink',       'permaLink'),
+        ('keywords',        'mt_keywords'),
+        ('allowPings',      'mt_allow_pings'),
+        ('allowComments',   'mt_allow_comments'),
+        ('date',            'dateCreated'),
+        ('slug',            'wp_slug'),
+    )
+
+    def _postChanges(self, post, publish): #{{{
+        """Get (metaWeblog.editPost struct or None, mt categories or None,
+        editPost publish flag, whether to call mt.publishPost) for edit of
+        post. A post loaded from the blog only sends what changed since,
+        other posts are sent whole.
+        """
+        if post._raw is None:
+            return (self._editPostContent(post), self._postCategories(post),
+                    0, publish)
+        changed = set(post.changedFields())
+        if 'description' in changed or 'textMore' in changed:
+            # WordPress rebuilds the post content from both
+            changed.update(('description', 'textMore'))
+        content = {}
+        for name, key in self._editPostFields:
+            if name in changed:
+                value = getattr(post, name)
+                if name == 'date':
+                    if not value:
+                        continue
+                    value = xmlrpclib.DateTime(value)
+                content[key] = value
+        categories = None
+        if 'categories' in changed:
+            categories = self._postCategories(post)
+        if 'post_status' not in post.struct():
+            # listed by mt.getRecentPostTitles, without publishing the
+            # edit would make the post a draft whatever its status
+            if content and not publish:
+                raise WordPressException('Status of post is unknown, list '
+                    'it with the status field to edit it without publishing')
+            return (content or None, categories, int(bool(content)),
+                    publish and not content)
+        # without post_status, editPost sets the status from its publish
+        # flag: draft for 0
+        original = post.originalValue('status')
+        status = publish and 'publish' or post.status
+        if status and status != 'publish' and (content or status != original):
+            content['post_status'] = status
+        published = original == 'publish'
+        return (content or None, categories,
+                int(published and status == 'publish'),
+                status == 'publish' and not published)
+    #}}}
+
+    def _postEdited(self, post, content, categories, flag, publish): #{{{
+        """Make the values sent by editPost the ones post was loaded with
+        """
+        struct = dict(content or ())
+        if categories is not None:
+            struct['categories'] = list(post.categories)
+        if content is not None and 'post_status' not in content:
+            struct['post_status'] = flag and 'publish' or 'draft'
+        if flag or publish:
+            struct['post_status'] = 'publish'
+        post._rebase(struct)
+    #}}}
+
+    def _editPostContent(self, post): #{{{
+        """Transform WordPressPost instance in metaWeblog.editPost struct
+        """
+        blogcontent = {
+            'title' : post.title,
+            'description' : post.description,
+            'permaLink' : post.permaLink,
+            'mt_allow_pings' : post.allowPings,
+            'mt_text_more' : post.textMore,
+            'mt_excerpt' : post.excerpt
+        }
+        
+        if post.date:
+            blogcontent['dateCreated'] = xmlrpclib.DateTime(post.date) 
+        return blogcontent
+    #}}}
+
+    # raw bytes per encoded chunk, whole 57 bytes base64 lines
+    mediaChunkSize = 57 * 1150
+
+    def _mediaRequest(self, f, name, progress): #{{{
+        """Get (bodyFactory, contentLength) of metaWeblog.newMediaObject
+        request with bits read from f chunk by chunk. contentLength is None
+        when the size of f is unknown. bodyFactory() yields the request
+        chunks, it can be called again to resend them when f is seekable.
+        """
+        marker = 'yawpl-media-bits'
+        request = xmlrpclib.dumps((self.blogId, self.user, self.password,
+            {'name' : name, 'bits' : xmlrpclib.Binary(marker)}),
+            'metaWeblog.newMediaObject')
+        head, tail = request.split(base64.encodestring(marker))
+        try:
+            start = f.tell()
+            size = os.fstat(f.fileno()).st_size - start
+        except (AttributeError, IOError, OSError, ValueError):
+            size = None
+        if not hasattr(f, 'seek'):
+            start = None
+        contentLength = None
+        if size is not None:
+            lines, rest = divmod(size, 57)
+            contentLength = len(head) + len(tail) + lines * 77
+            if rest:
+                contentLength += (rest + 2) // 3 * 4 + 1
+        sent = []
+        def body():
+            if sent:
+                if start is None:
+                    raise WordPressException('Media stream can not be resent')
+                f.seek(start)
+            sent.append(0)
+            yield head
+            count = 0
+            while True:
+                chunk = f.read(self.mediaChunkSize)
+                while chunk and len(chunk) < self.mediaChunkSize:
+                    more = f.read(self.mediaChunkSize - len(chunk))
+                    if not more:
+                        break
+                    chunk += more
+                if not chunk:
+                    break
+                yield base64.encodestring(chunk)
+                count += len(chunk)
+                if progress is not None:
+                    progress(count, size)
+            yield tail
+        return body, contentLength
+    #}}}
+
+    def _newCategoryContent(self, category): #{{{
+        """Transform WordPressCategory instance in wp.newCategory struct
+        """
+        return {
+            'name': category.name,
+            'parent_id': category.parentId,
+            'slug': category.slug,
+            'description': category.description,
+        }
+    #}}}
+
+    def _commentsFilter(self, status, post_id, number, offset): #{{{
+        """Build wp.getComments filter struct
+        """
+        struct = dict()
+        struct['status']    = status
+        struct['post_id']   = post_id
+        struct['number']    = number
+        struct['offset']    = offset 
+        return struct
+    #}}}
+#}}}
+
+class _Flight(object): #{{{
+    """Call in progress that other threads wait for
+    """
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+#}}}
+
+class WordPressClient(_WordPressClientBase): #{{{
+    """Client for connect to WordPress XML-RPC interface
+    """
+
+    # item classes WordPressTransport builds directly from streamed responses
+    itemClasses = {
+        'metaWeblog.getPost'        : WordPressPost,
+        'metaWeblog.getRecentPosts' : WordPressPost,
+        'wp.getComment'             : WordPressComment,
+        'wp.getComments'            : WordPressComment,
+        'wp.getCategories'          : WordPressCategory,
+        'mt.getPostCategories'      : WordPressCategory,
+        'wp.suggestCategories'      : WordPressCategory,
+        'wp.getTags'                : WordPressTag,
+        'blogger.getUsersBlogs'     : WordPressBlog,
+    }
+
+    # read methods sent again when the first request is slower than
+    # hedgeAfter seconds
+    hedgedMethods = frozenset([
+        'metaWeblog.getPost',
+        'metaWeblog.getRecentPosts',
+        'wp.getComment',
+        'wp.getComments',
+        'wp.getTags',
+        'wp.getCategories',
+    ])
+
+    # read methods for which identical calls made by several threads at
+    # the same time share one request
+    coalescedMethods = hedgedMethods | frozenset([
+        'wp.getPosts',
+        'mt.getPostCategories',
+        'mt.supportedMethods',
+        'mt.getTrackbackPings',
+        'blogger.getUsersBlogs',
+        'blogger.getUserInfo',
+        'wp.suggestCategories',
+        'pingback.extensions.getPingbacks',
+    ])
+    
+    def __init__(self, url, user, password, transport=None, maxConnections=4,
+                 idleTimeout=60.0, keepAlive=True, streamResponses=False,
+                 categoryTtl=None, cache=None, compress=True,
+                 mediaIndex=None, timeout=None, hedgeAfter=None,
+                 failureThreshold=None, snapshot=None): #{{{
+        self.url = url
+        self.user = user
+        self.password = password
+        self.blogId = 0
+        self._resetTemplates()
+        self.categoryStore = WordPressCategoryStore(ttl=categoryTtl)
+        self.methods = None
+        if transport is None:
+            transport = WordPressTransport(urllib.splittype(url)[0],
+                maxConnections, idleTimeout, keepAlive, compress=compress,
+                failureThreshold=failureThreshold)
+        self._transport = transport
+        self._host, self._handler = urllib.splithost(urllib.splittype(url)[1])
+        if not self._handler:
+            self._handler = '/RPC2'
+        self.streamResponses = streamResponses
+        if cache is True:
+            cache = WordPressResponseCache()
+        self.cache = cache
+        self.mediaIndex = mediaIndex
+        # socket timeout of calls in seconds, timeouts overrides it per method
+        self.timeout = timeout
+        self.timeouts = {}
+        self.hedgeAfter = hedgeAfter
+        # (methodName, params) -> _Flight of calls in progress
+        self._flights = {}
+        self._flightsLock = threading.Lock()
+        # transports other than WordPressTransport handle one call at a time
+        self._transportLock = threading.Lock()
+        # hook(event) callables run before and after every remote call
+        self.beforeCall = []
+        self.afterCall = []
+        # WordPressSnapshot, metadata dict of the selected blog loaded from
+        # it or refreshed and its time, error of the last background refresh
+        self.snapshot = snapshot
+        self._metadata = None
+        self._metadataTime = None
+        self.snapshotError = None
+        self._refreshing = threading.Lock()
+        self._warmStart()
+    #}}}
+
+    def _warmStart(self): #{{{
+        """Use snapshot of selected blog, refresh it in the background
+        when missing or older than snapshot.maxAge
+        """
+        self._metadata = None
+        if self.snapshot is None:
+            return
+        found = self.snapshot.load(self.url, self.user, self.blogId)
+        if found is not None:
+            data, saved = found
+            self._useMetadata(data, saved)
+            if time.time() - saved <= self.snapshot.maxAge:
+                return
+        self._refreshInBackground()
+    #}}}
+
+    def _refreshInBackground(self): #{{{
+        if self._refreshing.locked():
+            return
+        thread = threading.Thread(target=self._refreshQuietly,
+                                  name='yawpl-snapshot')
+        thread.daemon = True
+        thread.start()
+    #}}}
+
+    def _useMetadata(self, data, loadTime): #{{{
+        self.methods = data['methods']
+        self.categoryStore.load(map(WordPressCategory.fromStruct,
+                                    data['categories']))
+        self.categoryStore.loadTime = loadTime
+        self._metadata = data
+        self._metadataTime = loadTime
+    #}}}
+
+    def _metadataItems(self, key): #{{{
+        """Get key list of the selected blog metadata, None when there is
+        no metadata or the list was invalidated. Metadata older than
+        snapshot.maxAge or missing a list is still used while it is
+        refreshed in the background.
+        """
+        metadata = self._metadata
+        if metadata is None:
+            return None
+        items = metadata.get(key)
+        if items is None or (self.snapshot is not None and time.time() -
+                             self._metadataTime > self.snapshot.maxAge):
+            self._refreshInBackground()
+        return items
+    #}}}
+
+    def _refreshQuietly(self): #{{{
+        if not self._refreshing.acquire(False):
+            return
+        try:
+            self.refreshSnapshot()
+            self.snapshotError = None
+        except Exception, error:
+            # the client goes on with the data it has
+            self.snapshotError = error
+        finally:
+            self._refreshing.release()
+    #}}}
+
+    def refreshSnapshot(self): #{{{
+        """Fetch the user's blogs, categories, tags and supported methods
+        of the selected blog, use them and save them to snapshot. The
+        three lists are fetched in one request when the server supports
+        system.multicall.
+        """
+        blogId = self.blogId
+        methods = self.supportedMethods(forceUpdate=True)
+        calls = [('blogger.getUsersBlogs', '', self.user, self.password),
+                 ('wp.getCategories', blogId, self.user, self.password),
+                 ('wp.getTags', blogId, self.user, self.password)]
+        if 'system.multicall' in methods:
+            batch = self.batch()
+            for call in calls:
+                batch.call(*call)
+            results = batch.execute()
+            for result in results:
+                if isinstance(result, WordPressException):
+                    raise result
+        else:
+            try:
+                results = [self._call(*call) for call in calls]
+            except xmlrpclib.Fault, fault:
+                raise WordPressException(fault)
+        data = {
+            'blogs'         : results[0],
+            'categories'    : results[1],
+            'tags'          : results[2],
+            'methods'       : list(methods),
+        }
+        if blogId == self.blogId:
+            self._useMetadata(data, time.time())
+        if self.snapshot is not None:
+            self.snapshot.save(self.url, self.user, blogId, data)
+        return data
+    #}}}
+
+    def _getCategories(self): #{{{
+        if self.categoryStore.expired():
+            return None
+        return list(self.categoryStore)
+    #}}}
+
+    def _setCategories(self, categories): #{{{
+        if categories is None:
+            self.categoryStore.clear()
+        else:
+            self.categoryStore.load(categories)
+    #}}}
+
+    categories = property(_getCategories, _setCategories,
+                          doc='Cached categories list, None when not loaded')
+
+    def _callItems(self, methodName, *params): #{{{
+        """Call method returning array. With streamResponses each element
+        is yielded as soon as it is parsed from the response, except for
+        methods served from the response cache
+        """
+        if self.cache is not None and self.cache.cacheable(methodName):
+            return self._call(methodName, *params)
+        if self.streamResponses and hasattr(self._transport, 'requestItems'):
+            return self._streamItems(methodName, params)
+        return self._call(methodName, *params)
+    #}}}
+
+    def _streamItems(self, methodName, params): #{{{
+        """Yield items of streamed response, the call event finishes with
+        the last item or when the caller stops reading early
+        """
+        event = None
+        if self.beforeCall or self.afterCall:
+            event = self._startEvent(methodName)
+        items = None
+        error = None
+        try:
+            start = time.time()
+            body = self._dumps(methodName, params)
+            if event is not None:
+                event.marshalTime = time.time() - start
+                event.bytesSent = len(body)
+            items = self._transport.requestItems(self._host, self._handler,
+                body, event=event, itemClass=self.itemClasses.get(methodName),
+                timeout=self.timeouts.get(methodName, self.timeout))
+            for item in items:
+                yield item
+        except Exception, error:
+            raise
+        finally:
+            if items is not None:
+                # releases the connection of a response not read to the end
+                items.close()
+            if event is not None:
+                self._finishEvent(event, error)
+    #}}}
+
+    def _startEvent(self, methodName): #{{{
+        event = WordPressCallEvent(methodName, self.blogId)
+        for hook in self.beforeCall:
+            hook(event)
+        return event
+    #}}}
+
+    def _finishEvent(self, event, error=None): #{{{
+        event.finish(error)
+        for hook in self.afterCall:
+            hook(event)
+    #}}}
+
+    def _observe(self, methodName, function, *args): #{{{
+        """Return function(*args, event), firing call hooks around it.
+        event is None when there are no hooks.
+        """
+        if not (self.beforeCall or self.afterCall):
+            return function(*args + (None,))
+        event = self._startEvent(methodName)
+        try:
+            result = function(*args + (event,))
+        except Exception:
+            excInfo = sys.exc_info()
+            self._finishEvent(event, excInfo[1])
+            raise excInfo[0], excInfo[1], excInfo[2]
+        self._finishEvent(event)
+        return result
+    #}}}
+
+    def _call(self, methodName, *params): #{{{
+        """Call XML-RPC method, firing call hooks
+        """
+        return self._observe(methodName, self._cachedCall, methodName, params)
+    #}}}
+
+    def _cachedCall(self, methodName, params, event): #{{{
+        """Call XML-RPC method, results of cacheable methods are served
+        from the response cache when it is enabled
+        """
+        cache = self.cache
+        if cache is None or not cache.cacheable(methodName):
+            return self._coalesced(methodName, params, event)
+        key = cache.key(self.url, methodName, params)
+        found, result = cache.get(key)
+        if found:
+            if event is not None:
+                event.cached = True
+        else:
+            result = self._coalesced(methodName, params, event)
+            cache.set(key, result, methodName)
+        return result
+    #}}}
+
+    def _coalesced(self, methodName, params, event): #{{{
+        """Call XML-RPC method. Threads making a read call identical to
+        one in progress wait for it and get a copy of its result.
+        """
+        if methodName not in self.coalescedMethods:
+            return self._invoke(methodName, params, event)
+        key = (methodName, repr(params))
+        with self._flightsLock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            flight.done.wait()
+            if event is not None:
+                event.coalesced = True
+            if flight.error is not None:
+                raise flight.error[0], flight.error[1], flight.error[2]
+            return copy.deepcopy(flight.result)
+        result = None
+        try:
+            result = self._invoke(methodName, params, event)
+        except Exception:
+            flight.error = sys.exc_info()
+            raise
+        finally:
+            with self._flightsLock:
+                del self._flights[key]
+            # the caller may change result as soon as it is returned,
+            # followers copy a private copy made before
+            if flight.followers and flight.error is None:
+                try:
+                    flight.result = copy.deepcopy(result)
+                except Exception:
+                    flight.error = sys.exc_info()
+            flight.done.set()
+        return result
+    #}}}
+
+    def _invoke(self, methodName, params, event=None): #{{{
+        """Marshal XML-RPC call and send it through the transport
+        """
+        start = time.time()
+        body = self._dumps(methodName, params)
+        if event is not None:
+            event.marshalTime = time.time() - start
+            event.bytesSent = len(body)
+        if not isinstance(self._transport, WordPressTransport):
+            with self._transportLock:
+                response = self._transport.request(self._host, self._handler,
+                                                   body)
+        elif self.hedgeAfter is not None and methodName in self.hedgedMethods:
+            response = self._hedged(methodName, body, event)
+        else:
+            response = self._transport.request(self._host, self._handler,
+                body, event=event,
+                timeout=self.timeouts.get(methodName, self.timeout))
+        if len(response) == 1:
+            response = response[0]
+        return response
+    #}}}
+
+    def _hedged(self, methodName, body, event): #{{{
+        """Send request, and a duplicate when no answer came within
+        hedgeAfter seconds and the connection pool has a free connection.
+        Return the first successful response, raise error of the last one
+        when both failed. Only the attempt returned counts in event.
+        """
+        timeout = self.timeouts.get(methodName, self.timeout)
+        transport = self._transport
+        pool = transport.getPool(transport.get_host_info(self._host)[0])
+        results = Queue.Queue()
+        def attempt():
+            # each attempt records into its own event, they run at once
+            attemptEvent = None
+            if event is not None:
+                attemptEvent = WordPressCallEvent(methodName, self.blogId)
+                attemptEvent.bytesSent = event.bytesSent
+            try:
+                response = transport.request(self._host, self._handler, body,
+                    event=attemptEvent, timeout=timeout)
+                results.put((True, response, attemptEvent))
+            except Exception:
+                results.put((False, sys.exc_info(), attemptEvent))
+        def start():
+            thread = threading.Thread(target=attempt, name='yawpl-hedge')
+            thread.daemon = True
+            thread.start()
+        start()
+        # the timer queues the signal to hedge, so that waiting for the
+        # result is not a polling wait with timeout
+        timer = threading.Timer(self.hedgeAfter, results.put,
+                                ((None, None, None),))
+        timer.daemon = True
+        timer.start()
+        running = 1
+        try:
+            while True:
+                ok, value, attemptEvent = results.get()
+                if ok is None:
+                    # a duplicate waiting for a pooled connection would
+                    # only queue behind the first request
+                    if pool.available() > 0:
+                        if event is not None:
+                            event.hedged = True
+                        start()
+                        running += 1
+                    continue
+                running -= 1
+                if ok or not running:
+                    if event is not None:
+                        event._merge(attemptEvent)
+                    if ok:
+                        return value
+                    raise value[0], value[1], value[2]
+        finally:
+            timer.cancel()
+    #}}}
+
+    def _invalidatePost(self, postId): #{{{
+        """Drop cached responses affected by a change of post
+        """
+        if self.cache is not None:
+            self.cache.invalidate(self.url, 'metaWeblog.getPost',
+                                  (str(postId), self.user, self.password))
+        self._invalidateTags()
+    #}}}
+
+    def _invalidateTags(self): #{{{
+        """Drop cached tags, the post keywords may have added some
+        """
+        if self.cache is not None:
+            self.cache.invalidate(self.url, 'wp.getTags',
+                                  (self.blogId, self.user, self.password))
+        metadata = self._metadata
+        if metadata is not None:
+            metadata.pop('tags', None)
+    #}}}
+
+    def selectBlog(self, blogId): #{{{
+        self.blogId = blogId
+        self._resetTemplates()
+        # categories of the blog selected before
+        self.categoryStore.clear()
+        self._warmStart()
+    #}}}
+
+    def supportedMethods(self, forceUpdate=False): #{{{
+        """Get supported methods list
+        """
+        if self.methods == None or forceUpdate == True:
+            self.methods = self._call('mt.supportedMethods')
+        return self.methods
+    #}}}
+
+    def supportsMethod(self, methodName): #{{{
+        """Check if server lists methodName in supported methods
+        """
+        try:
+            return methodName in self.supportedMethods()
+        except xmlrpclib.Fault:
+            self.methods = []
+            return False
+    #}}}
+
+    def batch(self): #{{{
+        """Get WordPressBatch collecting calls in one system.multicall request
+        """
+        return WordPressBatch(self)
+    #}}}
+
+    def _finishPost(self, postId, categories, publish, batch=None): #{{{
+        """Set categories unless None and publish post, in one request if
+        server supports system.multicall. Neither call depends on the
+        other succeeding.
+        """
+        if batch is None:
+            if (categories is None or not publish or
+                    not self.supportsMethod('system.multicall')):
+                if categories is not None:
+                    self.setPostCategories(postId, categories)
+                if publish:
+                    self.publishPost(postId)
+                return
+            batch = self.batch()
+        if categories is not None:
+            batch.call('mt.setPostCategories', postId, self.user,
+                       self.password, categories)
+        if publish:
+            batch.call('mt.publishPost', postId, self.user, self.password)
+        for result in batch.execute():
+            if isinstance(result, WordPressException):
+                raise result
+        return batch.results
+    #}}}
+
+    def _iterPages(self, fetch, pageSize, prefetch): #{{{
+        """Yield items of pages fetch(offset, number) until a short page.
+        With prefetch the next page is fetched in a background thread
+        while the current one is consumed.
+        """
+        if not prefetch:
+            offset = 0
+            while True:
+                page = fetch(offset, pageSize)
+                for item in page:
+                    yield item
+                if len(page) < pageSize:
+                    return
+                offset += pageSize
+
+        pages = Queue.Queue(1)
+        stop = threading.Event()
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except Queue.Full:
+                    pass
+        def worker():
+            offset = 0
+            try:
+                while not stop.is_set():
+                    page = fetch(offset, pageSize)
+                    put((page, None))
+                    if len(page) < pageSize:
+                        return
+                    offset += pageSize
+            except:
+                put((None, sys.exc_info()))
+        thread = threading.Thread(target=worker, name='yawpl-prefetch')
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                page, error = pages.get()
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                for item in page:
+                    yield item
+                if len(page) < pageSize:
+                    return
+        finally:
+            stop.set()
+    #}}}
+
+    def getLastPost(self): #{{{
+        """Get last post
+        """
+        return tuple(self.getRecentPosts(1))[0]
+    #}}}
+
+    def getRecentPosts(self, numPosts=5, fields=None): #{{{
+        """Get recent posts. fields, a list of WordPressPost attribute
+        names, limits what is fetched to those attributes and the status,
+        other ones keep their defaults. The cheapest listing method the
+        server supports is used: mt.getRecentPostTitles for ids, titles,
+        dates and users, else wp.getPosts with a fields list.
+        mt.getRecentPostTitles does not return the status: editPost then
+        only changes the content of the posts when publishing them, add
+        'status' to fields to list them with wp.getPosts instead.
+        """
+        keys = None
+        if fields is not None:
+            keys = self._postKeys(fields)
+        return self._recentPosts(numPosts, fields, keys)
+    #}}}
+
+    def _recentPosts(self, numPosts, fields, keys): #{{{
+        """Yield recent posts for getRecentPosts, keeping only keys of
+        fields unless fields is None
+        """
+        try:
+            if fields is None:
+                posts = self._callItems('metaWeblog.getRecentPosts',
+                    self.blogId, self.user, self.password, numPosts)
+                for post in posts:
+                    yield self._filterPost(post)
+                return
+            methodName = self._postListMethod(fields)
+            if methodName == 'wp.getPosts':
+                posts = self._callItems('wp.getPosts', self.blogId, self.user,
+                    self.password, {'post_type' : 'post', 'number' : numPosts},
+                    self._wpFields(fields))
+                for post in posts:
+                    yield self._projectPost(self._wpPostStruct(post), keys)
+                return
+            posts = self._callItems(methodName, self.blogId, self.user,
+                                    self.password, numPosts)
+            for post in posts:
+                yield self._projectPost(post, keys)
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+
+    def _postListMethod(self, fields, paged=False): #{{{
+        """Get cheapest supported method listing posts with fields. For
+        paged listings wp.getPosts is preferred, other methods fetch the
+        previous pages again.
+        """
+        titles = (set(fields) <= self._titleFields and
+                  self.supportsMethod('mt.getRecentPostTitles'))
+        if titles and not paged:
+            return 'mt.getRecentPostTitles'
+        if self.supportsMethod('wp.getPosts'):
+            return 'wp.getPosts'
+        if titles:
+            return 'mt.getRecentPostTitles'
+        return 'metaWeblog.getRecentPosts'
+    #}}}
+
+    def _wpFields(self, fields): #{{{
+        """Get wp.getPosts fields list returning WordPressPost fields and
+        post_status
+        """
+        wpFields = set(['post_status'])
+        for name in fields:
+            wpFields.update(self._wpPostFields[name])
+        return sorted(wpFields)
+    #}}}
+
+    def iterPosts(self, pageSize=100, prefetch=True, fields=None): #{{{
+        """Iterate over all blog posts, pageSize posts per request.
+        Uses wp.getPosts, servers without it page through
+        metaWeblog.getRecentPosts re-fetching previous pages. fields
+        limits what is fetched as for getRecentPosts.
+        """
+        keys = None
+        if fields is not None:
+            keys = self._postKeys(fields)
+        def fetch(offset, number):
+            try:
+                if fields is not None:
+                    methodName = self._postListMethod(fields, True)
+                elif self.supportsMethod('wp.getPosts'):
+                    methodName = 'wp.getPosts'
+                else:
+                    methodName = 'metaWeblog.getRecentPosts'
+                if methodName == 'wp.getPosts':
+                    params = [self.blogId, self.user, self.password,
+                              {'post_type' : 'post', 'number' : number,
+                               'offset' : offset}]
+                    if fields is not None:
+                        params.append(self._wpFields(fields))
+                    posts = map(self._wpPostStruct, self._call(methodName,
+                                                               *params))
+                else:
+                    posts = self._call(methodName, self.blogId, self.user,
+                        self.password, offset + number)[offset:]
+                if keys is None:
+                    return map(self._filterPost, posts)
+                return [self._projectPost(post, keys) for post in posts]
+            except xmlrpclib.Fault, fault:
+                raise WordPressException(fault)
+        return self._iterPages(fetch, pageSize, prefetch)
+    #}}}
+
+    def getPost(self, postId): #{{{
+        """Get post item
+        """
+        try:
+            return self._filterPost(self._call('metaWeblog.getPost', str(postId), self.user, self.password))
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+
+    def getUserInfo(self): #{{{
+        """Get user info
+        """
+        try:
+            userinfo = self._call('blogger.getUserInfo', '', self.user, self.password)
+            return self._filterUser(userinfo)
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+
+    def getUsersBlogs(self, forceUpdate=False): #{{{
+        """Get blog's users info, from the snapshot when one is loaded
+        """
+        try:
+            blogs = None if forceUpdate else self._metadataItems('blogs')
+            if blogs is None:
+                blogs = self._call('blogger.getUsersBlogs', '', self.user,
+                                   self.password)
+            for blog in blogs:
+                yield self._filterBlog(blog)
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+
+    def newCategory(self, category): #{{{
+        """Add new category
+        """
+        blogContent = self._newCategoryContent(category)
+        idNewCat = int(self._call('wp.newCategory', self.blogId, self.user, self.password, blogContent))
+        if self.categoryStore.loadTime is not None:
+            catObj = WordPressCategory()
+            catObj.id           = idNewCat
+            catObj.name         = category.name
+            catObj.slug         = category.slug
+            catObj.description  = category.description
+            catObj.parentId     = category.parentId
+            self.categoryStore.add(catObj)
+        return idNewCat
+    #}}}
+
+    def newPost(self, post, publish): #{{{
+        """Insert new post
+        """
+        blogContent = self._newPostContent(post)
+        # add categories
+        categories = self._postCategories(post)
+        
+        # insert new post
+        idNewPost = int(self._call('metaWeblog.newPost', self.blogId, self.user, self.password, blogContent, 0))
+        
+        # set categories for new post and publish post if publish set at
+        # True, the post id is needed so this is a second request
+        self._finishPost(idNewPost, categories, publish)
+        self._invalidatePost(idNewPost)
+            
+        return idNewPost
+    #}}}
+    
+    def getPostCategories(self, postId): #{{{
+        """Get post's categories
+        """
+        try:
+            categories = self._call('mt.getPostCategories', postId, self.user, 
+                                                    self.password)
+            for cat in categories:
+                yield self._filterCategory(cat) 
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+    
+    def setPostCategories(self, postId, categories): #{{{
+        """Set post's categories
+        """
+        self._call('mt.setPostCategories', postId, self.user, self.password, categories)
+        self._invalidatePost(postId)
+    #}}}
+    
+    def editPost(self, postId, post, publish): #{{{
+        """Edit post. For a post loaded from the blog only the fields
+        changed since are sent, categories are set and the post published
+        only when that changes them, nothing is sent for an unchanged post.
+        """
+        blogcontent, categories, flag, publish = self._postChanges(post,
+                                                                   publish)
+        finish = categories is not None or publish
+        
+        if blogcontent is not None:
+            # system.multicall runs every call even when one faults, so
+            # categories and publishing wait for the edit to succeed
+            try:
+                result = self._call('metaWeblog.editPost', postId, self.user,
+                                    self.password, blogcontent, flag)
+            except xmlrpclib.Fault, fault:
+                raise WordPressException(fault)
+        
+            if result == 0:
+                raise WordPressException('Post edit failed')
+            
+        if finish:
+            # set categories and publish post
+            self._finishPost(postId, categories, publish)
+        self._postEdited(post, blogcontent, categories, flag, publish)
+        if blogcontent is not None or finish:
+            self._invalidatePost(postId)
+    #}}}
+    
+    def deletePost(self, postId): #{{{
+        """Delete post
+        """
+        try:
+            result = self._call('blogger.deletePost', '', postId, self.user, 
+                                             self.password)
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+        self._invalidatePost(postId)
+        return result
+    #}}}
+    
+    def deleteCategory(self, categoryId): #{{{
+        """Delete category
+        """
+        try:
+            result = self._call('wp.deleteCategory', self.blogId, self.user,
+                                self.password, categoryId)
+            self.categoryStore.remove(int(categoryId))
+            return result
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+
+    def getCategoryStore(self, forceUpdate=False): #{{{
+        """Get WordPressCategoryStore with blog's categories, reloaded
+        when expired
+        """
+        try:
+            if self.categoryStore.expired() or forceUpdate == True:
+                categories = self._call('wp.getCategories', self.blogId, 
+                    self.user, self.password)               
+                self.categoryStore.load(map(self._filterCategory, categories))
+            return self.categoryStore
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+
+    def getCategoryList(self, forceUpdate=False): #{{{
+        """Get blog's categories list
+        """
+        return list(self.getCategoryStore(forceUpdate))
+    #}}}
+
+    def getCategoryIdFromName(self, name): #{{{
+        """Get category id from category name
+        """
+        category = self.getCategoryStore().getByName(name)
+        if category is not None:
+            return category.id
+    #}}}
+
+    def getCategoryFromSlug(self, slug): #{{{
+        """Get category from category slug, known only for categories
+        added with newCategory or by servers returning slugs
+        """
+        return self.getCategoryStore().getBySlug(slug)
+    #}}}
+    
+    def getTrackbackPings(self, postId): #{{{
+        """Get trackback pings of post
+        """
+        try:
+            return self._call('mt.getTrackbackPings', postId)
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+    
+    def publishPost(self, postId): #{{{
+        """Publish post
+        """
+        try:
+            result = (self._call('mt.publishPost', postId, self.user, self.password) == 1)
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+        self._invalidatePost(postId)
+        return result
+    #}}}
+    
+    def getPingbacks(self, postUrl): #{{{
+        """Get pingbacks of post
+        """
+        try:
+            return self._call('pingback.extensions.getPingbacks', postUrl)
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+    
+    def getTags(self, forceUpdate=False): #{{{
+        """Get Blog tags, from the snapshot when one is loaded
+        """
+        try:
+            tags = None if forceUpdate else self._metadataItems('tags')
+            if tags is None:
+                tags = self._callItems('wp.getTags', self.blogId, self.user,
+                                       self.password)
+
+            for tag in tags:
+                yield self._filterTag(tag) 
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+
+    def newMediaObject(self, mediaFile, name=None, progress=None): #{{{
+        """Add new media object (image, movie, etc...)
+
+        mediaFile is a file name or a file-like object. The file is read,
+        base64-encoded and sent chunk by chunk, so memory use does not
+        depend on its size. progress(sentBytes, totalBytes) is called
+        after each chunk, totalBytes is None when size is unknown.
+
+        With mediaIndex the URL of identical media already uploaded to the
+        blog is returned without uploading it again.
+        """
+        index = self.mediaIndex
+        if index is not None:
+            hashed = index.hashFile(mediaFile)
+            if hashed is not None:
+                url = index.get(self.url, self.blogId, hashed[0])
+                if url is not None:
+                    return url
+            url = self._newMediaObject(mediaFile, name, progress)
+            if hashed is not None:
+                index.add(self.url, self.blogId, hashed[0], url, name,
+                          hashed[1])
+            return url
+        return self._newMediaObject(mediaFile, name, progress)
+    #}}}
+
+    def _newMediaObject(self, mediaFile, name, progress): #{{{
+        if isinstance(mediaFile, basestring):
+            f = file(mediaFile, 'rb')
+        else:
+            f = mediaFile
+        if name is None:
+            name = os.path.basename(getattr(f, 'name', 'media'))
+        try:
+            try:
+                if not hasattr(self._transport, 'requestStream'):
+                    mediaStruct = {
+                        'name' : name,
+                        'bits' : xmlrpclib.Binary(f.read())
+                    }
+                    result = self._call('metaWeblog.newMediaObject', self.blogId, 
+                                            self.user, self.password, mediaStruct)
+                    return result['url']
+                result = self._observe('metaWeblog.newMediaObject',
+                    self._newMediaStream, f, name, progress)
+                return result[0]['url']
+            except xmlrpclib.Fault, fault:
+                raise WordPressException(fault)
+        finally:
+            if f is not mediaFile:
+                f.close()
+    #}}}
+
+    def _newMediaStream(self, f, name, progress, event=None): #{{{
+        """Stream metaWeblog.newMediaObject request with bits read from f
+        """
+        body, contentLength = self._mediaRequest(f, name, progress)
+        return self._transport.requestStream(self._host, self._handler, body,
+            contentLength, event=event, timeout=self.timeouts.get(
+            'metaWeblog.newMediaObject', self.timeout))
+    #}}}
+    
+    def suggestCategories(self, string, maxResults=5): #{{{
+        """Suggest Categories
+        """
+        try:
+            cats = self._call('wp.suggestCategories', self.blogId, self.user,
+            self.password, string, maxResults)
+
+            for cat in cats:
+                yield self._filterCategory(cat)
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+
+    def getComment(self, commentId): #{{{
+        """Get comment.
+        """
+        try:
+            return self._filterComment(self._call('wp.getComment', self.blogId,
+            self.user, self.password, commentId))
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+
+    def getComments(self, status='approve', post_id=0, number=10, offset=0): #{{{
+        """Get comments.
+        """
+        struct = self._commentsFilter(status, post_id, number, offset)
+        try:
+            comments = self._callItems('wp.getComments', self.blogId, self.user,
+            self.password, struct)
+
+            for comment in comments:
+                yield self._filterComment(comment)
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+    #}}}
+
+    def iterComments(self, status='approve', post_id=0, pageSize=100,
+                     prefetch=True): #{{{
+        """Iterate over all comments, pageSize comments per request
+        """
+        def fetch(offset, number):
+            struct = self._commentsFilter(status, post_id, number, offset)
+            try:
+                comments = self._call('wp.getComments', self.blogId, self.user,
+                    self.password, struct)
+                return map(self._filterComment, comments)
+            except xmlrpclib.Fault, fault:
+                raise WordPressException(fault)
+        return self._iterPages(fetch, pageSize, prefetch)
+    #}}}
+
+    def getCommentIndex(self, status='', post_id=0, pageSize=100): #{{{
+        """Get WordPressCommentIndex with all comments, of every status
+        by default
+        """
+        return WordPressCommentIndex(self.iterComments(status, post_id,
+                                                       pageSize))
+    #}}}
+
+    def updateCommentIndex(self, index, status='', post_id=0, pageSize=100): #{{{
+        """Add comments newer than the newest one in index, reading pages
+        newest first until a page reaches known comments. Return number of
+        comments added. Changes to comments already in index are not seen,
+        index.update() them from getComment().
+        """
+        newest = index.newestId()
+        offset = added = 0
+        while True:
+            page = list(self.getComments(status, post_id, pageSize, offset))
+            fresh = [comment for comment in page if comment.id > newest]
+            added += index.update(fresh)
+            if len(fresh) < len(page) or len(page) < pageSize:
+                return added
+            offset += pageSize
+    #}}}
+
+    def _attempt(self, limit, retries, backoff, retryable, function,
+                 *args): #{{{
+        """Call function under concurrency limit, retrying failures for
+        which retryable(error) is true with exponential backoff. Return
+        result or exception.
+        """
+        attempt = 0
+        while True:
+            limit.acquire()
+            start = time.time()
+            try:
+                result = function(*args)
+            except Exception, error:
+                limit.release(time.time() - start, False)
+                if attempt < retries and retryable(error):
+                    time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+                    attempt += 1
+                    continue
+                if isinstance(error, xmlrpclib.Fault):
+                    error = WordPressException(error)
+                return error
+            limit.release(time.time() - start)
+            return result
+    #}}}
+
+    def _bulk(self, task, items, ordered, maxWorkers): #{{{
+        """Run task(item) for items on maxWorkers threads, yield (index,
+        result) tuples in input order or as each task completes. Closing
+        the generator early drops the queued items and waits for the
+        running tasks.
+        """
+        tasks = Queue.Queue()
+        results = Queue.Queue()
+        stopped = threading.Event()
+        def worker():
+            while True:
+                job = tasks.get()
+                if job is None or stopped.is_set():
+                    return
+                index, item = job
+                try:
+                    result = task(item)
+                except Exception, error:
+                    result = error
+                results.put((index, result))
+        threads = []
+        for i in range(maxWorkers):
+            thread = threading.Thread(target=worker, name='yawpl-bulk')
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # at most window items are queued, running or waiting for an
+        # earlier one to complete
+        window = maxWorkers * 4
+        items = iter(items)
+        exhausted = False
+        submitted = returned = 0
+        done = {}
+        try:
+            while True:
+                while not exhausted and submitted - returned < window:
+                    try:
+                        tasks.put((submitted, items.next()))
+                        submitted += 1
+                    except StopIteration:
+                        exhausted = True
+                if returned == submitted:
+                    return
+                index, result = results.get()
+                if not ordered:
+                    returned += 1
+                    yield index, result
+                    continue
+                done[index] = result
+                while returned in done:
+                    yield returned, done.pop(returned)
+                    returned += 1
+        finally:
+            stopped.set()
+            try:
+                while True:
+                    tasks.get_nowait()
+            except Queue.Empty:
+                pass
+            for thread in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
+    #}}}
+
+    def bulkNewPosts(self, posts, publish=False, ordered=True, maxWorkers=None,
+                     retries=3, backoff=0.5, limit=None): #{{{
+        """Insert posts concurrently, yield (index, result) tuples where
+        result is the new post id or the exception raised for the post.
+        Concurrency is adjusted by limit, a WordPressAdaptiveLimit, up to
+        maxWorkers (default: the transport's maxConnections). Failures are
+        retried up to retries times with backoff seconds doubled between
+        attempts: metaWeblog.newPost only when the request could not be
+        sent at all, setting categories and publishing on any transient
+        failure. When the post may have been created anyway the exception
+        has postMayExist set; when setting categories or publishing fails
+        it has the postId of the created post.
+        """
+        if limit is None:
+            limit = WordPressAdaptiveLimit(maximum=maxWorkers or
+                getattr(self._transport, 'maxConnections', 4))
+        def newPost(post):
+            return self._bulkNewPost(limit, retries, backoff, post, publish)
+        return self._bulk(newPost, posts, ordered, limit.maximum)
+    #}}}
+
+    def _bulkNewPost(self, limit, retries, backoff, post, publish,
+                     blogContent=None): #{{{
+        """Insert post for bulk operations, return new post id or the
+        exception raised, which has postId when the post was created.
+        blogContent is the metaWeblog.newPost struct sent, by default the
+        one of post.
+        """
+        if blogContent is None:
+            blogContent = self._newPostContent(post)
+        categories = self._postCategories(post)
+        # a resent request would create the post twice
+        result = self._attempt(limit, retries, backoff, _isUnsent, self._call,
+            'metaWeblog.newPost', self.blogId, self.user, self.password,
+            blogContent, 0)
+        if isinstance(result, Exception):
+            if not (isinstance(result, WordPressException) or
+                    _isUnsent(result)):
+                result.postMayExist = True
+            return result
+        postId = int(result)
+        result = self._attempt(limit, retries, backoff, _isTransient,
+                               self._finishPost, postId, categories, publish)
+        if isinstance(result, Exception):
+            result.postId = postId
+            return result
+        self._invalidatePost(postId)
+        return postId
+    #}}}
+
+    def bulkEditPosts(self, edits, publish=False, ordered=True, maxWorkers=None,
+                      retries=3, backoff=0.5, limit=None): #{{{
+        """Edit posts concurrently, edits are (postId, post) tuples or
+        posts loaded from the blog. Yield (index, result) tuples where
+        result is None or the exception raised for the post. As for
+        editPost, loaded posts only send their changes and unchanged ones
+        are skipped. Options are the same as for bulkNewPosts.
+        """
+        if limit is None:
+            limit = WordPressAdaptiveLimit(maximum=maxWorkers or
+                getattr(self._transport, 'maxConnections', 4))
+        def editPost(edit):
+            if isinstance(edit, WordPressPost):
+                postId, post = edit.id, edit
+            else:
+                postId, post = edit
+            return self._attempt(limit, retries, backoff, _isTransient,
+                                 self.editPost, postId, post, publish)
+        return self._bulk(editPost, edits, ordered, limit.maximum)
+    #}}}
+
+    def exportBlog(self, stream, pageSize=100): #{{{
+        """Write selected blog to stream as JSON Lines: a header, then
+        categories, tags, posts each followed by the media URLs found in
+        it, and comments. Records are written as pages arrive, comments
+        go through a temporary SQLite file to be written oldest first, so
+        that replies follow the comments they answer. Return dict of
+        record counts per type.
+        """
+        counts = {}
+        for kind, line in self._exportRecords(pageSize):
+            stream.write(line)
+            stream.write('\n')
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+    #}}}
+
+    def _exportRecords(self, pageSize): #{{{
+        """Yield (type, JSON line) of exported records
+        """
+        yield 'blog', _jsonRecord('blog', version=_exportVersion,
+                                  url=self.url, blogId=self.blogId)
+        for category in self.getCategoryStore(forceUpdate=True).descendants():
+            yield 'category', _jsonRecord('category', id=category.id,
+                                          struct=category.struct())
+        for tag in self.getTags():
+            yield 'tag', _jsonRecord('tag', id=tag.id, struct=tag.struct())
+        for post in self.iterPosts(pageSize):
+            yield 'post', _jsonRecord('post', id=post.id, struct=post.struct())
+            urls = set()
+            for url in _mediaUrls(post.description + post.textMore):
+                if url not in urls:
+                    urls.add(url)
+                    yield 'media', _jsonRecord('media', post=post.id, url=url)
+        fd, path = tempfile.mkstemp(suffix='.db', prefix='yawpl-export-')
+        os.close(fd)
+        try:
+            spool = sqlite3.connect(path)
+            try:
+                spool.execute('CREATE TABLE comments (id INTEGER PRIMARY KEY, '
+                              'line TEXT)')
+                # pages shift while comments arrive, the id key drops
+                # comments fetched twice
+                with spool:
+                    spool.executemany('INSERT OR REPLACE INTO comments VALUES '
+                        '(?, ?)', ((comment.id, _jsonRecord('comment',
+                        id=comment.id, struct=comment.struct())) for comment
+                        in self.iterComments('', pageSize=pageSize)))
+                for row in spool.execute('SELECT line FROM comments '
+                                         'ORDER BY id'):
+                    yield 'comment', str(row[0])
+            finally:
+                spool.close()
+        finally:
+            os.remove(path)
+    #}}}
+
+    def importBlog(self, stream, checkpoint=None, batchSize=100,
+                   maxWorkers=None, retries=3, backoff=0.5): #{{{
+        """Import blog written by exportBlog into selected blog. Records
+        are read from stream as they are needed and written in batches of
+        batchSize, posts and comments of a batch concurrently as in
+        bulkNewPosts. Categories are matched by name, tags by name and
+        created with wp.newTerm; without it they are only created by the
+        posts using them and are listed as failed. Posts keep their
+        excerpt, slug, comment and ping settings, status and author id,
+        which must exist in the blog. Media files are not copied: media
+        records are listed as failed with the URL, the posts still
+        reference the old files.
+
+        checkpoint is the path of a SQLite file keeping the position in
+        stream and the ids of imported items; importing the same stream
+        again with it resumes after the last finished batch and skips
+        items imported already. Without checkpoint a temporary file is
+        used.
+
+        Return dict of imported record counts per type, 'failed' is the
+        list of (type, id, exception) for records that were not imported.
+        Creating posts and comments is retried only when the request could
+        not be sent; an exception with postMayExist or commentMayExist set
+        means the item may have been created all the same, check the blog
+        before importing it again.
+        """
+        limit = WordPressAdaptiveLimit(maximum=maxWorkers or
+            getattr(self._transport, 'maxConnections', 4))
+        result = {'failed' : []}
+        state = _ImportState(checkpoint)
+        try:
+            for kind, batch, position in _importBatches(stream, state,
+                                                        batchSize):
+                if kind == 'category':
+                    self._importCategories(batch, state, result)
+                elif kind == 'tag':
+                    self._importTags(batch, state, result)
+                elif kind == 'post':
+                    self._importPosts(batch, state, result, limit, retries,
+                                      backoff)
+                elif kind == 'comment':
+                    self._importComments(batch, state, result, limit, retries,
+                                         backoff)
+                elif kind == 'media':
+                    result['failed'].extend(('media', postId,
+                        WordPressException('Media %s of post was not '
+                                           'imported' % struct['url']))
+                        for postId, struct in batch)
+                else:
+                    result[kind] = result.get(kind, 0) + len(batch)
+                state.setPosition(position)
+        finally:
+            state.close()
+        return result
+    #}}}
+
+    def _imported(self, result, kind, state, oldId, newId): #{{{
+        state.set(kind, oldId, newId)
+        result[kind] = result.get(kind, 0) + 1
+    #}}}
+
+    def _importCategories(self, batch, state, result): #{{{
+        """Create categories missing in blog, parents come first
+        """
+        store = self.getCategoryStore()
+        for oldId, struct in batch:
+            if state.get('category', oldId) is not None:
+                continue
+            category = WordPressCategory.fromStruct(struct)
+            existing = store.getByName(category.name)
+            try:
+                if existing is not None:
+                    newId = existing.id
+                else:
+                    category.parentId = int(state.get('category',
+                                                      category.parentId) or 0)
+                    newId = self.newCategory(category)
+            except Exception, error:
+                result['failed'].append(('category', oldId, error))
+                continue
+            self._imported(result, 'category', state, oldId, newId)
+    #}}}
+
+    def _importTags(self, batch, state, result): #{{{
+        """Create tags missing in blog with wp.newTerm
+        """
+        existing = None
+        for oldId, struct in batch:
+            if state.get('tag', oldId) is not None:
+                continue
+            tag = WordPressTag.fromStruct(struct)
+            try:
+                if not self.supportsMethod('wp.newTerm'):
+                    raise WordPressException('Server does not support '
+                                             'wp.newTerm, tag %s was not '
+                                             'imported' % tag.name)
+                if existing is None:
+                    existing = dict((item.name, item.id) for item in
+                                    self.getTags(forceUpdate=True))
+                newId = existing.get(tag.name)
+                if newId is None:
+                    newId = self._call('wp.newTerm', self.blogId, self.user,
+                        self.password, {'taxonomy' : 'post_tag',
+                        'name' : tag.name, 'slug' : tag.slug})
+                    self._invalidateTags()
+            except Exception, error:
+                result['failed'].append(('tag', oldId, error))
+                continue
+            self._imported(result, 'tag', state, oldId, newId)
+    #}}}
+
+    def _importContent(self, post): #{{{
+        """Transform exported WordPressPost instance in metaWeblog.newPost
+        struct keeping all it can set
+        """
+        blogContent = self._newPostContent(post)
+        blogContent.update({
+            'mt_excerpt'        : post.excerpt,
+            'mt_allow_comments' : int(post.allowComments),
+            'mt_allow_pings'    : int(post.allowPings),
+        })
+        if post.slug:
+            blogContent['wp_slug'] = post.slug
+        if post.user:
+            blogContent['wp_author_id'] = post.user
+        # published posts are published once their categories are set,
+        # WordPress makes those dated later future posts again
+        if post.status not in ('', 'publish', 'future'):
+            blogContent['post_status'] = post.status
+        return blogContent
+    #}}}
+
+    def _importPosts(self, batch, state, result, limit, retries, backoff): #{{{
+        """Create posts concurrently, with categories mapped by name
+        """
+        store = self.getCategoryStore()
+        jobs = []
+        for oldId, struct in batch:
+            if state.get('post', oldId) is not None:
+                continue
+            post = WordPressPost.fromStruct(struct)
+            post.categories = [category.id for category in
+                               map(store.getByName, post.categories)
+                               if category is not None]
+            jobs.append((oldId, post))
+        def newPost(job):
+            post = job[1]
+            return self._bulkNewPost(limit, retries, backoff, post,
+                                     post.status in ('', 'publish', 'future'),
+                                     self._importContent(post))
+        for index, postId in self._bulk(newPost, jobs, False, limit.maximum):
+            oldId = jobs[index][0]
+            if isinstance(postId, Exception):
+                result['failed'].append(('post', oldId, postId))
+                postId = getattr(postId, 'postId', None)
+                if postId is None:
+                    continue
+            self._imported(result, 'post', state, oldId, postId)
+    #}}}
+
+    def _importComments(self, batch, state, result, limit, retries,
+                        backoff): #{{{
+        """Create comments concurrently on the imported posts, then set
+        their status, date and author. Replies are in later batches than
+        the comments they answer.
+        """
+        jobs = []
+        for oldId, struct in batch:
+            if state.get('comment', oldId) is not None:
+                continue
+            comment = WordPressComment.fromStruct(struct)
+            postId = state.get('post', comment.postId)
+            if postId is None:
+                result['failed'].append(('comment', oldId, WordPressException(
+                    'Post %s of comment was not imported' % comment.postId)))
+                continue
+            jobs.append((oldId, comment, int(postId),
+                         int(state.get('comment', comment.parent) or 0)))
+        def newComment(job):
+            oldId, comment, postId, parent = job
+            commentId = self._attempt(limit, retries, backoff, _isUnsent,
+                self._call, 'wp.newComment', self.blogId, self.user,
+                self.password, postId, {'comment_parent' : parent,
+                'content' : comment.content, 'author' : comment.author,
+                'author_url' : comment.authorUrl,
+                'author_email' : comment.authorEmail})
+            if isinstance(commentId, Exception):
+                if not (isinstance(commentId, WordPressException) or
+                        _isUnsent(commentId)):
+                    commentId.commentMayExist = True
+                return commentId
+            commentId = int(commentId)
+            edit = {
+                'status'        : comment.status or 'approve',
+                'content'       : comment.content,
+                'author'        : comment.author,
+                'author_url'    : comment.authorUrl,
+                'author_email'  : comment.authorEmail,
+            }
+            if comment.date is not None:
+                edit['date_created_gmt'] = xmlrpclib.DateTime(comment.date)
+            error = self._attempt(limit, retries, backoff, _isTransient,
+                self._call, 'wp.editComment', self.blogId, self.user, self.password,
+                commentId, edit)
+            if isinstance(error, Exception):
+                error.commentId = commentId
+                return error
+            return commentId
+        for index, commentId in self._bulk(newComment, jobs, False,
+                                           limit.maximum):
+            oldId = jobs[index][0]
+            if isinstance(commentId, Exception):
+                result['failed'].append(('comment', oldId, commentId))
+                commentId = getattr(commentId, 'commentId', None)
+                if commentId is None:
+                    continue
+            self._imported(result, 'comment', state, oldId, commentId)
+    #}}}
+
+
+#}}}
+
+_exportVersion = 1
+
+def _jsonValue(value): #{{{
+    """Encode XML-RPC values json does not know
+    """
+    if isinstance(value, xmlrpclib.DateTime):
+        return value.value
+    if isinstance(value, xmlrpclib.Binary):
+        return base64.encodestring(value.data)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime('%Y%m%dT%H:%M:%S')
+    raise TypeError('%r is not JSON serializable' % (value,))
+#}}}
+
+def _jsonRecord(kind, **fields):
+    fields['type'] = kind
+    return json.dumps(fields, default=_jsonValue, separators=(',', ':'))
+
+def _jsonTagged(value): #{{{
+    """Encode XML-RPC values json does not know as objects with one tag
+    key, which _loadJson turns back into the values
+    """
+    if isinstance(value, xmlrpclib.DateTime):
+        return {'__dateTime__' : value.value}
+    if isinstance(value, xmlrpclib.Binary):
+        return {'__base64__' : base64.encodestring(value.data)}
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__' : value.strftime('%Y%m%dT%H:%M:%S')}
+    raise TypeError('%r is not JSON serializable' % (value,))
+#}}}
+
+def _jsonRestore(value): #{{{
+    """Get XML-RPC value of decoded JSON value, ASCII strings are str as
+    xmlrpclib returns them
+    """
+    if isinstance(value, unicode):
+        try:
+            return value.encode('ascii')
+        except UnicodeError:
+            return value
+    if isinstance(value, list):
+        return map(_jsonRestore, value)
+    if isinstance(value, dict):
+        if len(value) == 1:
+            key, tagged = value.items()[0]
+            if key == '__dateTime__':
+                return xmlrpclib.DateTime(str(tagged))
+            if key == '__base64__':
+                return xmlrpclib.Binary(base64.decodestring(tagged))
+            if key == '__datetime__':
+                return datetime.datetime.strptime(tagged, '%Y%m%dT%H:%M:%S')
+        return dict((_jsonRestore(key), _jsonRestore(item))
+                    for key, item in value.iteritems())
+    return value
+#}}}
+
+def _dumpJson(value):
+    return json.dumps(value, default=_jsonTagged, separators=(',', ':'))
+
+def _loadJson(data):
+    return _jsonRestore(json.loads(data))
+
+_mediaUrls = re.compile(r'''https?://[^\s"'<>()]+/wp-content/uploads/'''
+                        r'''[^\s"'<>()]+''').findall
+
+def _importBatches(stream, state, batchSize): #{{{
+    """Yield (type, [(id, struct)], next line number) batches of records of
+    one type read from stream, starting after the checkpoint position. A
+    comment replying to one in the current batch starts a new batch.
+    """
+    kind = None
+    batch = []
+    ids = set()
+    lineNo = -1
+    for lineNo, line in enumerate(stream):
+        if lineNo < state.position or not line.strip():
+            continue
+        record = json.loads(line)
+        record['type'] = str(record['type'])
+        if record['type'] == 'blog':
+            if record.get('version', 0) > _exportVersion:
+                raise WordPressException('Unsupported export version %s' %
+                                         record['version'])
+            continue
+        if record['type'] == 'media':
+            key, struct = record['post'], record
+        else:
+            key, struct = record['id'], record['struct']
+        if batch and (record['type'] != kind or len(batch) >= batchSize or
+                (kind == 'comment' and struct.get('parent') in ids)):
+            yield kind, batch, lineNo
+            batch = []
+            ids.clear()
+        kind = record['type']
+        batch.append((key, struct))
+        if kind == 'comment':
+            ids.add(str(key))
+    if batch:
+        yield kind, batch, lineNo + 1
+#}}}
+
+_importSchema = '''
+PRAGMA synchronous = NORMAL;
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS ids (kind TEXT, old TEXT, new TEXT,
+    PRIMARY KEY (kind, old));
+'''
+
+class _ImportState(object): #{{{
+    """Position in import stream and old to new item ids, in a SQLite file
+    so that memory use does not grow with the blog
+    """
+    def __init__(self, path=None):
+        self.temporary = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix='.db', prefix='yawpl-import-')
+            os.close(fd)
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.executescript(_importSchema)
+        row = self._db.execute("SELECT value FROM state WHERE key = "
+                               "'position'").fetchone()
+        self.position = row and int(row[0]) or 0
+
+    def close(self): #{{{
+        self._db.close()
+        if self.temporary:
+            os.remove(self.path)
+    #}}}
+
+    def get(self, kind, oldId): #{{{
+        row = self._db.execute('SELECT new FROM ids WHERE kind = ? AND '
+                               'old = ?', (kind, str(oldId))).fetchone()
+        return row and row[0]
+    #}}}
+
+    def set(self, kind, oldId, newId): #{{{
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO ids VALUES (?, ?, ?)',
+                             (kind, str(oldId), str(newId)))
+    #}}}
+
+    def setPosition(self, position): #{{{
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO state VALUES "
+                             "('position', ?)", (str(position),))
+        self.position = position
+    #}}}
+#}}}
+
+_mirrorSchema = '''
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS posts (id INTEGER PRIMARY KEY, date TEXT,
+    modified TEXT, struct TEXT);
+CREATE INDEX IF NOT EXISTS posts_date ON posts (date);
+CREATE TABLE IF NOT EXISTS comments (id INTEGER PRIMARY KEY, post_id INTEGER,
+    struct TEXT);
+CREATE INDEX IF NOT EXISTS comments_post ON comments (post_id);
+CREATE TABLE IF NOT EXISTS categories (id INTEGER PRIMARY KEY, struct TEXT);
+CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, struct TEXT);
+'''
+
+# structs are stored as JSON since format 2, format 1 pickled them
+_mirrorFormat = '2'
+
+class WordPressMirror(object): #{{{
+    """Local SQLite copy of the posts, comments, categories and tags of
+    the blog selected in client.
+
+    After the first sync only new and changed items are fetched: posts by
+    modification date with wp.getPosts, or by creation date with
+    metaWeblog.getRecentPosts (edits are then missed), comments by id.
+    Categories and tags are small and reloaded every time. Deleted posts
+    and comments are removed by sync(full=True) only.
+    """
+    pageSize = 100
+
+    def __init__(self, client, path, commentStatus=''):
+        self.client = client
+        self.path = path
+        self.commentStatus = commentStatus
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.executescript(_mirrorSchema)
+        if self._getState('format') != _mirrorFormat:
+            # items of an older format are not read, the next sync
+            # fetches everything again
+            with self._db:
+                for table in ('posts', 'comments', 'categories', 'tags'):
+                    self._db.execute('DELETE FROM %s' % table)
+                self._db.execute("DELETE FROM state WHERE key IN "
+                                 "('postMark', 'commentMark', 'synced')")
+            self._setState(format=_mirrorFormat)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.path)
+
+    def close(self): #{{{
+        self._db.close()
+    #}}}
+
+    def _getState(self, key, default=None): #{{{
+        row = self._db.execute('SELECT value FROM state WHERE key = ?',
+                               (key,)).fetchone()
+        if row is None:
+            return default
+        return row[0]
+    #}}}
+
+    def _setState(self, **values): #{{{
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                                 values.items())
+    #}}}
+
+    def _store(self, table, rows, seen): #{{{
+        """Insert or replace rows in one transaction
+        """
+        if not rows:
+            return
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO %s VALUES (%s)' % (
+                table, ', '.join('?' * len(rows[0]))), rows)
+            if seen:
+                self._db.executemany('INSERT OR IGNORE INTO seen VALUES (?)',
+                                     [row[:1] for row in rows])
+    #}}}
+
+    def _prune(self, table): #{{{
+        """Delete rows not stored during full sync
+        """
+        with self._db:
+            self._db.execute('DELETE FROM %s WHERE id NOT IN '
+                             '(SELECT id FROM seen)' % table)
+            self._db.execute('DELETE FROM seen')
+    #}}}
+
+    def sync(self, full=False): #{{{
+        """Fetch items new or changed since previous sync, everything when
+        full is True. Return {kind: count} of items stored.
+        """
+        client = self.client
+        blog = '%s#%s' % (client.url, client.blogId)
+        known = self._getState('blog')
+        if known is None:
+            self._setState(blog=blog)
+        elif known != blog:
+            raise WordPressException('Mirror %s belongs to %s' % (self.path,
+                                                                  known))
+        if full:
+            self._db.execute('CREATE TEMP TABLE IF NOT EXISTS seen '
+                             '(id INTEGER PRIMARY KEY)')
+        try:
+            counts = {
+                'posts'         : self._syncPosts(full),
+                'comments'      : self._syncComments(full),
+                'categories'    : self._syncTerms('categories',
+                    'wp.getCategories', client._filterCategory),
+                'tags'          : self._syncTerms('tags', 'wp.getTags',
+                                                  client._filterTag),
+            }
+        except xmlrpclib.Fault, fault:
+            raise WordPressException(fault)
+        self._setState(synced=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        return counts
+    #}}}
+
+    def _syncPosts(self, full): #{{{
+        client = self.client
+        mark = (not full and self._getState('postMark')) or ''
+        newMark = mark
+        count = 0
+        useWpPosts = client.supportsMethod('wp.getPosts')
+        offset = 0
+        while True:
+            if useWpPosts:
+                posts = client._call('wp.getPosts', client.blogId, client.user,
+                    client.password, {'post_type' : 'post',
+                    'post_status' : 'any', 'number' : self.pageSize,
+                    'offset' : offset, 'orderby' : 'modified',
+                    'order' : 'DESC'})
+                structs = map(client._wpPostStruct, posts)
+                page = posts
+            else:
+                # newest posts first, previous pages are fetched again
+                page = client._call('metaWeblog.getRecentPosts', client.blogId,
+                    client.user, client.password, offset + self.pageSize)
+                page = page[offset:]
+                structs = [client._filterPost(post).struct() for post in page]
+            rows = []
+            # stop after the first page reaching items older than mark
+            done = len(page) < self.pageSize
+            for struct in structs:
+                date = _dateKey(struct['dateCreated'])
+                modified = date
+                if useWpPosts and struct.get('date_modified'):
+                    modified = _dateKey(struct['date_modified'])
+                if modified < mark:
+                    done = True
+                    continue
+                newMark = max(newMark, modified)
+                rows.append((int(struct['postid']), date, modified,
+                             _dumpJson(struct)))
+            self._store('posts', rows, full)
+            count += len(rows)
+            if done:
+                break
+            offset += len(page)
+        if full:
+            self._prune('posts')
+        self._setState(postMark=newMark)
+        return count
+    #}}}
+
+    def _syncComments(self, full): #{{{
+        client = self.client
+        mark = int((not full and self._getState('commentMark')) or 0)
+        newMark = mark
+        count = 0
+        offset = 0
+        while True:
+            page = client._call('wp.getComments', client.blogId, client.user,
+                client.password, client._commentsFilter(self.commentStatus, 0,
+                self.pageSize, offset))
+            rows = []
+            done = len(page) < self.pageSize
+            for comment in map(client._filterComment, page):
+                if comment.id <= mark:
+                    done = True
+                    continue
+                newMark = max(newMark, comment.id)
+                rows.append((comment.id, int(comment.postId),
+                             _dumpJson(comment.struct())))
+            self._store('comments', rows, full)
+            count += len(rows)
+            if done:
+                break
+            offset += len(page)
+        if full:
+            self._prune('comments')
+        self._setState(commentMark=str(newMark))
+        return count
+    #}}}
+
+    def _syncTerms(self, table, methodName, filter): #{{{
+        client = self.client
+        terms = client._call(methodName, client.blogId, client.user,
+                             client.password)
+        rows = [(term.id, _dumpJson(term.struct()))
+                for term in map(filter, terms)]
+        with self._db:
+            self._db.execute('DELETE FROM %s' % table)
+            self._db.executemany('INSERT OR REPLACE INTO %s VALUES (?, ?)' %
+                                 table, rows)
+        return len(rows)
+    #}}}
+
+    def lastSync(self): #{{{
+        """Get time of last sync as 'YYYY-MM-DDTHH:MM:SS', None before
+        first sync
+        """
+        return self._getState('synced')
+    #}}}
+
+    def getPost(self, postId): #{{{
+        """Get mirrored WordPressPost, None if unknown
+        """
+        row = self._db.execute('SELECT struct FROM posts WHERE id = ?',
+                               (int(postId),)).fetchone()
+        if row is not None:
+            return WordPressPost.fromStruct(_loadJson(row[0]))
+    #}}}
+
+    def iterPosts(self): #{{{
+        """Iterate over mirrored posts, newest first
+        """
+        for row in self._db.execute('SELECT struct FROM posts '
+                                    'ORDER BY date DESC, id DESC'):
+            yield WordPressPost.fromStruct(_loadJson(row[0]))
+    #}}}
+
+    def getComments(self, postId=None): #{{{
+        """Iterate over mirrored comments of post or of all posts, newest
+        first
+        """
+        if postId is None:
+            rows = self._db.execute('SELECT struct FROM comments '
+                                    'ORDER BY id DESC')
+        else:
+            rows = self._db.execute('SELECT struct FROM comments WHERE '
+                'post_id = ? ORDER BY id DESC', (int(postId),))
+        for row in rows:
+            yield WordPressComment.fromStruct(_loadJson(row[0]))
+    #}}}
+
+    def getCategoryStore(self): #{{{
+        """Get WordPressCategoryStore with mirrored categories
+        """
+        rows = self._db.execute('SELECT struct FROM categories ORDER BY id')
+        return WordPressCategoryStore([WordPressCategory.fromStruct(
+            _loadJson(row[0])) for row in rows])
+    #}}}
+
+    def getTags(self): #{{{
+        """Get mirrored tags
+        """
+        rows = self._db.execute('SELECT struct FROM tags ORDER BY id')
+        return [WordPressTag.fromStruct(_loadJson(row[0]))
+                for row in rows]
+    #}}}
+#}}}
+
+_mediaSchema = '''
+CREATE TABLE IF NOT EXISTS media (site TEXT, blog_id TEXT, hash TEXT,
+    url TEXT, name TEXT, size INTEGER, added REAL,
+    PRIMARY KEY (site, blog_id, hash));
+CREATE INDEX IF NOT EXISTS media_url ON media (url);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER,
+    mtime REAL, hash TEXT);
+'''
+
+class WordPressMediaIndex(object): #{{{
+    """Persistent index of uploaded media by content hash, stored in a
+    SQLite file. WordPressClient created with mediaIndex looks uploads up
+    here and returns the URL of identical media already uploaded to the
+    blog without sending it again.
+
+    Hashes of files given by name are remembered by (path, size, mtime),
+    so an unchanged file is not read again. Entries of media deleted on
+    the server are removed with evict() or verify().
+    """
+    hashName = 'sha256'
+    chunkSize = 1 << 20
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.executescript(_mediaSchema)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.path)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM media').fetchone()[0]
+
+    def close(self): #{{{
+        with self._lock:
+            self._db.close()
+    #}}}
+
+    def _hashStream(self, f): #{{{
+        """Hash rest of file f, reading into one reused buffer
+        """
+        digest = hashlib.new(self.hashName)
+        buf = bytearray(self.chunkSize)
+        view = memoryview(buf)
+        size = 0
+        readinto = getattr(f, 'readinto', None)
+        while True:
+            if readinto is not None:
+                count = readinto(buf)
+                chunk = view[:count]
+            else:
+                chunk = f.read(self.chunkSize)
+                count = len(chunk)
+            if not count:
+                break
+            digest.update(chunk)
+            size += count
+        return digest.hexdigest(), size
+    #}}}
+
+    def hashFile(self, mediaFile): #{{{
+        """Get (hash, size) of file name or file-like object, None when
+        the object can not be read again after hashing. File-like object
+        is hashed from its current position and rewound.
+        """
+        if not isinstance(mediaFile, basestring):
+            try:
+                start = mediaFile.tell()
+                result = self._hashStream(mediaFile)
+                mediaFile.seek(start)
+            except (AttributeError, IOError, OSError, ValueError):
+                return None
+            return result
+        path = os.path.abspath(mediaFile)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._db.execute('SELECT hash FROM files WHERE path = ? AND '
+                'size = ? AND mtime = ?', (path, stat.st_size,
+                stat.st_mtime)).fetchone()
+        if row is not None:
+            return str(row[0]), stat.st_size
+        f = file(path, 'rb')
+        try:
+            result = self._hashStream(f)
+        finally:
+            f.close()
+        with self._lock:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO files VALUES '
+                    '(?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime,
+                    result[0]))
+        return result
+    #}}}
+
+    def get(self, site, blogId, digest): #{{{
+        """Get URL of media with hash uploaded to blog, None when unknown
+        """
+        with self._lock:
+            row = self._db.execute('SELECT url FROM media WHERE site = ? AND '
+                'blog_id = ? AND hash = ?', (site, str(blogId),
+                digest)).fetchone()
+        return row and row[0]
+    #}}}
+
+    def add(self, site, blogId, digest, url, name=None, size=None): #{{{
+        """Remember URL of media uploaded to blog
+        """
+        with self._lock:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO media VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?)', (site, str(blogId), digest, url,
+                    name, size, time.time()))
+    #}}}
+
+    def entries(self, site=None, blogId=None): #{{{
+        """Get list of (site, blogId, hash, url) tuples, optionally of one
+        site or blog only
+        """
+        query = 'SELECT site, blog_id, hash, url FROM media'
+        where, params = [], []
+        if site is not None:
+            where.append('site = ?')
+            params.append(site)
+        if blogId is not None:
+            where.append('blog_id = ?')
+            params.append(str(blogId))
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+    #}}}
+
+    def evict(self, url=None, site=None, blogId=None): #{{{
+        """Remove entries of media URL, or all entries of site or blog.
+        Return number of entries removed.
+        """
+        if url is not None:
+            query, params = 'DELETE FROM media WHERE url = ?', [url]
+        elif site is not None:
+            query, params = 'DELETE FROM media WHERE site = ?', [site]
+            if blogId is not None:
+                query += ' AND blog_id = ?'
+                params.append(str(blogId))
+        else:
+            query, params = 'DELETE FROM media', []
+        with self._lock:
+            with self._db:
+                return self._db.execute(query, params).rowcount
+    #}}}
+
+    def verify(self, site=None, blogId=None, timeout=10.0): #{{{
+        """Check media URLs with HEAD requests and evict those the server
+        answers with 404 or 410. Return list of evicted URLs, URLs that
+        could not be checked are kept.
+        """
+        evicted = []
+        for url in set(entry[3] for entry in self.entries(site, blogId)):
+            scheme, rest = urllib.splittype(url)
+            host, path = urllib.splithost(rest or '')
+            if scheme not in ('http', 'https') or not host:
+                continue
+            pool = getConnectionPool(scheme, host, timeout=timeout)
+            try:
+                connection, reused = pool.acquire()
+            except (socket.error, httplib.HTTPException):
+                continue
+            reusable = False
+            try:
+                connection.request('HEAD', path or '/')
+                response = connection.getresponse()
+                response.read()
+                reusable = not response.will_close
+                status = response.status
+            except (socket.error, httplib.HTTPException):
+                continue
+            finally:
+                pool.release(connection, reusable)
+            if status in (404, 410):
+                self.evict(url)
+                evicted.append(url)
+        return evicted
+    #}}}
+#}}}
+
+_snapshotSchema = '''
+CREATE TABLE IF NOT EXISTS snapshots (url TEXT, user TEXT, blog_id TEXT,
+    version INTEGER, saved REAL, data TEXT,
+    PRIMARY KEY (url, user, blog_id));
+'''
+
+class WordPressSnapshot(object): #{{{
+    """Slow changing blog metadata stored in a SQLite file: the user's
+    blogs, categories, tags and supported methods, per URL, user and blog
+    id. WordPressClient created with snapshot starts from it without any
+    call, a snapshot missing or older than maxAge seconds is refreshed in
+    the background. Data is stored as JSON, snapshots of another format
+    version are ignored and those of older ones deleted.
+    """
+    # 2 stores JSON, 1 pickled the data
+    version = 2
+
+    def __init__(self, path, maxAge=3600):
+        self.path = path
+        self.maxAge = maxAge
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.executescript(_snapshotSchema)
+        with self._db:
+            self._db.execute('DELETE FROM snapshots WHERE version < ?',
+                             (self.version,))
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.path)
+
+    def close(self): #{{{
+        with self._lock:
+            self._db.close()
+    #}}}
+
+    def load(self, url, user, blogId): #{{{
+        """Get (data, saved time) of blog, None when there is no snapshot.
+        data is dict with 'blogs', 'categories' and 'tags' struct lists and
+        'methods' list.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT data, saved FROM snapshots WHERE '
+                'url = ? AND user = ? AND blog_id = ? AND version = ?',
+                (url, user, str(blogId), self.version)).fetchone()
+        if row is not None:
+            return _loadJson(row[0]), row[1]
+    #}}}
+
+    def save(self, url, user, blogId, data): #{{{
+        """Store data of blog, replacing its previous snapshot
+        """
+        data = _dumpJson(data)
+        with self._lock:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO snapshots VALUES '
+                    '(?, ?, ?, ?, ?, ?)', (url, user, str(blogId),
+                    self.version, time.time(), data))
+    #}}}
+
+    def delete(self, url, user=None, blogId=None): #{{{
+        """Remove snapshots of url, only those of user and blogId when
+        given
+        """
+        query = 'DELETE FROM snapshots WHERE url = ?'
+        params = [url]
+        if user is not None:
+            query += ' AND user = ?'
+            params.append(user)
+        if blogId is not None:
+            query += ' AND blog_id = ?'
+            params.append(str(blogId))
+        with self._lock:
+            with self._db:
+                self._db.execute(query, params)
+    #}}}
+#}}}
+
+class WordPressFleet(object): #{{{
+    """Clients for many WordPress sites. Clients share one transport per
+    scheme, so all sites on a host use the same connection pool. map()
+    fans a call out to every site running at most maxConcurrency calls in
+    total and at most maxPerHost calls per host, hosts take turns. The
+    host limit holds for all map() calls of the fleet running at once,
+    whatever the size of the connection pool of the host.
+
+    Failures are retried up to retries times with backoff seconds doubled
+    between attempts: any transient failure of the methods in
+    retriedMethods (defaultRetriedMethods, the read methods, unless
+    given), only failures before the request was sent for other methods.
+    Add a method name or a function passed to map() to retriedMethods to
+    retry it too.
+
+    Other keyword arguments are passed to every WordPressClient.
+    """
+    defaultRetriedMethods = frozenset([
+        'getPost', 'getRecentPosts', 'getLastPost', 'iterPosts',
+        'getUserInfo', 'getUsersBlogs', 'getPostCategories',
+        'getCategoryStore', 'getCategoryList', 'getTrackbackPings',
+        'getPingbacks', 'getTags', 'suggestCategories', 'getComment',
+        'getComments', 'getCommentIndex', 'supportedMethods',
+    ])
+
+    def __init__(self, targets=(), maxConcurrency=32, maxPerHost=4,
+                 retries=2, backoff=0.5, idleTimeout=60.0, keepAlive=True,
+                 compress=True, failureThreshold=None, retriedMethods=None,
+                 **clientOptions): #{{{
+        self.maxConcurrency = maxConcurrency
+        self.maxPerHost = maxPerHost
+        if retriedMethods is None:
+            retriedMethods = self.defaultRetriedMethods
+        self.retriedMethods = set(retriedMethods)
+        self.retries = retries
+        self.backoff = backoff
+        self.idleTimeout = idleTimeout
+        self.keepAlive = keepAlive
+        self.compress = compress
+        self.failureThreshold = failureThreshold
+        self.clientOptions = clientOptions
+        self._clients = collections.OrderedDict()
+        self._transports = {}
+        self._lock = threading.Lock()
+        # calls running per host in all map() calls
+        self._hostCalls = collections.defaultdict(int)
+        self._hostFree = threading.Condition()
+        for target in targets:
+            self.add(*target)
+    #}}}
+
+    def __repr__(self):
+        return '<%s %d sites>' % (self.__class__.__name__, len(self))
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(self._clients.values())
+
+    def _transport(self, scheme): #{{{
+        transport = self._transports.get(scheme)
+        if transport is None:
+            transport = WordPressTransport(scheme, self.maxPerHost,
+                self.idleTimeout, self.keepAlive, compress=self.compress,
+                failureThreshold=self.failureThreshold)
+            self._transports[scheme] = transport
+        return transport
+    #}}}
+
+    def add(self, url, user, password, blogId=0): #{{{
+        """Add site, return its client. A site added again gets a new
+        client with the given password.
+        """
+        with self._lock:
+            client = WordPressClient(url, user, password,
+                self._transport(urllib.splittype(url)[0]),
+                **self.clientOptions)
+            client.selectBlog(blogId)
+            self._clients[(url, user, blogId)] = client
+        return client
+    #}}}
+
+    def get(self, url, user, blogId=0): #{{{
+        """Get client of site, None when it is not in fleet
+        """
+        return self._clients.get((url, user, blogId))
+    #}}}
+
+    def remove(self, url, user, blogId=0): #{{{
+        """Remove site from fleet
+        """
+        with self._lock:
+            self._clients.pop((url, user, blogId), None)
+    #}}}
+
+    def map(self, methodName, *args, **kwargs): #{{{
+        """Call client method methodName with args on every site, yield
+        (client, result) tuples as the calls complete. result is the
+        exception raised for a site whose call failed, iterators returned
+        by the method are read into lists. methodName may be a function
+        called as methodName(client, *args, **kwargs) instead.
+        """
+        if callable(methodName):
+            function = methodName
+        else:
+            def function(client, *args, **kwargs):
+                return getattr(client, methodName)(*args, **kwargs)
+        def task(client):
+            result = function(client, *args, **kwargs)
+            if isinstance(result, collections.Iterator):
+                result = list(result)
+            return result
+        return self._run(task, list(self), methodName in self.retriedMethods)
+    #}}}
+
+    def _attempt(self, task, client, idempotent): #{{{
+        """Run task(client), retrying transient failures when idempotent,
+        else only failures before the request was sent. Return result or
+        exception.
+        """
+        attempt = 0
+        while True:
+            try:
+                return task(client)
+            except Exception, error:
+                if attempt < self.retries and (_isUnsent(error) or
+                        idempotent and _isTransient(error)):
+                    time.sleep(self.backoff * 2 ** attempt *
+                               random.uniform(0.5, 1.5))
+                    attempt += 1
+                    continue
+                if isinstance(error, xmlrpclib.Fault):
+                    error = WordPressException(error)
+                return error
+    #}}}
+
+    def _claim(self, host): #{{{
+        """Wait until less than maxPerHost calls to host are running in
+        the fleet, count one more
+        """
+        with self._hostFree:
+            while self._hostCalls[host] >= self.maxPerHost:
+                self._hostFree.wait()
+            self._hostCalls[host] += 1
+    #}}}
+
+    def _release(self, host): #{{{
+        with self._hostFree:
+            self._hostCalls[host] -= 1
+            self._hostFree.notify_all()
+    #}}}
+
+    def _run(self, task, clients, idempotent): #{{{
+        """Run task(client) for clients on worker threads within the
+        concurrency limits, yield (client, result) tuples as tasks complete
+        """
+        tasks = Queue.Queue()
+        results = Queue.Queue()
+        def worker():
+            while True:
+                client = tasks.get()
+                if client is None:
+                    return
+                # other map() calls may run tasks on the host too
+                self._claim(client._host)
+                try:
+                    result = self._attempt(task, client, idempotent)
+                finally:
+                    self._release(client._host)
+                results.put((client, result))
+        workers = min(self.maxConcurrency, len(clients))
+        for i in range(workers):
+            thread = threading.Thread(target=worker, name='yawpl-fleet')
+            thread.daemon = True
+            thread.start()
+
+        # clients waiting per host, hosts below maxPerHost with waiting
+        # clients are in ready in round-robin order
+        waiting = collections.defaultdict(collections.deque)
+        for client in clients:
+            waiting[client._host].append(client)
+        ready = collections.deque(waiting)
+        active = dict.fromkeys(waiting, 0)
+        running = 0
+        try:
+            while True:
+                while ready and running < workers:
+                    host = ready.popleft()
+                    tasks.put(waiting[host].popleft())
+                    active[host] += 1
+                    running += 1
+                    if waiting[host] and active[host] < self.maxPerHost:
+                        ready.append(host)
+                if not running:
+                    return
+                client, result = results.get()
+                host = client._host
+                running -= 1
+                active[host] -= 1
+                if waiting[host] and active[host] == self.maxPerHost - 1:
+                    ready.append(host)
+                yield client, result
+        finally:
+            for i in range(workers):
+                tasks.put(None)
+    #}}}
+
+    def close(self): #{{{
+        """Close idle connections to the hosts of the fleet
+        """
+        for client in self:
+            transport = self._transports[urllib.splittype(client.url)[0]]
+            transport.getPool(transport.get_host_info(client._host)[0]).close()
+    #}}}
+#}}}
+
+class WordPressFuture(object): #{{{
+    """Result of AsyncWordPressClient call, available once the event loop
+    has completed the request
+    """
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self): #{{{
+        """Get call result, raise call exception
+        """
+        if not self._done:
+            raise WordPressException('Call not finished')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+    #}}}
+
+    def exception(self):
+        return self._exception
+
+    def addCallback(self, callback): #{{{
+        """Call callback(future) when future is done
+        """
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+    #}}}
+
+    def setResult(self, result): #{{{
+        self._result = result
+        self._finish()
+    #}}}
+
+    def setException(self, exception): #{{{
+        self._exception = exception
+        self._finish()
+    #}}}
+
+    def _finish(self): #{{{
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+    #}}}
+
+    def then(self, func): #{{{
+        """Get future of func(result), func may return another future
+        """
+        future = WordPressFuture()
+        def done(f):
+            if f._exception is not None:
+                future.setException(f._exception)
+                return
+            try:
+                value = func(f._result)
+            except Exception, e:
+                future.setException(e)
+                return
+            if isinstance(value, WordPressFuture):
+                value.addCallback(lambda v: future._copy(v))
+            else:
+                future.setResult(value)
+        self.addCallback(done)
+        return future
+    #}}}
+
+    def _copy(self, other): #{{{
+        if other._exception is not None:
+            self.setException(other._exception)
+        else:
+            self.setResult(other._result)
+    #}}}
+
+    @classmethod
+    def completed(cls, result): #{{{
+        """Get future already done with result
+        """
+        future = cls()
+        future.setResult(result)
+        return future
+    #}}}
+#}}}
+
+# (id(map), scheme, host) -> _AsyncHost shared by the async clients of host
+_asyncHosts = weakref.WeakValueDictionary()
+
+def _asyncHost(map, scheme, host): #{{{
+    """Get _AsyncHost of the async clients of host on event loop map
+    """
+    key = (id(map), scheme, host)
+    with _connectionPoolsLock:
+        hostRequests = _asyncHosts.get(key)
+        if hostRequests is None or hostRequests.map is not map:
+            hostRequests = _AsyncHost(map, scheme, host)
+            _asyncHosts[key] = hostRequests
+        return hostRequests
+#}}}
+
+def _chunked(chunks): #{{{
+    """Encode chunks with HTTP/1.1 chunked transfer coding
+    """
+    for chunk in chunks:
+        if chunk:
+            yield '%x\r\n%s\r\n' % (len(chunk), chunk)
+    yield '0\r\n\r\n'
+#}}}
+
+class _AsyncCall(object): #{{{
+    """Request queued by an async client, timeout is the seconds it may
+    take once sent
+    """
+    __slots__ = ('handler', 'body', 'contentLength', 'future', 'timeout')
+
+    def __init__(self, handler, body, contentLength, future, timeout=None):
+        self.handler = handler
+        self.body = body
+        self.contentLength = contentLength
+        self.future = future
+        self.timeout = timeout
+#}}}
+
+class _AsyncHost(object): #{{{
+    """Requests and keep-alive connections of the async clients of a host
+    on one event loop. A request is sent when less requests than the limit
+    of its client are in flight, the others are queued.
+    """
+    def __init__(self, map, scheme, host):
+        self.map = map
+        self.scheme = scheme
+        self.host = host
+        name, port = urllib.splitport(host)
+        if port is None:
+            port = scheme == 'https' and 443 or 80
+        self.name = name.strip('[]')
+        self.port = int(port)
+        self._addresses = None
+        self.active = 0
+        self.queue = collections.deque()
+        self.idle = []
+
+    def addresses(self): #{{{
+        """Get (family, address) list of host, resolved once as the
+        lookup blocks the event loop
+        """
+        if self._addresses is None:
+            self._addresses = [(family, address) for family, type, proto,
+                               name, address in socket.getaddrinfo(self.name,
+                               self.port, 0, socket.SOCK_STREAM)]
+        return self._addresses
+    #}}}
+
+    def submit(self, request, limit): #{{{
+        """Queue request, send it if limit allows
+        """
+        self.queue.append((request, limit))
+        self._start()
+    #}}}
+
+    def _start(self): #{{{
+        while self.queue and self.active < self.queue[0][1]:
+            request = self.queue.popleft()[0]
+            self.active += 1
+            self._send(request)
+    #}}}
+
+    def _send(self, request, fresh=False): #{{{
+        """Send request on an idle connection or a new one when fresh
+        """
+        try:
+            chunks = iter(request.body())
+            if request.contentLength is None:
+                chunks = _chunked(chunks)
+            if self.idle and not fresh:
+                connection = self.idle.pop()
+                reused = True
+            else:
+                connection = _AsyncConnection(self)
+                reused = False
+        except Exception, e:
+            self.active -= 1
+            request.future.setException(e)
+            return
+        connection.start(request, chunks, reused)
+    #}}}
+
+    def finished(self, connection, reusable): #{{{
+        """Count request on connection done, keep connection if reusable
+        """
+        self.active -= 1
+        if reusable:
+            self.idle.append(connection)
+        self._start()
+    #}}}
+
+    def retry(self, request): #{{{
+        """Resend request of a reused connection closed before response
+        """
+        self._send(request, True)
+        self._start()
+    #}}}
+
+    def discard(self, connection): #{{{
+        if connection in self.idle:
+            self.idle.remove(connection)
+    #}}}
+
+    def abort(self, error): #{{{
+        """Fail queued requests and those in flight with error
+        """
+        queue, self.queue = self.queue, collections.deque()
+        for request, limit in queue:
+            request.future.setException(error)
+        for channel in self.map.values():
+            if (isinstance(channel, _AsyncConnection) and
+                    channel._hostRequests is self and channel.busy):
+                channel.abort(error)
+    #}}}
+
+    def close(self): #{{{
+        """Close idle connections
+        """
+        idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+    #}}}
+#}}}
+
+class _AsyncConnection(asyncore.dispatcher): #{{{
+    """Non-blocking HTTP/1.1 keep-alive connection sending XML-RPC requests
+    one after another, each response is parsed while it arrives
+    """
+    def __init__(self, hostRequests):
+        asyncore.dispatcher.__init__(self, map=hostRequests.map)
+        self._hostRequests = hostRequests
+        self._request = None
+        self._deadline = None
+        self._out = ''
+        self._chunks = None
+        self._handshaking = False
+        self._addresses = list(hostRequests.addresses())
+        self._connect()
+
+    def _connect(self): #{{{
+        """Connect to the next address of the host
+        """
+        while True:
+            family, address = self._addresses.pop(0)
+            try:
+                self.create_socket(family, socket.SOCK_STREAM)
+                self.connect(address)
+                return
+            except socket.error:
+                asyncore.dispatcher.close(self)
+                if not self._addresses:
+                    raise
+    #}}}
+
+    @property
+    def busy(self):
+        return self._request is not None
+
+    def expire(self, now): #{{{
+        """Fail request with socket.timeout if its deadline has passed,
+        else return seconds left or None without deadline
+        """
+        if self._request is None or self._deadline is None:
+            return None
+        if now < self._deadline:
+            return self._deadline - now
+        self.abort(socket.timeout('timed out'))
+    #}}}
+
+    def abort(self, error): #{{{
+        """Close connection, fail its request with error
+        """
+        self.close()
+        if self._request is not None:
+            self._fail(error)
+    #}}}
+
+    def start(self, request, chunks, reused): #{{{
+        """Send request, its body chunks are sent as the socket is writable
+        """
+        hostRequests = self._hostRequests
+        self._request = request
+        if request.timeout is not None:
+            self._deadline = time.time() + request.timeout
+        else:
+            self._deadline = None
+        self._reused = reused
+        self._received = False
+        self._out = ('POST %s HTTP/1.1\r\n'
+                     'Host: %s\r\n'
+                     'User-Agent: %s\r\n'
+                     'Accept-Encoding: gzip\r\n'
+                     'Content-Type: text/xml\r\n' % (request.handler,
+                     hostRequests.host, xmlrpclib.Transport.user_agent))
+        if request.contentLength is None:
+            self._out += 'Transfer-Encoding: chunked\r\n\r\n'
+        else:
+            self._out += 'Content-Length: %d\r\n\r\n' % request.contentLength
+        self._chunks = chunks
+        self._header = ''
+        self._status = None
+        self._keepAlive = False
+        self._remaining = None
+        self._state = 'size'
+        self._buffer = ''
+        self._parser, self._closeParser = _responseParser()
+        self._decompressor = None
+    #}}}
+
+    def handle_connect(self): #{{{
+        if self._hostRequests.scheme == 'https':
+            self.socket = ssl.create_default_context().wrap_socket(self.socket,
+                server_hostname=self._hostRequests.name,
+                do_handshake_on_connect=False)
+            self._handshaking = True
+            self._handshake()
+    #}}}
 
-    def __repr__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
-#}}}
-        
-class WordPressCategory(object): #{{{
-    """Represents category item
-    """ 
-    def __init__(self):
-        self.id = 0
-        self.parentId = 0
-        self.name = ''
-        self.slug = ''
-        self.description = ''
-        self.rssUrl = ''
-        self.htmlUrl = ''
-        self.isPrimary = False
-    
-    def __str__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+    def _handshake(self): #{{{
+        try:
+            self.socket.do_handshake()
+            self._handshaking = False
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            pass
+    #}}}
 
-    def __repr__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
-#}}}
+    def writable(self):
+        return (not self.connected or self._handshaking or bool(self._out) or
+                self._chunks is not None)
 
-class WordPressComment(object): #{{{
-    """Represents comment item
-    """ 
-    def __init__(self):
-        self.id           = 0
-        self.userId       = ''
-        self.parent       = ''
-        self.status       = ''
-        self.content      = ''
-        self.link         = ''
-        self.postId       = 0
-        self.postTitle    = ''
-        self.author       = ''
-        self.authorUrl    = ''
-        self.authorEmail  = ''
-        self.authorIp     = ''
+    def handle_write(self): #{{{
+        if self._handshaking:
+            self._handshake()
+            return
+        while self._chunks is not None and len(self._out) < 65536:
+            try:
+                self._out += self._chunks.next()
+            except StopIteration:
+                self._chunks = None
+        if self._out:
+            sent = self.send(self._out[:65536])
+            self._out = self._out[sent:]
+    #}}}
 
-    def __str__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.content)
+    def handle_read(self): #{{{
+        if self._handshaking:
+            self._handshake()
+            return
+        try:
+            data = self.recv(65536)
+        except ssl.SSLWantReadError:
+            return
+        if not data:
+            return
+        if self._request is None:
+            # nothing is expected on an idle connection
+            self.close()
+            self._hostRequests.discard(self)
+            return
+        self._received = True
+        self._feed(data)
+    #}}}
 
-    def __repr__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.content)
-#}}}
+    def _feed(self, data): #{{{
+        if self._status is None:
+            self._header += data
+            end = self._header.find('\r\n\r\n')
+            if end < 0:
+                return
+            data = self._header[end + 4:]
+            lines = self._header[:end].split('\r\n')
+            status = lines[0].split(None, 2)
+            if status[1].startswith('1'):
+                # interim response, the final one follows
+                self._header = ''
+                if data:
+                    self._feed(data)
+                return
+            self._header = self._header[:end]
+            self._status = status[1:]
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip().lower()
+            connection = headers.get('connection', '')
+            self._keepAlive = (connection == 'keep-alive' or
+                               status[0] == 'HTTP/1.1' and connection != 'close')
+            if headers.get('content-encoding') == 'gzip':
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if headers.get('transfer-encoding') == 'chunked':
+                self._remaining = None
+            elif 'content-length' in headers:
+                self._remaining = int(headers['content-length'])
+            else:
+                # read until the server closes the connection
+                self._remaining = -1
+                self._keepAlive = False
+            if self._remaining == 0:
+                self._complete()
+                return
+        if self._remaining is None:
+            self._dechunk(data)
+        elif self._remaining < 0:
+            self._body(data)
+        else:
+            if len(data) > self._remaining:
+                data = data[:self._remaining]
+                self._keepAlive = False
+            self._remaining -= len(data)
+            self._body(data)
+            if not self._remaining:
+                self._complete()
+    #}}}
 
-class WordPressPost(object): #{{{
-    """Represents post item
-    """ 
-    def __init__(self):
-        self.id = 0
-        self.title = ''
-        self.date = None
-        self.permaLink = ''
-        self.description = ''
-        self.textMore = ''
-        self.excerpt = ''
-        self.link = ''
-        self.categories = []
-        self.user = ''
-        self.allowPings = False
-        self.allowComments = False
-        self.keywords = ''
+    def _dechunk(self, data): #{{{
+        """Feed body of chunked response
+        """
+        self._buffer += data
+        while self._request is not None:
+            if self._state == 'data':
+                piece = self._buffer[:self._remainingChunk]
+                self._buffer = self._buffer[len(piece):]
+                self._remainingChunk -= len(piece)
+                if piece:
+                    self._body(piece)
+                if self._remainingChunk:
+                    return
+                self._state = 'end'
+            end = self._buffer.find('\r\n')
+            if end < 0:
+                return
+            line, self._buffer = self._buffer[:end], self._buffer[end + 2:]
+            if self._state == 'end':
+                self._state = 'size'
+            elif self._state == 'size':
+                self._remainingChunk = int(line.split(';', 1)[0], 16)
+                self._state = self._remainingChunk and 'data' or 'trailer'
+            elif not line:
+                self._complete()
+    #}}}
 
-    def __str__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.title)
+    def _body(self, data): #{{{
+        if self._status[0] == '200':
+            if self._decompressor is not None:
+                data = self._decompressor.decompress(data)
+            self._parser.Parse(data, False)
+    #}}}
 
-    def __repr__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.title)
-#}}}
+    def _complete(self): #{{{
+        """Finish request with the received response
+        """
+        request, self._request = self._request, None
+        # the server may not have read the body of a failed request
+        reusable = (self._keepAlive and self._status[0] == '200' and
+                    not self._out and self._chunks is None)
+        if not reusable:
+            self.close()
+        error = result = None
+        if self._status[0] != '200':
+            error = xmlrpclib.ProtocolError(self._hostRequests.host +
+                request.handler, int(self._status[0]),
+                ' '.join(self._status[1:]), self._header)
+        else:
+            try:
+                if self._decompressor is not None:
+                    self._parser.Parse(self._decompressor.flush(), False)
+                result = self._closeParser()
+            except xmlrpclib.Fault, fault:
+                error = WordPressException(fault)
+            except Exception, e:
+                error = e
+        self._hostRequests.finished(self, reusable)
+        if error is not None:
+            request.future.setException(error)
+        else:
+            request.future.setResult(result[0])
+    #}}}
 
-class WordPressTag(object): #{{{
-    """Represents tag item
-    """ 
-    def __init__(self):
-        self.id = 0
-        self.name = ''
-        self.rssUrl = ''
-        self.htmlUrl = ''
-        self.slug = ''
-        self.count = 0
-        
+    def handle_close(self): #{{{
+        if self._connectFailed():
+            return
+        if self._request is None:
+            self._hostRequests.discard(self)
+        elif self._status is not None and self._remaining == -1:
+            self._complete()
+        elif self._reused and not self._received:
+            # keep-alive connection closed by server meanwhile
+            request, self._request = self._request, None
+            self._hostRequests.retry(request)
+        else:
+            self._fail(WordPressException('Connection closed by server'))
+    #}}}
 
-    def __str__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+    def _connectFailed(self): #{{{
+        """Connect to the next address of the host after connecting
+        failed, return True if connecting again
+        """
+        connecting = self.connecting
+        self.close()
+        if not connecting or not self._addresses:
+            return False
+        try:
+            self._connect()
+        except socket.error:
+            return False
+        return True
+    #}}}
 
-    def __repr__(self):
-        return '<%s %d: \'%s\'>' % (self.__class__.__name__, self.id, self.name)
+    def handle_error(self): #{{{
+        error = sys.exc_info()[1]
+        if isinstance(error, socket.error) and self._connectFailed():
+            return
+        self.close()
+        if self._request is None:
+            self._hostRequests.discard(self)
+        elif (self._reused and not self._received and
+              isinstance(error, socket.error)):
+            request, self._request = self._request, None
+            self._hostRequests.retry(request)
+        else:
+            self._fail(error)
+    #}}}
+
+    def _fail(self, exception): #{{{
+        request, self._request = self._request, None
+        self._chunks = None
+        self._hostRequests.finished(self, False)
+        request.future.setException(exception)
+    #}}}
 #}}}
 
-class WordPressClient(object): #{{{
-    """Client for connect to WordPress XML-RPC interface
+class AsyncWordPressClient(_WordPressClientBase): #{{{
+    """Non-blocking client for WordPress XML-RPC interface built on asyncore.
+    Methods return WordPressFuture instances, requests are sent while
+    run() or wait() drive the event loop over HTTP/1.1 keep-alive
+    connections.
+
+    Several clients can share one event loop passing the same map. They
+    share the connections to a host too, and at most maxPerHost requests
+    to the host are in flight for all of them, the others are queued.
+    A request not answered timeout seconds after it was sent fails with
+    socket.timeout.
     """
-    
-    def __init__(self, url, user, password): #{{{
+
+    def __init__(self, url, user, password, maxPerHost=8, map=None,
+                 timeout=None): #{{{
         self.url = url
         self.user = user
         self.password = password
         self.blogId = 0
+        self._resetTemplates()
         self.categories = None
-        self._server = xmlrpclib.ServerProxy(self.url)
+        self.methods = None
+        self.maxPerHost = maxPerHost
+        self.timeout = timeout
+        if map is None:
+            map = {}
+        self.map = map
+        self._scheme, rest = urllib.splittype(url)
+        self._host, self._handler = urllib.splithost(rest)
+        if not self._handler:
+            self._handler = '/RPC2'
+        self._hostRequests = _asyncHost(map, self._scheme, self._host)
     #}}}
 
-    def _filterTag(self, tag): #{{{
-        """Transform tag struct in WordPressTag instance 
+    def _call(self, methodName, *params): #{{{
+        """Queue XML-RPC call, return WordPressFuture of its result
         """
-        tagObj = WordPressTag()
-        tagObj.id           = int(tag['tag_id'])
-        tagObj.name         = tag['name']
-        tagObj.rssUrl       = tag['rss_url']
-        tagObj.slug         = tag['slug']
-        tagObj.htmlUrl      = tag['html_url']
-        tagObj.count        = int(tag['count'])
-        return tagObj
+        body = self._dumps(methodName, params)
+        return self._request(lambda: (body,), len(body))
     #}}}
- 
-    def _filterPost(self, post): #{{{
-        """Transform post struct in WordPressPost instance 
+
+    def _request(self, body, contentLength): #{{{
+        """Queue request with the chunks yielded by body(), return
+        WordPressFuture of its result. Without contentLength the body is
+        sent with chunked transfer encoding.
         """
-        postObj = WordPressPost()
-        postObj.permaLink       = post['permaLink']
-        postObj.description     = post['description']
-        postObj.title           = post['title']
-        postObj.excerpt         = post['mt_excerpt']
-        postObj.user            = post['userid']
-        postObj.date            = time.strptime(str(post['dateCreated']), "%Y%m%dT%H:%M:%S")
-        postObj.link            = post['link']
-        postObj.textMore        = post['mt_text_more']
-        postObj.allowComments   = post['mt_allow_comments'] == 1
-        postObj.id              = int(post['postid'])
-        postObj.categories      = post['categories']
-        postObj.allowPings      = post['mt_allow_pings'] == 1
-        return postObj
+        future = WordPressFuture()
+        self._hostRequests.submit(_AsyncCall(self._handler, body,
+                                             contentLength, future,
+                                             self.timeout),
+                                  self.maxPerHost)
+        return future
     #}}}
 
-    def _filterComment(self, comment): #{{{
-        """Transform comment struct in WordPressComment instance
+    def _busy(self): #{{{
+        """Check if a request on map is not done, idle keep-alive
+        connections do not count
         """
-        commentObj = WordPressComment()
-        commentObj.id           = int(comment['comment_id'])
-        commentObj.userId       = comment['user_id'] 
-        commentObj.parent       = comment['parent'] 
-        commentObj.status       = comment['status'] 
-        commentObj.content      = comment['content'] 
-        commentObj.link         = comment['link'] 
-        commentObj.postId       = comment['post_id'] 
-        commentObj.postTitle    = comment['post_title'] 
-        commentObj.author       = comment['author'] 
-        commentObj.authorUrl    = comment['author_url'] 
-        commentObj.authorEmail  = comment['author_email'] 
-        commentObj.authorIp     = comment['author_ip'] 
+        for channel in self.map.values():
+            if getattr(channel, 'busy', True):
+                return True
+        return False
+    #}}}
 
-        return commentObj
+    def _loop(self, done, timeout): #{{{
+        """Run event loop until done() or no request on map is left. When
+        timeout seconds have passed, the requests on map not done fail
+        with socket.timeout.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while not done() and self._busy():
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                self._abort(socket.timeout('timed out'))
+                return
+            interval = deadline is not None and deadline - now or 30.0
+            for channel in self.map.values():
+                if isinstance(channel, _AsyncConnection):
+                    left = channel.expire(now)
+                    if left is not None:
+                        interval = min(interval, left)
+            asyncore.loop(interval, True, self.map, 1)
     #}}}
 
-    def _filterCategory(self, cat): #{{{
-        """Transform category struct in WordPressCategory instance
+    def _abort(self, error): #{{{
+        """Fail all requests queued or in flight on map with error
+        """
+        hosts = set([self._hostRequests])
+        for channel in self.map.values():
+            if isinstance(channel, _AsyncConnection):
+                hosts.add(channel._hostRequests)
+        for hostRequests in hosts:
+            hostRequests.abort(error)
+    #}}}
+
+    def run(self, timeout=None): #{{{
+        """Run event loop until all requests on map are done, at most
+        timeout seconds: then the requests left fail with socket.timeout
         """
-        catObj = WordPressCategory()
-        if 'categoryId' in cat:
-            catObj.id           = int(cat['categoryId'])
-            catObj.name         = cat['categoryName'] 
-            catObj.description  = cat['categoryDescription'] 
-            catObj.htmlUrl      = cat['htmlUrl'] 
-            catObj.rssUrl       = cat['rssUrl'] 
-            catObj.parentId     = int(cat['parentId'])
+        self._loop(lambda: False, timeout)
+    #}}}
 
-        if 'category_id' in cat:
-            catObj.id           = int(cat['category_id'])
-            catObj.name         = cat['category_name'] 
+    def wait(self, future, timeout=None): #{{{
+        """Run event loop until future is done, return its result. After
+        timeout seconds the requests on map not done fail with
+        socket.timeout, and so does future.
+        """
+        self._loop(future.done, timeout)
+        if timeout is not None and not future.done():
+            raise socket.timeout('timed out')
+        return future.result()
+    #}}}
 
-        if cat.has_key('isPrimary'):
-            catObj.isPrimary    = cat['isPrimary']
-        return catObj
+    def close(self): #{{{
+        """Close idle connections to the host
+        """
+        self._hostRequests.close()
     #}}}
 
     def selectBlog(self, blogId): #{{{
         self.blogId = blogId
+        self._resetTemplates()
+        self.categories = None
     #}}}
 
-    def supportedMethods(self): #{{{
+    def supportedMethods(self, forceUpdate=False): #{{{
         """Get supported methods list
         """
-        return self._server.mt.supportedMethods()
+        if self.methods != None and forceUpdate == False:
+            return WordPressFuture.completed(self.methods)
+        def cache(methods):
+            self.methods = methods
+            return methods
+        return self._call('mt.supportedMethods').then(cache)
     #}}}
 
     def getLastPost(self): #{{{
         """Get last post
         """
-        return tuple(self.getRecentPosts(1))[0]
+        return self.getRecentPosts(1).then(lambda posts: posts[0])
     #}}}
 
     def getRecentPosts(self, numPosts=5): #{{{
-        """Get recent posts
+        """Get recent posts list
         """
-        try:
-            posts = self._server.metaWeblog.getRecentPosts(self.blogId, self.user, 
-                                                    self.password, numPosts)
-            for post in posts:
-                yield self._filterPost(post)    
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('metaWeblog.getRecentPosts', self.blogId, self.user,
+            self.password, numPosts).then(lambda posts: map(self._filterPost, posts))
     #}}}
 
     def getPost(self, postId): #{{{
         """Get post item
         """
-        try:
-            return self._filterPost(self._server.metaWeblog.getPost(str(postId), self.user, self.password))
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('metaWeblog.getPost', str(postId), self.user,
+            self.password).then(self._filterPost)
     #}}}
 
     def getUserInfo(self): #{{{
         """Get user info
         """
-        try:
-            userinfo = self._server.blogger.getUserInfo('', self.user, self.password)
-            userObj = WordPressUser()
-            userObj.id = userinfo['userid']
-            userObj.firstName = userinfo['firstname']
-            userObj.lastName = userinfo['lastname']
-            userObj.nickname = userinfo['nickname']
-            #userObj.email = userinfo['email']
-            return userObj
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('blogger.getUserInfo', '', self.user,
+            self.password).then(self._filterUser)
     #}}}
 
     def getUsersBlogs(self): #{{{
-        """Get blog's users info
+        """Get blog's users info list
         """
-        try:
-            blogs = self._server.blogger.getUsersBlogs('', self.user, self.password)
-            for blog in blogs:
-                blogObj = WordPressBlog()
-                blogObj.id = blog['blogid']
-                blogObj.name = blog['blogName']
-                blogObj.isAdmin = blog['isAdmin']
-                blogObj.url = blog['url']
-                yield blogObj
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('blogger.getUsersBlogs', '', self.user,
+            self.password).then(lambda blogs: map(self._filterBlog, blogs))
     #}}}
 
     def newCategory(self, category): #{{{
         """Add new category
         """
-        blogContent = {
-            'name': category.name,
-            'parent_id': category.parentId,
-            'slug': category.slug,
-            'description': category.description,
-        }
-        idNewCat = int(self._server.wp.newCategory(self.blogId, self.user, self.password, blogContent))
-        return idNewCat
+        return self._call('wp.newCategory', self.blogId, self.user,
+            self.password, self._newCategoryContent(category)).then(int)
     #}}}
 
     def newPost(self, post, publish): #{{{
         """Insert new post
         """
-        blogContent = {
-            'title' : post.title,
-            'description' : post.description,
-            'mt_text_more' : post.textMore,
-            'mt_keywords': post.keywords,
-        }
-        blogContent['dateCreated'] = xmlrpclib.DateTime(post.date) 
-        # add categories
-        i = 0
-        categories = []
-        for cat in post.categories:
-            if i == 0:
-                categories.append({'categoryId' : cat, 'isPrimary' : 1})
-            else:
-                categories.append({'categoryId' : cat, 'isPrimary' : 0})
-            i += 1
-        
-        # insert new post
-        idNewPost = int(self._server.metaWeblog.newPost(self.blogId, self.user, self.password, blogContent, 0))
-        
-        # set categories for new post
-        self.setPostCategories(idNewPost, categories)
-        
-        # publish post if publish set at True 
-        if publish:
-            self.publishPost(idNewPost)
-            
-        return idNewPost
+        categories = self._postCategories(post)
+        def finish(idNewPost):
+            idNewPost = int(idNewPost)
+            future = self.setPostCategories(idNewPost, categories)
+            if publish:
+                future = future.then(lambda r: self.publishPost(idNewPost))
+            return future.then(lambda r: idNewPost)
+        return self._call('metaWeblog.newPost', self.blogId, self.user,
+            self.password, self._newPostContent(post), 0).then(finish)
     #}}}
-    
+
     def getPostCategories(self, postId): #{{{
-        """Get post's categories
+        """Get post's categories list
         """
-        try:
-            categories = self._server.mt.getPostCategories(postId, self.user, 
-                                                    self.password)
-            for cat in categories:
-                yield self._filterCategory(cat) 
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('mt.getPostCategories', postId, self.user,
+            self.password).then(lambda cats: map(self._filterCategory, cats))
     #}}}
-    
+
     def setPostCategories(self, postId, categories): #{{{
         """Set post's categories
         """
-        self._server.mt.setPostCategories(postId, self.user, self.password, categories)
+        return self._call('mt.setPostCategories', postId, self.user,
+            self.password, categories)
     #}}}
-    
+
     def editPost(self, postId, post, publish): #{{{
-        """Edit post
+        """Edit post, sending only the changes of a post loaded from the
+        blog as WordPressClient.editPost does
         """
-        blogcontent = {
-            'title' : post.title,
-            'description' : post.description,
-            'permaLink' : post.permaLink,
-            'mt_allow_pings' : post.allowPings,
-            'mt_text_more' : post.textMore,
-            'mt_excerpt' : post.excerpt
-        }
-        
-        if post.date:
-            blogcontent['dateCreated'] = xmlrpclib.DateTime(post.date) 
-        
-        # add categories
-        i = 0
-        categories = []
-        for cat in post.categories:
-            if i == 0:
-                categories.append({'categoryId' : cat, 'isPrimary' : 1})
-            else:
-                categories.append({'categoryId' : cat, 'isPrimary' : 0})
-            i += 1               
-        
-        result = self._server.metaWeblog.editPost(postId, self.user, self.password,
-                                              blogcontent, 0)
-        
-        if result == 0:
-            raise WordPressException('Post edit failed')
-            
-        # set categories for new post
-        self.setPostCategories(postId, categories)
-        
-        # publish new post
-        if publish:
-            self.publishPost(postId)
+        content, categories, flag, publish = self._postChanges(post, publish)
+        def finish(result):
+            if result == 0:
+                raise WordPressException('Post edit failed')
+            future = WordPressFuture.completed(result)
+            if categories is not None:
+                future = self.setPostCategories(postId, categories)
+            if publish:
+                future = future.then(lambda r: self.publishPost(postId))
+            return future
+        def edited(result):
+            self._postEdited(post, content, categories, flag, publish)
+            return result
+        if content is None:
+            future = finish(True)
+        else:
+            future = self._call('metaWeblog.editPost', postId, self.user,
+                self.password, content, flag).then(finish)
+        return future.then(edited)
     #}}}
-    
+
     def deletePost(self, postId): #{{{
         """Delete post
         """
-        try:
-            return self._server.blogger.deletePost('', postId, self.user, 
-                                             self.password)
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('blogger.deletePost', '', postId, self.user,
+            self.password)
     #}}}
-    
+
     def deleteCategory(self, categoryId): #{{{
         """Delete category
         """
-        try:
-            return self._server.wp.deleteCategory(self.blogId, self.user,
-            categoryId, self.password)
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        def forget(result):
+            if self.categories is not None:
+                self.categories = [category for category in self.categories
+                                   if category.id != int(categoryId)]
+            return result
+        return self._call('wp.deleteCategory', self.blogId, self.user,
+            self.password, categoryId).then(forget)
     #}}}
 
     def getCategoryList(self, forceUpdate=False): #{{{
         """Get blog's categories list
         """
-        try:
-            if self.categories == None or forceUpdate == True:
-                self.categories = []
-                categories = self._server.wp.getCategories(self.blogId, 
-                    self.user, self.password)               
-                for cat in categories:
-                    self.categories.append(self._filterCategory(cat))   
+        if self.categories != None and forceUpdate == False:
+            return WordPressFuture.completed(self.categories)
+        def cache(categories):
+            self.categories = map(self._filterCategory, categories)
             return self.categories
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('wp.getCategories', self.blogId, self.user,
+            self.password).then(cache)
     #}}}
 
     def getCategoryIdFromName(self, name): #{{{
         """Get category id from category name
         """
-        for c in self.getCategoryList():
-            if c.name == name:
-                return c.id
+        def find(categories):
+            for c in categories:
+                if c.name == name:
+                    return c.id
+        return self.getCategoryList().then(find)
     #}}}
-    
+
     def getTrackbackPings(self, postId): #{{{
         """Get trackback pings of post
         """
-        try:
-            return self._server.mt.getTrackbackPings(postId)
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('mt.getTrackbackPings', postId)
     #}}}
-    
+
     def publishPost(self, postId): #{{{
         """Publish post
         """
-        try:
-            return (self._server.mt.publishPost(postId, self.user, self.password) == 1)
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('mt.publishPost', postId, self.user,
+            self.password).then(lambda result: result == 1)
     #}}}
-    
+
     def getPingbacks(self, postUrl): #{{{
         """Get pingbacks of post
         """
-        try:
-            return self._server.pingback.extensions.getPingbacks(postUrl)
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('pingback.extensions.getPingbacks', postUrl)
     #}}}
-    
+
     def getTags(self): #{{{
-        """Get Blog tags
+        """Get Blog tags list
         """
-        try:
-            tags = self._server.wp.getTags(self.blogId, self.user,
-            self.password)
-
-            for tag in tags:
-                yield self._filterTag(tag) 
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('wp.getTags', self.blogId, self.user,
+            self.password).then(lambda tags: map(self._filterTag, tags))
     #}}}
 
-    def newMediaObject(self, mediaFileName): #{{{
+    def newMediaObject(self, mediaFile, name=None, progress=None): #{{{
         """Add new media object (image, movie, etc...)
+
+        mediaFile is a file name or a file-like object, it is read and
+        sent chunk by chunk as by WordPressClient.newMediaObject.
+        progress(sentBytes, totalBytes) is called after each chunk.
         """
+        if isinstance(mediaFile, basestring):
+            f = file(mediaFile, 'rb')
+        else:
+            f = mediaFile
+        if name is None:
+            name = os.path.basename(getattr(f, 'name', 'media'))
         try:
-            f = file(mediaFileName, 'rb')
-            mediaBits = f.read()
-            f.close()
-            
-            mediaStruct = {
-                'name' : os.path.basename(mediaFileName),
-                'bits' : xmlrpclib.Binary(mediaBits)
-            }
-            
-            result = self._server.metaWeblog.newMediaObject(self.blogId, 
-                                    self.user, self.password, mediaStruct)
-            return result['url']
-            
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+            body, contentLength = self._mediaRequest(f, name, progress)
+            future = self._request(body, contentLength)
+        except:
+            if f is not mediaFile:
+                f.close()
+            raise
+        if f is not mediaFile:
+            future.addCallback(lambda future: f.close())
+        return future.then(lambda result: result['url'])
     #}}}
-    
+
     def suggestCategories(self, string, maxResults=5): #{{{
         """Suggest Categories
         """
-        try:
-            cats = self._server.wp.suggestCategories(self.blogId, self.user,
-            self.password, string, maxResults)
-
-            for cat in cats:
-                yield self._filterCategory(cat)
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('wp.suggestCategories', self.blogId, self.user,
+            self.password, string, maxResults).then(
+            lambda cats: map(self._filterCategory, cats))
     #}}}
 
     def getComment(self, commentId): #{{{
         """Get comment.
         """
-        try:
-            return self._filterComment(self._server.wp.getComment(self.blogId,
-            self.user, self.password, commentId))
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+        return self._call('wp.getComment', self.blogId, self.user,
+            self.password, commentId).then(self._filterComment)
     #}}}
 
     def getComments(self, status='approve', post_id=0, number=10, offset=0): #{{{
-        """Get comments.
+        """Get comments list.
         """
-        struct = dict()
-        struct['status']    = status
-        struct['post_id']   = post_id
-        struct['number']    = number
-        struct['offset']    = offset 
-        try:
-            comments = self._server.wp.getComments(self.blogId, self.user,
-            self.password, struct)
+        struct = self._commentsFilter(status, post_id, number, offset)
+        return self._call('wp.getComments', self.blogId, self.user,
+            self.password, struct).then(
+            lambda comments: map(self._filterComment, comments))
+    #}}}
 
-            for comment in comments:
-                yield self._filterComment(comment)
-        except xmlrpclib.Fault, fault:
-            raise WordPressException(fault)
+    def _fetchPages(self, fetch, pageSize, callback): #{{{
+        """Request pages with fetch(offset, number) one after another
+        until a short page, passing the items of each to callback(items).
+        Get future of the number of items.
+        """
+        result = WordPressFuture()
+        def received(future, offset):
+            if future.exception() is not None:
+                result.setException(future.exception())
+                return
+            items = future.result()
+            try:
+                if items:
+                    callback(items)
+            except Exception, e:
+                result.setException(e)
+                return
+            if len(items) < pageSize:
+                result.setResult(offset + len(items))
+            else:
+                request(offset + pageSize)
+        def request(offset):
+            fetch(offset, pageSize).addCallback(
+                lambda future: received(future, offset))
+        request(0)
+        return result
     #}}}
 
+    def iterPosts(self, callback, pageSize=100): #{{{
+        """Fetch all blog posts, pageSize posts per request, and pass the
+        WordPressPost items of each page to callback(posts) as it arrives.
+        Get future of the number of posts. As WordPressClient.iterPosts,
+        servers without wp.getPosts page through metaWeblog.getRecentPosts
+        re-fetching previous pages.
+        """
+        def pages(methods):
+            def fetch(offset, number):
+                if 'wp.getPosts' in methods:
+                    return self._call('wp.getPosts', self.blogId, self.user,
+                        self.password, {'post_type' : 'post',
+                        'number' : number, 'offset' : offset}).then(
+                        lambda posts: map(self._filterWpPost, posts))
+                return self._call('metaWeblog.getRecentPosts', self.blogId,
+                    self.user, self.password, offset + number).then(
+                    lambda posts: map(self._filterPost, posts[offset:]))
+            return self._fetchPages(fetch, pageSize, callback)
+        return self.supportedMethods().then(pages)
+    #}}}
 
+    def iterComments(self, callback, status='approve', post_id=0,
+                     pageSize=100): #{{{
+        """Fetch all comments, pageSize comments per request, and pass the
+        WordPressComment items of each page to callback(comments) as it
+        arrives. Get future of the number of comments.
+        """
+        def fetch(offset, number):
+            return self.getComments(status, post_id, number, offset)
+        return self._fetchPages(fetch, pageSize, callback)
+    #}}}
 #}}}
-